@@ -0,0 +1,170 @@
+import heapq
+import threading
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice, zip_longest
+import cash_on_hand_api as db_api
+
+#Most accounts queried at the same time. SQLite lets other threads run while it executes a query,
+#so a thread per account is enough to read several files at once.
+MAX_WORKERS = 8
+
+#An expense together with the name of the account it belongs to.
+AccountExpense = tuple[str, db_api.Expense]
+
+#Where paging across accounts got to: the last expense each account has returned so far. Adding each
+#page to it, as in after.update(page), keeps it up to date.
+AccountCursor = dict[str, db_api.Expense]
+
+def _sort_key(order_by: str) -> Callable[[AccountExpense], tuple]:
+    '''Key giving the order of query_expenses() for expenses of several accounts. Each account's own
+    results already break ties by id, so the key leaves it out.'''
+    if order_by == 'date':
+        return lambda item: (db_api.date_to_day(item[1].date),)
+    if order_by == 'amount':
+        return lambda item: (db_api.amount_to_cents(item[1].amount),)
+    if order_by == 'category':
+        return lambda item: (item[1].category, db_api.date_to_day(item[1].date))
+    raise ValueError(f'Cannot sort expenses by {order_by!r}')
+
+class Accounts:
+    '''Named accounts, such as wallets or bank accounts, each kept in its own database file and
+    opened as a Database. Reports across accounts run the same call on every account in parallel
+    and merge the results.'''
+
+    def __init__(self, paths: dict[str, str] | None = None, max_workers: int = MAX_WORKERS) -> None:
+        self._databases: dict[str, db_api.Database] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='Accounts')
+        for name, path in (paths or {}).items():
+            self.add(name, path)
+
+    def add(self, name: str, path: str, default_categories: list[list[str]] | None = None) -> db_api.Database:
+        '''Open the database file at path as the account called name, creating it with
+        default_categories if it does not exist yet.'''
+        with self._lock:
+            if name in self._databases:
+                raise ValueError(f'Account {name!r} already exists')
+            database = db_api.Database(path)
+            database.init_db(default_categories or [])
+            self._databases[name] = database
+        return database
+
+    def remove(self, name: str) -> None:
+        '''Close the account called name. Its file is left as it is.'''
+        with self._lock:
+            database = self._databases.pop(name)
+        database.close()
+
+    def names(self) -> list[str]:
+        with self._lock:
+            return list(self._databases)
+
+    def __getitem__(self, name: str) -> db_api.Database:
+        with self._lock:
+            return self._databases[name]
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._databases
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._databases)
+
+    def call(self, function: Callable, *args, accounts: Iterable[str] | None = None, **kwargs) -> dict[str, object]:
+        '''Call a module function that takes a connection (see Database.call) on every account, or on
+        the named ones, in parallel. Returns the results by account name, in account order. If any
+        call raises, the first exception is raised once all of them have finished.'''
+        return self._call_each(function, lambda name: args, accounts, kwargs)
+
+    def _call_each(self,
+                   function: Callable,
+                   arguments: Callable[[str], tuple],
+                   accounts: Iterable[str] | None,
+                   kwargs: dict) -> dict[str, object]:
+        '''Like call(), with the positional arguments given by arguments(name) for each account.'''
+        with self._lock:
+            databases = [(name, self._databases[name]) for name in (accounts if accounts != None else self._databases)]
+        futures = [(name, self._pool.submit(database.call, function, *arguments(name), **kwargs)) for name, database in databases]
+        results = {}
+        error = None
+        for name, future in futures:
+            try:
+                results[name] = future.result()
+            except Exception as exception:
+                error = error or exception
+        if error != None:
+            raise error
+        return results
+
+    def get_cash_amount(self) -> float:
+        '''The cash on hand of all accounts together.'''
+        return round(sum(self.call(db_api.get_cash_amount).values()), 2)
+
+    def get_month_total(self, year: int, month: int) -> float:
+        return round(sum(self.call(db_api.get_month_total, year, month).values()), 2)
+
+    def get_running_total(self, date: str) -> float:
+        return round(sum(self.call(db_api.get_running_total, date).values()), 2)
+
+    def get_category_totals(self, year: int, month: int) -> dict[str, float]:
+        '''Total spent in each category during the given month, with categories of the same name in
+        different accounts added together.'''
+        cents: dict[str, int] = {}
+        for totals in self.call(db_api.get_category_totals, year, month).values():
+            for category, amount in totals.items():
+                cents[category] = cents.get(category, 0) + db_api.amount_to_cents(amount)
+        return {category: cents[category] / 100 for category in sorted(cents)}
+
+    def query_expenses(self,
+                       order_by: str = 'date',
+                       desc: bool = False,
+                       limit: int | None = None,
+                       after: AccountCursor | None = None) -> list[AccountExpense]:
+        '''The first limit expenses of all accounts sorted like db_api.query_expenses(), as
+        (account, expense) pairs. Each account reads its own first limit expenses in parallel, and
+        the sorted lists are merged.
+        To get the next page, pass the last expense of each account so far as after. Each account
+        then continues from its own last expense, so a page costs the same however deep it is.'''
+        key = _sort_key(order_by)
+        after = after or {}
+        pages = self._call_each(lambda _cur, last: list(db_api.query_expenses(_cur, order_by, desc, limit, last)),
+                                lambda name: (after.get(name),), None, {})
+        merged = heapq.merge(*([(name, expense) for expense in page] for name, page in pages.items()), key=key, reverse=desc)
+        return list(islice(merged, limit))
+
+    def search_expenses(self,
+                        text: str,
+                        start: str | None = None,
+                        end: str | None = None,
+                        min_amount: float | None = None,
+                        max_amount: float | None = None,
+                        order_by: str = 'rank',
+                        limit: int = 50,
+                        offset: int = 0,
+                        after: AccountCursor | None = None) -> list[AccountExpense]:
+        '''Search every account like db_api.search_expenses(), as (account, expense) pairs. With
+        order_by='date' the results are merged newest first. Relevance is only comparable within one
+        file, so with order_by='rank' the accounts' best matches take turns, starting from the first
+        account on every page.
+        Deep pages are much cheaper with after, the last expense of each account so far, than with an
+        offset, for which every account reads all the results up to the end of the page.'''
+        after = after or {}
+        pages = self._call_each(db_api.search_expenses,
+                                lambda name: (text, start, end, min_amount, max_amount, order_by, limit + offset, 0, after.get(name)),
+                                None, {})
+        tagged = [[(name, expense) for expense in page] for name, page in pages.items()]
+        if order_by == 'date':
+            merged = heapq.merge(*tagged, key=_sort_key('date'), reverse=True)
+        else:
+            merged = (item for item in chain.from_iterable(zip_longest(*tagged)) if item != None)
+        return list(islice(merged, offset, offset + limit))
+
+    def close(self) -> None:
+        '''Close every account and stop the worker threads.'''
+        self._pool.shutdown()
+        with self._lock:
+            for database in self._databases.values():
+                database.close()
+            self._databases.clear()
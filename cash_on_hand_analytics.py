@@ -0,0 +1,252 @@
+import datetime
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from functools import wraps
+from itertools import accumulate, groupby
+import cash_on_hand_api as db_api
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#Rows fetched from the database at a time when loading columns.
+COLUMN_CHUNK_SIZE = 10000
+
+#Number of results kept by the cache, least recently used first out.
+CACHE_SIZE = 32
+
+PERIODS = ['day', 'week', 'month', 'year']
+
+#Ordinal of 01/01/1970, where month numbers used as bucket keys start.
+_EPOCH_DAY = datetime.date(1970, 1, 1).toordinal()
+
+@dataclass
+class Columns:
+    '''Expenses as parallel columns sorted by day: array('q') columns, or NumPy int64 arrays when
+    NumPy is installed. Uncategorized expenses have category id 0.'''
+    days: Sequence[int]
+    cents: Sequence[int]
+    category_ids: Sequence[int]
+    #Category names by id, including '' for 0.
+    names: dict[int, str]
+
+@dataclass
+class PeriodSummary:
+    #First day of the period, as MM/DD/YYYY.
+    start: str
+    total: float
+    count: int
+    mean: float
+    median: float
+    p90: float
+    by_category: dict[str, float]
+    #Fraction of the period's total spent in each category.
+    shares: dict[str, float]
+
+@dataclass
+class YearOverYear:
+    year: int
+    month: int
+    total: float
+    previous_total: float
+    #Fractional change from the same month a year earlier, or None if nothing was spent then.
+    change: float | None
+
+_cache: OrderedDict = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cached(function: Callable) -> Callable:
+    '''Cache the results of an analytics function by its arguments and the data version of the
+    database, so it is only recomputed after expenses or categories change. Cached results are
+    shared between callers and must not be modified. Inside a transaction the data version may be
+    rolled back and reached again by other changes, so results are neither cached nor looked up.'''
+    @wraps(function)
+    def wrapper(_cur: sqlite3.Cursor, *args, **kwargs):
+        if _cur.connection.in_transaction:
+            return function(_cur, *args, **kwargs)
+        key = (function.__name__, db_api.get_data_version(_cur), args, tuple(sorted(kwargs.items())))
+        with _cache_lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                return _cache[key]
+        result = function(_cur, *args, **kwargs)
+        with _cache_lock:
+            _cache[key] = result
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+        return result
+    return wrapper
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+def _day_range(start: str | None, end: str | None) -> tuple[int, int]:
+    '''Convert optional MM/DD/YYYY bounds to the inclusive range of stored days they cover.'''
+    bounds = []
+    for date, default in [(start, 1), (end, datetime.date.max.toordinal())]:
+        day = default if date == None else db_api.date_to_day(date)
+        if day is None:
+            raise ValueError(f'Invalid date: {date!r}')
+        bounds.append(day)
+    return bounds[0], bounds[1]
+
+@_cached
+def load_columns(_cur: sqlite3.Cursor, start: str | None = None, end: str | None = None) -> Columns:
+    '''Read the day, amount and category of every expense from start to end (MM/DD/YYYY, inclusive,
+    either may be None) into columns, COLUMN_CHUNK_SIZE rows at a time.'''
+    first, last = _day_range(start, end)
+    days, cents, category_ids = array('q'), array('q'), array('q')
+    rows = _cur.connection.execute('''SELECT day, cents, IFNULL(category_id, 0) FROM expenses
+                                      WHERE day BETWEEN ? AND ? ORDER BY day''', [first, last])
+    while chunk := rows.fetchmany(COLUMN_CHUNK_SIZE):
+        chunk_days, chunk_cents, chunk_categories = zip(*chunk)
+        days.extend(chunk_days)
+        cents.extend(chunk_cents)
+        category_ids.extend(chunk_categories)
+    names = dict(_cur.execute('SELECT id, name FROM categories').fetchall())
+    names[0] = ''
+    if numpy != None:
+        return Columns(*(numpy.frombuffer(column, dtype=numpy.int64) for column in [days, cents, category_ids]), names)
+    return Columns(days, cents, category_ids, names)
+
+def _month_of_day(day: int) -> int:
+    date = datetime.date.fromordinal(day)
+    return (date.year - 1970) * 12 + date.month - 1
+
+def _bucket_keys(days: Sequence[int], period: str) -> Sequence[int]:
+    '''Number the period each day falls in: the day itself, the week (starting on Monday), or the
+    month or year counted from 1970. Keys of sorted days come out sorted.'''
+    if period == 'day':
+        return days
+    if period == 'week':
+        return (days - 1) // 7 if numpy != None else [(day - 1) // 7 for day in days]
+    if period not in ['month', 'year']:
+        raise ValueError(f'Cannot group expenses by {period!r}')
+    if numpy != None:
+        months = (days - _EPOCH_DAY).astype('datetime64[D]').astype('datetime64[M]').astype(numpy.int64)
+    else:
+        #Days repeat a lot, so each distinct day is converted once.
+        month_of = {day: _month_of_day(day) for day in dict.fromkeys(days)}
+        months = [month_of[day] for day in days]
+    if period == 'year':
+        return months // 12 if numpy != None else [month // 12 for month in months]
+    return months
+
+def _bucket_start(key: int, period: str) -> str:
+    if period == 'day':
+        return db_api.day_to_date(key)
+    if period == 'week':
+        return db_api.day_to_date(key * 7 + 1)
+    if period == 'year':
+        return f'01/01/{1970 + key:04d}'
+    return f'{key % 12 + 1:02d}/01/{1970 + key // 12:04d}'
+
+def _percentile(ordered: Sequence[int], fraction: float) -> float:
+    '''Percentile of sorted values, interpolating between the two nearest ones like numpy.percentile.'''
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def _bucket_bounds(keys: Sequence[int]) -> list[tuple[int, int, int]]:
+    '''Split sorted keys into runs, returned as (key, start, stop) index ranges.'''
+    if numpy != None:
+        starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(keys)) + 1)) if len(keys) else numpy.array([], dtype=numpy.int64)
+        stops = numpy.append(starts[1:], len(keys))
+        return [(int(keys[start]), int(start), int(stop)) for start, stop in zip(starts, stops)]
+    bounds = []
+    position = 0
+    for key, run in groupby(keys):
+        count = sum(1 for _ in run)
+        bounds.append((key, position, position + count))
+        position += count
+    return bounds
+
+def _category_sums(columns: Columns, bounds: list[tuple[int, int, int]]) -> list[dict[int, int]]:
+    '''Total cents of each category in each bucket.'''
+    if numpy != None and bounds:
+        ids, categories = numpy.unique(columns.category_ids, return_inverse=True)
+        counts = [stop - start for _, start, stop in bounds]
+        buckets = numpy.repeat(numpy.arange(len(bounds)), counts)
+        cells = buckets * len(ids) + categories
+        sums = numpy.bincount(cells, weights=columns.cents, minlength=len(bounds) * len(ids)).reshape(len(bounds), len(ids))
+        #Categories are listed by whether they have expenses in the bucket, not by a non-zero sum, so
+        #that $0.00 expenses are kept like the pure Python version keeps them.
+        counts = numpy.bincount(cells, minlength=len(bounds) * len(ids)).reshape(len(bounds), len(ids))
+        return [{int(ids[column]): int(row[column]) for column in numpy.flatnonzero(present)} for row, present in zip(sums, counts)]
+    result = []
+    for _, start, stop in bounds:
+        totals = {}
+        for category_id, cents in zip(columns.category_ids[start:stop], columns.cents[start:stop]):
+            totals[category_id] = totals.get(category_id, 0) + cents
+        result.append(totals)
+    return result
+
+@_cached
+def spending_by_period(_cur: sqlite3.Cursor,
+                       period: str = 'month',
+                       start: str | None = None,
+                       end: str | None = None) -> list[PeriodSummary]:
+    '''Summarize spending in each 'day', 'week', 'month' or 'year' from start to end that has any
+    expenses: the total, number of expenses, mean, median and 90th percentile amount, and the total
+    and share of each category.'''
+    columns = load_columns(_cur, start, end)
+    bounds = _bucket_bounds(_bucket_keys(columns.days, period))
+    summaries = []
+    for (key, start_index, stop_index), categories in zip(bounds, _category_sums(columns, bounds)):
+        if numpy != None:
+            amounts = numpy.sort(columns.cents[start_index:stop_index])
+            total = int(amounts.sum())
+        else:
+            amounts = sorted(columns.cents[start_index:stop_index])
+            total = sum(amounts)
+        count = stop_index - start_index
+        named = {columns.names.get(category_id, ''): cents for category_id, cents in sorted(categories.items())}
+        summaries.append(PeriodSummary(_bucket_start(key, period), total / 100, count, total / count / 100,
+                                       float(_percentile(amounts, 0.5)) / 100, float(_percentile(amounts, 0.9)) / 100,
+                                       {name: cents / 100 for name, cents in named.items()},
+                                       {name: cents / total if total else 0.0 for name, cents in named.items()}))
+    return summaries
+
+@_cached
+def rolling_totals(_cur: sqlite3.Cursor,
+                   window: int = 30,
+                   start: str | None = None,
+                   end: str | None = None) -> list[tuple[str, float]]:
+    '''Total spent in the window days ending on each day from the first to the last expense between
+    start and end, as (MM/DD/YYYY, amount) pairs. Computed from running sums, so the cost does not
+    depend on the window size.'''
+    columns = load_columns(_cur, start, end)
+    if not len(columns.days):
+        return []
+    first = int(columns.days[0])
+    if numpy != None:
+        daily = numpy.bincount(columns.days - first, weights=columns.cents)
+        running = numpy.concatenate(([0], numpy.cumsum(daily)))
+        ends = numpy.arange(1, len(daily) + 1)
+        totals = running[ends] - running[numpy.maximum(0, ends - window)]
+    else:
+        daily = [0] * (int(columns.days[-1]) - first + 1)
+        for day, cents in zip(columns.days, columns.cents):
+            daily[day - first] += cents
+        running = [0, *accumulate(daily)]
+        totals = [running[index + 1] - running[max(0, index + 1 - window)] for index in range(len(daily))]
+    return [(db_api.day_to_date(first + index), round(float(cents)) / 100) for index, cents in enumerate(totals)]
+
+@_cached
+def year_over_year(_cur: sqlite3.Cursor) -> list[YearOverYear]:
+    '''Compare each month's total with the same month of the year before, oldest month first.
+    Read from the month_totals summary table, so the cost depends on the number of months.'''
+    totals = dict(_cur.execute('SELECT month, cents FROM month_totals ORDER BY month').fetchall())
+    result = []
+    for month, cents in totals.items():
+        previous = totals.get(month - 100, 0)
+        result.append(YearOverYear(month // 100, month % 100, cents / 100, previous / 100,
+                                   (cents - previous) / previous if previous else None))
+    return result
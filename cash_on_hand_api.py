@@ -1,14 +1,287 @@
 import sqlite3
+import calendar
 import datetime
-from dataclasses import dataclass
+import hashlib
+import inspect
+import json
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from itertools import compress, groupby, islice
+from operator import attrgetter, itemgetter
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Expense:
     category: str
     date: str
     amount: float
     title: str = ''
     color: str = '#000000'
+    #ROWID of the expense when it was read from the database, -1 otherwise.
+    expense_id: int = field(default=-1, compare=False)
+
+class ExpenseBatch:
+    '''Many expenses stored column by column: arrays of ids, stored day numbers, cents and category
+    numbers, plus a list of titles in which repeated titles share one string. Categories are stored
+    once each, as (name, color) pairs numbered by their position in categories.
+    Takes a fraction of the memory of a list of Expense objects, and sorting, filtering and slicing
+    work on the columns without creating an Expense per row. Indexing or iterating a batch creates
+    Expense objects only for the rows that are read.'''
+    __slots__ = ('ids', 'days', 'cents', 'category_numbers', 'titles', 'categories')
+
+    def __init__(self, categories: list[tuple[str, str]] | None = None) -> None:
+        self.ids = array('q')
+        self.days = array('i')
+        self.cents = array('q')
+        self.category_numbers = array('i')
+        self.titles: list[str] = []
+        self.categories = categories if categories != None else []
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> 'ExpenseBatch':
+        '''Build a batch from (id, category, day, cents, title, color) rows.'''
+        batch = cls()
+        numbers: dict[tuple[str, str], int] = {}
+        titles: dict[str, str] = {}
+        for expense_id, category, day, cents, title, color in rows:
+            key = (category, color)
+            if key not in numbers:
+                numbers[key] = len(batch.categories)
+                batch.categories.append(key)
+            batch.ids.append(expense_id)
+            batch.days.append(day)
+            batch.cents.append(cents)
+            batch.category_numbers.append(numbers[key])
+            batch.titles.append(titles.setdefault(title, title))
+        return batch
+
+    @classmethod
+    def from_expenses(cls, expenses: Iterable[Expense]) -> 'ExpenseBatch':
+        '''Build a batch from Expense objects. Invalid dates are stored as day 1, like str_to_date.'''
+        return cls.from_rows((expense.expense_id, expense.category, date_to_day(expense.date) or 1,
+                              amount_to_cents(expense.amount), expense.title, expense.color) for expense in expenses)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _expense(self, index: int) -> Expense:
+        category, color = self.categories[self.category_numbers[index]]
+        return Expense(category, day_to_date(self.days[index]), self.cents[index] / 100, self.titles[index], color, self.ids[index])
+
+    def __getitem__(self, index: int | slice) -> 'Expense | ExpenseBatch':
+        if isinstance(index, slice):
+            batch = ExpenseBatch(self.categories)
+            batch.ids, batch.days, batch.cents = self.ids[index], self.days[index], self.cents[index]
+            batch.category_numbers, batch.titles = self.category_numbers[index], self.titles[index]
+            return batch
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('ExpenseBatch index out of range')
+        return self._expense(index)
+
+    def __iter__(self) -> Iterator[Expense]:
+        return map(self._expense, range(len(self)))
+
+    def take(self, indexes: Iterable[int]) -> 'ExpenseBatch':
+        '''Return a new batch with the rows at the given positions, in that order.'''
+        indexes = list(indexes)
+        #itemgetter() copies many values at once much faster than indexing them one by one,
+        #but returns a single value rather than a tuple when given one position.
+        pick = itemgetter(*indexes) if len(indexes) > 1 else lambda column: [column[index] for index in indexes]
+        batch = ExpenseBatch(self.categories)
+        batch.ids = array('q', pick(self.ids))
+        batch.days = array('i', pick(self.days))
+        batch.cents = array('q', pick(self.cents))
+        batch.category_numbers = array('i', pick(self.category_numbers))
+        batch.titles = list(pick(self.titles))
+        return batch
+
+    def sorted(self, by: str = 'date', desc: bool = False) -> 'ExpenseBatch':
+        '''Return the rows sorted by 'date', 'amount' or 'category' name. Like the sort helpers, rows
+        that sort the same keep their order.'''
+        if by == 'date':
+            key = self.days.__getitem__
+        elif by == 'amount':
+            key = self.cents.__getitem__
+        elif by == 'category':
+            names = [name for name, _ in self.categories]
+            numbers = self.category_numbers
+            key = lambda index: names[numbers[index]]
+        else:
+            raise ValueError(f'Cannot sort expenses by {by!r}')
+        return self.take(sorted(range(len(self)), key=key, reverse=desc))
+
+    def filter(self,
+               start: str | None = None,
+               end: str | None = None,
+               min_amount: float | None = None,
+               max_amount: float | None = None,
+               category: str | None = None) -> 'ExpenseBatch':
+        '''Return the rows dated from start to end (MM/DD/YYYY), costing from min_amount to max_amount
+        and in the given category, all inclusive and optional.'''
+        first, last = date_to_day(start) if start != None else None, date_to_day(end) if end != None else None
+        if (start != None and first is None) or (end != None and last is None):
+            raise ValueError(f'Invalid date range: {start!r} to {end!r}')
+        keep = [True] * len(self)
+        for column, low, high in [(self.days, first, last),
+                                  (self.cents, None if min_amount is None else amount_to_cents(min_amount),
+                                   None if max_amount is None else amount_to_cents(max_amount))]:
+            if low != None:
+                keep = [kept and value >= low for kept, value in zip(keep, column)]
+            if high != None:
+                keep = [kept and value <= high for kept, value in zip(keep, column)]
+        if category != None:
+            numbers = {number for number, (name, _) in enumerate(self.categories) if name == category}
+            keep = [kept and number in numbers for kept, number in zip(keep, self.category_numbers)]
+        return self.take(compress(range(len(self)), keep))
+
+#How often a recurring rule repeats, each interval times the unit.
+RECURRING_FREQUENCIES = ['daily', 'weekly', 'monthly', 'yearly']
+
+@dataclass
+class RecurringRule:
+    '''An expense that repeats every interval days, weeks, months or years from start (MM/DD/YYYY)
+    until end, or forever if end is None. Monthly and yearly rules that start on a day the month
+    does not have, like the 31st, fall on the last day of the month instead.'''
+    category: str
+    amount: float
+    title: str
+    frequency: str
+    start: str
+    interval: int = 1
+    end: str | None = None
+    color: str = '#000000'
+    #ROWID of the rule when it was read from the database, -1 otherwise.
+    rule_id: int = field(default=-1, compare=False)
+    #Date of the next expense still to be added, or None once the rule has ended.
+    next_date: str | None = field(default=None, compare=False)
+
+@dataclass(frozen=True, slots=True)
+class Change:
+    '''One row inserted, updated or deleted, as recorded in the change journal. old and new hold the
+    row's columns before and after the change; old is None for inserts and new for deletes.'''
+    seq: int
+    #The commit the change was part of, or None while it is uncommitted.
+    group: int | None
+    table: str
+    row_id: int
+    action: str
+    old: dict | None
+    new: dict | None
+
+@dataclass
+class BulkInsertResult:
+    inserted: int = 0
+    rejected: int = 0
+    duplicates: int = 0
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    invalidations: int = 0
+
+class LookupCache:
+    '''Committed copies of the categories table and the cash amount, shared by the connections to one
+    database so that looking them up does not query it every time. The API functions that change
+    categories or cash clear it.'''
+
+    def __init__(self) -> None:
+        #Category ids and colors by name.
+        self.categories: dict[str, tuple[int, str]] | None = None
+        self.cash: float | None = None
+        self.stats = CacheStats()
+        #Goes up on every clear(), so that a value read before a change is not stored after it.
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.categories = None
+            self.cash = None
+            self.generation += 1
+            self.stats.invalidations += 1
+
+class _Connection(sqlite3.Connection):
+    '''The connections made by sql_connect() and Database, which carry a LookupCache.'''
+    cache: LookupCache
+    #Set while changes to categories or cash are uncommitted, so the cache is cleared again once they
+    #are committed or rolled back.
+    cache_changed: bool = False
+    #data_version.lookup_version when the connection last checked it, and the time of that check.
+    lookup_version: int | None = None
+    lookup_checked: float = -math.inf
+    #Class of the cursors made by cursor() and execute(), which cash_on_hand_stats replaces to count
+    #the rows each statement changes.
+    cursor_class: type[sqlite3.Cursor] = sqlite3.Cursor
+
+    def cursor(self, factory: type[sqlite3.Cursor] | None = None) -> sqlite3.Cursor:
+        return super().cursor(factory or self.cursor_class)
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, parameters)
+
+    def executescript(self, script: str) -> sqlite3.Cursor:
+        return self.cursor().executescript(script)
+
+#Depth of the open unit_of_work() blocks for each connection, keyed by id(connection).
+_open_units: dict[int, int] = {}
+#Pragmas to run once the outermost unit_of_work() block of a connection has committed or rolled back,
+#for settings that SQLite ignores inside a transaction.
+_unit_pragmas: dict[int, list[str]] = {}
+
+#Connection settings applied by sql_connect() and Database. cache_size is in KiB when negative.
+#auto_vacuum only takes effect in new files, before the first table is created.
+CONNECTION_PRAGMAS: dict[str, str | int] = {'auto_vacuum': 'INCREMENTAL',
+                                            'journal_mode': 'WAL',
+                                            'synchronous': 'NORMAL',
+                                            'cache_size': -16000,
+                                            'mmap_size': 64 * 1024 * 1024,
+                                            'busy_timeout': 5000,
+                                            'foreign_keys': 'ON'}
+
+#Seconds between the checks a connection makes for changes to categories or cash committed by other
+#connections, such as another process. Changes made through the same connection or Database are
+#seen at once.
+LOOKUP_CHECK_SECONDS = 1.0
+
+#Number of rows copied per step when a migration has to rewrite a table.
+MIGRATION_BATCH_SIZE = 5000
+
+#Number of expenses moved per transaction by archive_expenses().
+ARCHIVE_BATCH_SIZE = 5000
+
+#Number of free pages returned to the file system per reclaim_space() call.
+RECLAIM_BATCH_PAGES = 2000
+
+#Number of most recent commits kept by compact_journal(), and so the number of steps undo() can go back.
+JOURNAL_KEEP_GROUPS = 1000
+
+#Columns recorded in the change journal for each journaled table. Rows are identified by ROWID.
+_JOURNALED_TABLES = {'expenses': ['category_id', 'day', 'cents', 'title', 'content_hash'],
+                     'categories': ['name', 'color'],
+                     'finance': ['cash'],
+                     'recurring_rules': ['category_id', 'cents', 'title', 'frequency', 'interval', 'start_day',
+                                         'end_day', 'occurrences', 'next_day']}
+
+#Query for expenses as (id, category, day, cents, title, color) rows.
+_SELECT_EXPENSES = 'SELECT id, category, day, cents, title, color FROM expense_details'
+#Query for the expenses that have a category, joined in category name order. CROSS JOIN makes SQLite
+#walk the categories by the index on their names and read each one's expenses from
+#expenses_by_category_date, already in (day, id) order. Left to itself it scans expenses and sorts.
+_SELECT_NAMED_EXPENSES = ('SELECT e.id, c.name, e.day, e.cents, e.title, c.color '
+                          'FROM categories c CROSS JOIN expenses e ON e.category_id=c.id')
 
 def get_today_as_str() -> str:
     '''Returns the current data as a string in MM/DD/YYYY format.'''
@@ -24,154 +297,1502 @@ def str_to_date(string: str) -> datetime.datetime:
         output = datetime.datetime(1, 1, 1)
     return output
 
+@lru_cache(maxsize=8192)
+def date_to_day(string: str) -> int | None:
+    '''Convert a MM/DD/YYYY string to the day number stored in the database (the proleptic
+    Gregorian ordinal, where 1/1/1 is day 1). Returns None if the string is not a valid date.'''
+    try:
+        month, day, year = string.split('/')
+        return datetime.date(int(year), int(month), int(day)).toordinal()
+    except (AttributeError, ValueError):
+        return None
+
+@lru_cache(maxsize=8192)
+def day_to_date(day: int) -> str:
+    '''Convert a stored day number back to a MM/DD/YYYY string.'''
+    date = datetime.date.fromordinal(day)
+    return f'{date.month:02d}/{date.day:02d}/{date.year:04d}'
+
+#Range of the amounts in cents that fit SQLite's 64-bit INTEGER column.
+MIN_CENTS, MAX_CENTS = -2**63, 2**63 - 1
+
+def amount_to_cents(amount: float) -> int:
+    '''Convert a dollar amount to the whole number of cents stored in the database.'''
+    return round(amount * 100)
+
+#Functions called with each new connection after it is configured, e.g. to install a trace callback.
+CONNECTION_HOOKS: list[Callable[[sqlite3.Connection], None]] = []
+
+def _configure_connection(_db: sqlite3.Connection) -> None:
+    '''Apply CONNECTION_PRAGMAS to a new connection. In-memory databases ignore the WAL setting.'''
+    for name, value in CONNECTION_PRAGMAS.items():
+        _db.execute(f'PRAGMA {name}={value}')
+    for hook in CONNECTION_HOOKS:
+        hook(_db)
+
 def sql_connect(data: str) -> tuple[sqlite3.Connection, sqlite3.Cursor]:
     '''Establish the connetion to the SQLite3 database.'''
-    _db = sqlite3.connect(data)
+    _db = sqlite3.connect(data, factory=_Connection)
+    _db.cache = LookupCache()
+    _configure_connection(_db)
     _cur = _db.cursor()
     return _db, _cur
 
-def init_db(_db: sqlite3.Connection, _cur: sqlite3.Cursor, default_categories: (list[list[str, str]])) -> None:
-    '''Check if the connected database already contains the required tables. If it does not, creates
-    them.'''
+def _close_change_group(_db: sqlite3.Connection, kind: str = 'change', schema: str = 'main') -> int | None:
+    '''Number the journal entries of the transaction in progress as one group of the given kind, just
+    before it is committed. A new change means the changes that were undone can no longer be redone.
+    schema names an attached database whose own journal should be closed instead. Returns the group,
+    or None if nothing was journaled.'''
+    if not _db.in_transaction or _db.execute(f'SELECT 1 FROM {schema}.change_journal WHERE group_id IS NULL LIMIT 1').fetchone() is None:
+        return None
+    group = _db.execute(f'INSERT INTO {schema}.change_groups(kind) VALUES(?)', [kind]).lastrowid
+    _db.execute(f'UPDATE {schema}.change_journal SET group_id=? WHERE group_id IS NULL', [group])
+    if kind in ['change', 'other']:
+        _db.execute(f"UPDATE {schema}.change_groups SET kind='other' WHERE kind='change' AND undone_by IS NOT NULL")
+    return group
+
+def _commit(_db: sqlite3.Connection) -> None:
+    '''Commit the current transaction, unless the connection is inside a unit_of_work() block,
+    in which case the commit is deferred until the block exits.'''
+    if id(_db) not in _open_units:
+        _close_change_group(_db)
+        _db.commit()
+        _settle_cache(_db)
+
+def _rollback(_db: sqlite3.Connection) -> None:
+    '''Roll back the current transaction after an error, unless the connection is inside a
+    unit_of_work() block, which rolls back when the error reaches it. Otherwise the rows written
+    before the error would be saved by the next commit.'''
+    if id(_db) not in _open_units and _db.in_transaction:
+        _db.rollback()
+        _settle_cache(_db)
+
+def _invalidate_cache(_db: sqlite3.Connection) -> None:
+    '''Clear the lookup cache after changing categories or the cash amount. If the change is not
+    committed yet, the cache is cleared again when it is, since other connections may have cached
+    the old committed values in the meantime.'''
+    cache = getattr(_db, 'cache', None)
+    if cache != None:
+        cache.clear()
+        _db.cache_changed = _db.in_transaction
+
+def _settle_cache(_db: sqlite3.Connection) -> None:
+    '''Clear the lookup cache once changes made since _invalidate_cache() are committed or rolled back.'''
+    if getattr(_db, 'cache_changed', False):
+        _db.cache_changed = False
+        _db.cache.clear()
+
+def _cached_lookup(_cur: sqlite3.Cursor, name: str, load: Callable[[sqlite3.Cursor], object]):
+    '''Return the cached value called name for the cursor's connection, reading it with load(_cur) on
+    a miss. Connections without a cache, or inside a transaction, where uncommitted changes may
+    differ from the committed values in the cache, always read from the database. At most every
+    LOOKUP_CHECK_SECONDS the cache is cleared if categories or cash were changed by another
+    connection, which the lookup version kept by triggers tells; other writes leave it in place.'''
+    connection = _cur.connection
+    cache = getattr(connection, 'cache', None)
+    if cache is None or connection.in_transaction:
+        return load(_cur)
+    now = time.monotonic()
+    if now - connection.lookup_checked >= LOOKUP_CHECK_SECONDS:
+        connection.lookup_checked = now
+        lookup_version = _cur.execute('SELECT lookup_version FROM data_version').fetchone()[0]
+        if connection.lookup_version != lookup_version:
+            #The first check on a connection cannot tell what changed before it, so it clears as well.
+            cache.clear()
+            connection.lookup_version = lookup_version
+    with cache.lock:
+        value = getattr(cache, name)
+        if value is not None:
+            cache.stats.hits += 1
+            return value
+        cache.stats.misses += 1
+        generation = cache.generation
+    value = load(_cur)
+    with cache.lock:
+        if cache.generation == generation:
+            setattr(cache, name, value)
+    return value
+
+@contextmanager
+def unit_of_work(_db: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    '''Group several API calls under a single commit.
+    Every function called inside the block skips its own commit; the changes are committed
+    together when the block exits, or rolled back if it raises. Blocks may be nested, only the
+    outermost one commits.'''
+    key = id(_db)
+    _open_units[key] = _open_units.get(key, 0) + 1
+    try:
+        yield _db
+    except BaseException:
+        if _close_unit(key):
+            _db.rollback()
+            _settle_unit(_db)
+        raise
+    if _close_unit(key):
+        try:
+            _close_change_group(_db)
+            _db.commit()
+        finally:
+            _settle_unit(_db)
+
+def _settle_unit(_db: sqlite3.Connection) -> None:
+    '''Clear the lookup cache and run the pragmas deferred until the outermost unit_of_work() block
+    of a connection has ended.'''
+    _settle_cache(_db)
+    for pragma in _unit_pragmas.pop(id(_db), []):
+        _db.execute(pragma)
+
+def _close_unit(key: int) -> bool:
+    '''Leave one level of unit_of_work() for a connection. Returns True if it was the outermost.'''
+    _open_units[key] -= 1
+    if _open_units[key] == 0:
+        del _open_units[key]
+        return True
+    return False
+
+def _migrate_to_v1(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Create the original untyped tables. Databases made before versioning already have them.'''
     _cur.execute('CREATE TABLE IF NOT EXISTS expenses(category, date, amount, title, color)')
     _cur.execute('CREATE TABLE IF NOT EXISTS finance(cash)')
-    _cur.execute('INSERT INTO finance VALUES(0.00)')
     _cur.execute('CREATE TABLE IF NOT EXISTS categories(name, color)')
-    if default_categories:
-        for category in default_categories:
-            _cur.execute('INSERT INTO categories VALUES(?, ?)', [category[0], category[1]])
-    _db.commit()
 
-def find_expense_id(_cur: sqlite3.Cursor, expense: Expense) -> int:
+def _legacy_expense_values(row: tuple) -> tuple:
+    '''Convert a row of the version 1 expenses table to the typed version 2 columns.
+    Unreadable dates default to 1/1/1 and unreadable amounts to 0, as they did when sorting.
+    Missing categories become uncategorized.'''
+    rowid, category, date, amount, title, color = row
+    try:
+        cents = amount_to_cents(float(amount))
+    except (TypeError, ValueError):
+        cents = 0
+    return (rowid, '' if category is None else str(category), date_to_day(date) or 1, cents,
+            '' if title is None else str(title), '#000000' if color is None else str(color))
+
+def _migrate_to_v2(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Rebuild the expenses table with typed columns, day numbers instead of date strings,
+    amounts in cents and indexes for date, category and amount lookups.
+    Rows are copied MIGRATION_BATCH_SIZE at a time and keep their ROWIDs.'''
+    _cur.execute('''CREATE TABLE expenses_v2(id INTEGER PRIMARY KEY,
+                                             category TEXT NOT NULL,
+                                             day INTEGER NOT NULL,
+                                             cents INTEGER NOT NULL,
+                                             title TEXT NOT NULL DEFAULT '',
+                                             color TEXT NOT NULL DEFAULT '#000000')''')
+    read_cur = _db.cursor()
+    last_id = 0
+    while rows := read_cur.execute('SELECT ROWID, * FROM expenses WHERE ROWID>? ORDER BY ROWID LIMIT ?',
+                                   [last_id, MIGRATION_BATCH_SIZE]).fetchall():
+        _cur.executemany('INSERT INTO expenses_v2 VALUES(?, ?, ?, ?, ?, ?)', map(_legacy_expense_values, rows))
+        last_id = rows[-1][0]
+    _cur.execute('DROP TABLE expenses')
+    _cur.execute('ALTER TABLE expenses_v2 RENAME TO expenses')
+    _cur.execute('CREATE INDEX expenses_by_date ON expenses(day)')
+    _cur.execute('CREATE INDEX expenses_by_category_date ON expenses(category, day)')
+    _cur.execute('CREATE INDEX expenses_by_amount ON expenses(cents)')
+
+#SQL expression for the YYYYMM month number of a stored day number ({} is the day column).
+#1721424.5 is the Julian day number of the day before 1/1/1, so adding it converts a proleptic ordinal.
+_MONTH_OF_DAY = "CAST(strftime('%Y%m', {} + 1721424.5) AS INTEGER)"
+
+def _aggregate_queries(category: str) -> dict[str, str]:
+    '''The summary tables kept current by the triggers from _aggregate_triggers(), with the query
+    that rebuilds each one from the expenses table. category is the SQL expression for the category
+    of an expense row, with {row} standing for the row prefix.'''
+    month = _MONTH_OF_DAY.format('day')
+    return {
+        'category_month_totals': f'''SELECT {category.format(row='')} AS category, {month} AS month, SUM(cents), COUNT(*)
+                                     FROM expenses GROUP BY category, month''',
+        'month_totals': f'SELECT {month} AS month, SUM(cents), COUNT(*) FROM expenses GROUP BY month',
+        'day_totals': 'SELECT day, SUM(cents), COUNT(*) FROM expenses GROUP BY day',
+    }
+
+def _aggregate_changes(category: str, column: str, row: str, sign: str) -> str:
+    '''Trigger statements that add (sign='+') or remove (sign='-') one expense row, given as NEW or OLD,
+    from every summary table. column is the category column of category_month_totals.'''
+    month = _MONTH_OF_DAY.format(f'{row}.day')
+    category = category.format(row=f'{row}.')
+    statements = [
+        f'''INSERT INTO category_month_totals VALUES({category}, {month}, {sign}{row}.cents, {sign}1)
+           ON CONFLICT({column}, month) DO UPDATE SET cents=cents+excluded.cents, count=count+excluded.count''',
+        f'''INSERT INTO month_totals VALUES({month}, {sign}{row}.cents, {sign}1)
+           ON CONFLICT(month) DO UPDATE SET cents=cents+excluded.cents, count=count+excluded.count''',
+        f'''INSERT INTO day_totals VALUES({row}.day, {sign}{row}.cents, {sign}1)
+           ON CONFLICT(day) DO UPDATE SET cents=cents+excluded.cents, count=count+excluded.count''',
+    ]
+    if sign == '-':
+        statements += [f'DELETE FROM category_month_totals WHERE {column}={category} AND month={month} AND count=0',
+                       f'DELETE FROM month_totals WHERE month={month} AND count=0',
+                       f'DELETE FROM day_totals WHERE day={row}.day AND count=0']
+    return ''.join(f'{statement};\n' for statement in statements)
+
+def _create_aggregate_triggers(_cur: sqlite3.Cursor, category: str, column: str, watched: str) -> None:
+    '''Create the triggers that keep the summary tables in step with the expenses table.
+    watched lists the expenses columns whose updates affect the totals.'''
+    added = _aggregate_changes(category, column, 'NEW', '+')
+    removed = _aggregate_changes(category, column, 'OLD', '-')
+    _cur.execute(f'CREATE TRIGGER expenses_totals_insert AFTER INSERT ON expenses BEGIN\n{added}END')
+    _cur.execute(f'CREATE TRIGGER expenses_totals_delete AFTER DELETE ON expenses BEGIN\n{removed}END')
+    _cur.execute(f'CREATE TRIGGER expenses_totals_update AFTER UPDATE OF {watched} ON expenses BEGIN\n{removed}{added}END')
+
+def _fill_aggregate_tables(_cur: sqlite3.Cursor, category: str) -> None:
+    '''Recompute every summary table from the expenses table.'''
+    for table, query in _aggregate_queries(category).items():
+        _cur.execute(f'DELETE FROM {table}')
+        _cur.execute(f'INSERT INTO {table} {query}')
+
+def _migrate_to_v3(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Add the summary tables of spending per category and month, per month and per day, and the
+    triggers that keep them up to date whenever an expense is added, changed or deleted.'''
+    _cur.execute('''CREATE TABLE category_month_totals(category TEXT NOT NULL, month INTEGER NOT NULL,
+                                                       cents INTEGER NOT NULL, count INTEGER NOT NULL,
+                                                       PRIMARY KEY(category, month)) WITHOUT ROWID''')
+    _cur.execute('''CREATE TABLE month_totals(month INTEGER PRIMARY KEY, cents INTEGER NOT NULL,
+                                              count INTEGER NOT NULL)''')
+    _cur.execute('''CREATE TABLE day_totals(day INTEGER PRIMARY KEY, cents INTEGER NOT NULL,
+                                            count INTEGER NOT NULL)''')
+    _create_aggregate_triggers(_cur, '{row}category', 'category', 'category, day, cents')
+    _fill_aggregate_tables(_cur, '{row}category')
+
+#Category of an expense row in the summary tables since version 4. Uncategorized expenses use 0.
+_CATEGORY_OF_EXPENSE = 'IFNULL({row}category_id, 0)'
+
+def _migrate_to_v4(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Store each category once, with an integer id, and have expenses refer to it by id instead of
+    repeating its name and color. Categories only named by expenses are added, using the color of
+    their first expense. Expenses of a deleted category become uncategorized (category_id NULL).'''
+    _cur.execute('''CREATE TABLE categories_v4(id INTEGER PRIMARY KEY,
+                                               name TEXT NOT NULL UNIQUE,
+                                               color TEXT NOT NULL DEFAULT '#000000')''')
+    _cur.execute('''INSERT OR IGNORE INTO categories_v4
+                    SELECT ROWID, name, IFNULL(color, '#000000') FROM categories
+                    WHERE IFNULL(name, '')!='' ORDER BY ROWID''')
+    _cur.execute('''INSERT OR IGNORE INTO categories_v4(name, color)
+                    SELECT category, color FROM expenses
+                    WHERE id IN (SELECT MIN(id) FROM expenses WHERE category!='' GROUP BY category) ORDER BY id''')
+    _cur.execute('''CREATE TABLE expenses_v4(id INTEGER PRIMARY KEY,
+                                             category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL,
+                                             day INTEGER NOT NULL,
+                                             cents INTEGER NOT NULL,
+                                             title TEXT NOT NULL DEFAULT '')''')
+    last_id = 0
+    while True:
+        _cur.execute('''INSERT INTO expenses_v4
+                        SELECT e.id, c.id, e.day, e.cents, e.title FROM expenses e
+                        LEFT JOIN categories_v4 c ON c.name=e.category
+                        WHERE e.id>? ORDER BY e.id LIMIT ?''', [last_id, MIGRATION_BATCH_SIZE])
+        if _cur.rowcount < 1:
+            break
+        last_id = _cur.execute('SELECT MAX(id) FROM expenses_v4').fetchone()[0]
+    _cur.execute('DROP TABLE expenses')
+    _cur.execute('DROP TABLE categories')
+    _cur.execute('DROP TABLE category_month_totals')
+    _cur.execute('ALTER TABLE categories_v4 RENAME TO categories')
+    _cur.execute('ALTER TABLE expenses_v4 RENAME TO expenses')
+    _cur.execute('CREATE INDEX expenses_by_date ON expenses(day)')
+    _cur.execute('CREATE INDEX expenses_by_category_date ON expenses(category_id, day)')
+    _cur.execute('CREATE INDEX expenses_by_amount ON expenses(cents)')
+    _cur.execute('''CREATE VIEW expense_details AS
+                    SELECT e.id, IFNULL(c.name, '') AS category, e.day, e.cents, e.title,
+                           IFNULL(c.color, '#000000') AS color, e.category_id
+                    FROM expenses e LEFT JOIN categories c ON c.id=e.category_id''')
+    _cur.execute('''CREATE TABLE category_month_totals(category_id INTEGER NOT NULL, month INTEGER NOT NULL,
+                                                       cents INTEGER NOT NULL, count INTEGER NOT NULL,
+                                                       PRIMARY KEY(category_id, month)) WITHOUT ROWID''')
+    _create_aggregate_triggers(_cur, _CATEGORY_OF_EXPENSE, 'category_id', 'category_id, day, cents')
+    _fill_aggregate_tables(_cur, _CATEGORY_OF_EXPENSE)
+
+def expense_hash(day: int, cents: int, title: str) -> int:
+    '''Return the content hash stored with an expense: a signed 64-bit digest of its stored day,
+    cents and title. The category is left out so that renaming or merging categories does not
+    change it; lookups match category_id alongside the hash instead.'''
+    digest = hashlib.blake2b(f'{day}\x1f{cents}\x1f{title}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+def _fill_content_hashes(_cur: sqlite3.Cursor, only_missing: bool) -> int:
+    '''Compute the content hash of the expenses, MIGRATION_BATCH_SIZE rows at a time. Returns the
+    number of rows updated.'''
+    read_cur = _cur.connection.cursor()
+    condition = ' AND content_hash IS NULL' if only_missing else ''
+    last_id = 0
+    updated = 0
+    while rows := read_cur.execute(f'SELECT id, day, cents, title FROM expenses WHERE id>?{condition} ORDER BY id LIMIT ?',
+                                   [last_id, MIGRATION_BATCH_SIZE]).fetchall():
+        _cur.executemany('UPDATE expenses SET content_hash=? WHERE id=?',
+                         [(expense_hash(day, cents, title), expense_id) for expense_id, day, cents, title in rows])
+        last_id = rows[-1][0]
+        updated += len(rows)
+    return updated
+
+def _migrate_to_v5(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Store a content hash with every expense, indexed together with the category, so that an
+    expense and its duplicates can be looked up without comparing every row.'''
+    _cur.execute('ALTER TABLE expenses ADD COLUMN content_hash INTEGER')
+    _fill_content_hashes(_cur, only_missing=False)
+    _cur.execute('CREATE INDEX expenses_by_hash ON expenses(content_hash, category_id)')
+
+def _migrate_to_v6(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Keep a counter that goes up whenever an expense or category changes, so that results computed
+    from them can be cached until the next change. The random token tells databases apart.'''
+    _cur.execute('''CREATE TABLE data_version(id INTEGER PRIMARY KEY CHECK(id=1),
+                                              token INTEGER NOT NULL,
+                                              version INTEGER NOT NULL)''')
+    _cur.execute('INSERT INTO data_version VALUES(1, random(), 0)')
+    for table in ['expenses', 'categories']:
+        for action in ['INSERT', 'UPDATE', 'DELETE']:
+            _cur.execute(f'''CREATE TRIGGER {table}_version_{action.lower()} AFTER {action} ON {table}
+                             BEGIN UPDATE data_version SET version=version+1; END''')
+
+#Text indexed in the category column of expense_search: a token naming the category id, so that
+#renaming a category does not have to touch the index.
+_SEARCH_CATEGORY = "'c' || IFNULL({row}category_id, 0)"
+
+def _migrate_to_v7(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Add a full-text index of expense titles and categories for search_expenses(), kept up to date
+    by triggers. The index is contentless; results are read from the expenses table.'''
+    #No prefix indexes: FTS5 answers the prefix queries of search_expenses() from the full-word index,
+    #and prefix='1 2 3' made adding expenses about a third slower.
+    _cur.execute("CREATE VIRTUAL TABLE expense_search USING fts5(title, category, content='', tokenize='unicode61 remove_diacritics 2')")
+    insert = f"INSERT INTO expense_search(rowid, title, category) VALUES(new.id, new.title, {_SEARCH_CATEGORY.format(row='new.')});"
+    delete = ("INSERT INTO expense_search(expense_search, rowid, title, category) "
+              f"VALUES('delete', old.id, old.title, {_SEARCH_CATEGORY.format(row='old.')});")
+    _cur.execute(f'CREATE TRIGGER expenses_search_insert AFTER INSERT ON expenses BEGIN {insert} END')
+    _cur.execute(f'CREATE TRIGGER expenses_search_delete AFTER DELETE ON expenses BEGIN {delete} END')
+    _cur.execute(f'CREATE TRIGGER expenses_search_update AFTER UPDATE OF title, category_id ON expenses BEGIN {delete} {insert} END')
+    _cur.execute(f"INSERT INTO expense_search(rowid, title, category) SELECT id, title, {_SEARCH_CATEGORY.format(row='')} FROM expenses")
+
+def _migrate_to_v8(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Add the recurring_rules table. occurrences counts the expenses a rule has added so far and
+    next_day is the day of the next one, NULL once the rule has ended, so that finding the rules that
+    are due follows an index.'''
+    _cur.execute('''CREATE TABLE recurring_rules(id INTEGER PRIMARY KEY,
+                                                 category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL,
+                                                 cents INTEGER NOT NULL,
+                                                 title TEXT NOT NULL DEFAULT '',
+                                                 frequency TEXT NOT NULL CHECK(frequency IN ('daily', 'weekly', 'monthly', 'yearly')),
+                                                 interval INTEGER NOT NULL DEFAULT 1 CHECK(interval>0),
+                                                 start_day INTEGER NOT NULL,
+                                                 end_day INTEGER,
+                                                 occurrences INTEGER NOT NULL DEFAULT 0,
+                                                 next_day INTEGER)''')
+    _cur.execute('CREATE INDEX recurring_rules_by_next_day ON recurring_rules(next_day)')
+
+def _migrate_to_v9(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Add the change journal: triggers record every row inserted, updated or deleted in the journaled
+    tables, in the same transaction as the change, under an ever increasing sequence number. Each
+    commit's changes are numbered as one group in change_groups, which undo() and redo() work on.'''
+    _cur.execute('''CREATE TABLE change_groups(id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                               kind TEXT NOT NULL CHECK(kind IN ('change', 'undo', 'redo', 'other')),
+                                               undone_by INTEGER)''')
+    _cur.execute('''CREATE TABLE change_journal(seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                group_id INTEGER,
+                                                table_name TEXT NOT NULL,
+                                                row_id INTEGER NOT NULL,
+                                                action TEXT NOT NULL CHECK(action IN ('insert', 'update', 'delete')),
+                                                old TEXT,
+                                                new TEXT)''')
+    #Only the changes of the transaction in progress are ungrouped, so this index stays tiny.
+    _cur.execute('CREATE INDEX change_journal_ungrouped ON change_journal(seq) WHERE group_id IS NULL')
+    _cur.execute('CREATE INDEX change_journal_by_group ON change_journal(group_id)')
+    for table, columns in _JOURNALED_TABLES.items():
+        values = {row: 'json_object(' + ', '.join(f"'{column}', {row}.{column}" for column in columns) + ')'
+                  for row in ['old', 'new']}
+        changed = ' OR '.join(f'old.{column} IS NOT new.{column}' for column in columns)
+        for action, old, new, row, condition in [('insert', 'NULL', values['new'], 'new', ''),
+                                                 ('update', values['old'], values['new'], 'new', f'WHEN {changed}'),
+                                                 ('delete', values['old'], 'NULL', 'old', '')]:
+            _cur.execute(f'''CREATE TRIGGER {table}_journal_{action} AFTER {action.upper()} ON {table} {condition}
+                             BEGIN INSERT INTO change_journal(table_name, row_id, action, old, new)
+                                   VALUES('{table}', {row}.ROWID, '{action}', {old}, {new}); END''')
+
+def _migrate_to_v10(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Keep a second counter that only goes up when a category or the cash amount changes, so that
+    the lookup cache can tell those changes by other connections from the far more frequent expense
+    writes.'''
+    _cur.execute('ALTER TABLE data_version ADD COLUMN lookup_version INTEGER NOT NULL DEFAULT 0')
+    for table, action in [('categories', 'INSERT'), ('categories', 'UPDATE'), ('categories', 'DELETE'),
+                          ('finance', 'INSERT'), ('finance', 'UPDATE'), ('finance', 'DELETE')]:
+        _cur.execute(f'''CREATE TRIGGER {table}_lookup_{action.lower()} AFTER {action} ON {table}
+                         BEGIN UPDATE data_version SET lookup_version=lookup_version+1; END''')
+
+#Schema migrations in order. _MIGRATIONS[n] upgrades a database from version n to n + 1.
+_MIGRATIONS: list[Callable[[sqlite3.Connection, sqlite3.Cursor], None]] = [
+    _migrate_to_v1,
+    _migrate_to_v2,
+    _migrate_to_v3,
+    _migrate_to_v4,
+    _migrate_to_v5,
+    _migrate_to_v6,
+    _migrate_to_v7,
+    _migrate_to_v8,
+    _migrate_to_v9,
+    _migrate_to_v10,
+]
+
+def get_schema_version(_cur: sqlite3.Cursor) -> int:
+    '''Return the schema version of the connected database. 0 means it has never been migrated.'''
+    return _cur.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate_db(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> int:
+    '''Upgrade the connected database in place to the latest schema version.
+    Each migration runs in its own transaction together with its version bump, so an interrupted
+    upgrade resumes from the last completed version. Foreign keys are not enforced while tables are
+    being rebuilt. Returns the resulting schema version.'''
+    version = get_schema_version(_cur)
+    if version >= len(_MIGRATIONS):
+        return version
+    foreign_keys = _cur.execute('PRAGMA foreign_keys').fetchone()[0]
+    _cur.execute('PRAGMA foreign_keys=OFF')
+    try:
+        for target, migration in enumerate(_MIGRATIONS[version:], start=version + 1):
+            if not _db.in_transaction:
+                _cur.execute('BEGIN')
+            migration(_db, _cur)
+            _cur.execute(f'PRAGMA user_version={target}')
+            _db.commit()
+    finally:
+        _cur.execute(f'PRAGMA foreign_keys={foreign_keys}')
+        _invalidate_cache(_db)
+    return len(_MIGRATIONS)
+
+def _table_exists(_cur: sqlite3.Cursor, name: str) -> bool:
+    '''Check if a table with the given name exists in the connected database.'''
+    return _cur.execute('SELECT 1 FROM sqlite_master WHERE type=? AND name=?', ['table', name]).fetchone() is not None
+
+def init_db(_db: sqlite3.Connection, _cur: sqlite3.Cursor, default_categories: (list[list[str, str]])) -> None:
+    '''Check if the connected database already contains the required tables. If it does not, creates
+    them and fills in the default categories. Databases made by older versions are migrated to the
+    current schema.'''
+    is_new = get_schema_version(_cur) == 0 and not _table_exists(_cur, 'expenses')
+    migrate_db(_db, _cur)
+    if is_new:
+        _cur.execute('INSERT INTO finance VALUES(0.00)')
+        if default_categories:
+            for category in default_categories:
+                _cur.execute('INSERT OR IGNORE INTO categories(name, color) VALUES(?, ?)', [category[0], category[1]])
+        _invalidate_cache(_db)
+        _commit(_db)
+
+def _row_to_expense(row: tuple) -> Expense:
+    '''Convert an (id, category, day, cents, title, color) row from the expenses table to an Expense.'''
+    return Expense(row[1], day_to_date(row[2]), row[3] / 100, row[4], row[5], row[0])
+
+def _ordered_rows(_cur: sqlite3.Cursor,
+                  select: str,
+                  where: list[str],
+                  columns: list[str],
+                  desc: bool,
+                  after: list | None,
+                  limit: int | None) -> sqlite3.Cursor:
+    '''Run select with the given conditions, ordered by columns, starting after the row whose
+    column values are after. Runs on a new cursor so that results can be read lazily.'''
+    params: list = []
+    if after is not None:
+        where = where + [f'({", ".join(columns)}) {"<" if desc else ">"} ({", ".join(["?"] * len(columns))})']
+        params += after
+    if where:
+        select += ' WHERE ' + ' AND '.join(where)
+    direction = 'DESC' if desc else 'ASC'
+    select += ' ORDER BY ' + ', '.join(f'{column} {direction}' for column in columns)
+    if limit is not None:
+        select += ' LIMIT ?'
+        params.append(limit)
+    return _cur.connection.execute(select, params)
+
+def _expenses_by_category(_cur: sqlite3.Cursor, desc: bool, limit: int | None, after: Expense | None) -> Iterator[tuple]:
+    '''Rows for query_expenses(order_by='category'). Uncategorized expenses sort before every named
+    category; they are read separately so that both parts can follow an index.'''
+    uncategorized_after = named_after = None
+    skip_uncategorized = skip_named = False
+    if after is not None:
+        day = date_to_day(after.date)
+        if after.category == '':
+            uncategorized_after = [day, after.expense_id]
+            skip_named = desc
+        else:
+            named_after = [after.category, day, after.expense_id]
+            skip_uncategorized = not desc
+    parts = []
+    if not skip_uncategorized:
+        parts.append(lambda: _ordered_rows(_cur, _SELECT_EXPENSES, ['category_id IS NULL'], ['day', 'id'],
+                                           desc, uncategorized_after, limit))
+    if not skip_named:
+        parts.append(lambda: _ordered_rows(_cur, _SELECT_NAMED_EXPENSES, [], ['c.name', 'e.day', 'e.id'],
+                                           desc, named_after, limit))
+    if desc:
+        parts.reverse()
+    remaining = limit
+    for part in parts:
+        for row in part():
+            if remaining is not None:
+                if remaining == 0:
+                    return
+                remaining -= 1
+            yield row
+
+def _query_rows(_cur: sqlite3.Cursor, order_by: str, desc: bool, limit: int | None, after: Expense | None) -> Iterator[tuple]:
+    '''Rows for query_expenses() and query_expense_batch().'''
+    if order_by == 'category':
+        return _expenses_by_category(_cur, desc, limit, after)
+    if order_by == 'date':
+        column, key = 'day', None if after is None else date_to_day(after.date)
+    elif order_by == 'amount':
+        column, key = 'cents', None if after is None else amount_to_cents(after.amount)
+    else:
+        raise ValueError(f'Cannot sort expenses by {order_by!r}')
+    return _ordered_rows(_cur, _SELECT_EXPENSES, [], [column, 'id'], desc,
+                         None if after is None else [key, after.expense_id], limit)
+
+def query_expenses(_cur: sqlite3.Cursor,
+                   order_by: str = 'date',
+                   desc: bool = False,
+                   limit: int | None = None,
+                   after: Expense | None = None) -> Iterator[Expense]:
+    '''Iterate over the expenses sorted by 'date', 'amount' or 'category' (then date), oldest,
+    cheapest or A-Z first unless desc=True. Rows are read from the database as they are iterated.
+    To get the next page of a list, pass the last expense of the previous page as after; the
+    query then continues from its position using the indexes, rather than skipping rows.
+    The query runs on its own cursor, so _cur stays free for other calls while iterating.'''
+    return map(_row_to_expense, _query_rows(_cur, order_by, desc, limit, after))
+
+def query_expense_batch(_cur: sqlite3.Cursor,
+                        order_by: str = 'date',
+                        desc: bool = False,
+                        limit: int | None = None,
+                        after: Expense | None = None) -> ExpenseBatch:
+    '''Like query_expenses(), but read all the expenses at once into an ExpenseBatch, which holds
+    large result sets in a fraction of the memory of a list of Expense objects.'''
+    return ExpenseBatch.from_rows(_query_rows(_cur, order_by, desc, limit, after))
+
+def get_expense(_cur: sqlite3.Cursor, expense_id: int) -> Expense | None:
+    '''Return the expense with the given ROWID, or None if it does not exist.'''
+    row = _cur.execute(f'{_SELECT_EXPENSES} WHERE id=?', [expense_id]).fetchone()
+    if row != None:
+        return _row_to_expense(row)
+    return None
+
+def get_all_expenses(_cur: sqlite3.Cursor) -> list[Expense]:
+    '''Return every expense in the database, in the order they were added.'''
+    return [_row_to_expense(row) for row in _cur.execute(f'{_SELECT_EXPENSES} ORDER BY id')]
+
+def _expense_row(expense: Expense) -> list | None:
+    '''Convert an expense to the (category, day, cents, title, color) values used by the expenses
+    table, or None if it is not a valid expense. Amounts that are not finite or do not fit in the
+    stored cents are not valid.'''
+    if (not isinstance(expense, Expense)
+            or type(expense.amount) not in [int, float]
+            or not isinstance(expense.category, str)
+            or not isinstance(expense.date, str)
+            or not math.isfinite(expense.amount)):
+        return None
+    day = date_to_day(expense.date)
+    cents = amount_to_cents(expense.amount)
+    if day is None or not MIN_CENTS <= cents <= MAX_CENTS:
+        return None
+    return [expense.category, day, cents, expense.title, expense.color]
+
+def _valid_expense_row(expense: Expense) -> list:
+    '''Same as _expense_row, but raises a ValueError for an invalid expense.'''
+    row = _expense_row(expense)
+    if row is None:
+        raise ValueError(f'Invalid expense: {expense!r}')
+    return row
+
+def _category_filter(cat_name: str) -> tuple[str, list]:
+    '''SQL condition and parameters matching the expenses of the category named cat_name.
+    An empty name matches the uncategorized expenses.'''
+    if cat_name == '':
+        return 'category_id IS NULL', []
+    return 'category_id=(SELECT id FROM categories WHERE name=?)', [cat_name]
+
+def _add_missing_categories(_cur: sqlite3.Cursor, rows: list[list]) -> None:
+    '''Create the categories named by the given expense rows that do not exist yet, using the
+    color of the first expense that names them.'''
+    new_categories = dict.fromkeys((row[0], row[4]) for row in rows if row[0] != '')
+    _cur.executemany('INSERT OR IGNORE INTO categories(name, color) VALUES(?, ?)', new_categories)
+    if _cur.rowcount > 0:
+        _invalidate_cache(_cur.connection)
+
+def find_expense_id(_cur: sqlite3.Cursor, expense: Expense, match_color: bool = True) -> int:
     '''Attempt to find the ROWID of an expense given its attributes. If the expense is found,
-    returns its ROWID. If it is not found, returns -1.'''
-    expense_id: int = _cur.execute('SELECT ROWID FROM expenses WHERE category=? AND date=? AND amount=? AND title=? AND color=?',
-                                  [expense.category, expense.date, expense.amount, expense.title, expense.color]).fetchone()
+    returns its ROWID. If it is not found, returns -1.
+    With match_color=False the color is ignored, since it belongs to the category.'''
+    row = _expense_row(expense)
+    if row is None:
+        return -1
+    condition, params = _category_filter(expense.category)
+    sql = f'SELECT id FROM expenses WHERE content_hash=? AND {condition} AND day=? AND cents=? AND title=?'
+    params = [expense_hash(*row[1:4])] + params + row[1:4]
+    if match_color:
+        sql += " AND IFNULL((SELECT color FROM categories WHERE id=category_id), '#000000')=?"
+        params.append(row[4])
+    expense_id: int = _cur.execute(sql, params).fetchone()
     if  expense_id != None:
         return expense_id[0]
     return -1
     
+_INSERT_EXPENSE = ('INSERT INTO expenses(category_id, day, cents, title, content_hash) '
+                   'VALUES((SELECT id FROM categories WHERE name=?), ?, ?, ?, ?)')
+
+def _insert_rows(_cur: sqlite3.Cursor, rows: list[list], skip_duplicates: bool) -> tuple[int, int]:
+    '''Insert valid expense rows, creating missing categories first. With skip_duplicates, rows equal
+    to an existing expense or to an earlier row of the batch (ignoring color) are left out.
+    Returns the number of rows inserted and skipped.'''
+    _add_missing_categories(_cur, rows)
+    records = [row[:4] + [expense_hash(*row[1:4])] for row in rows]
+    if skip_duplicates:
+        seen = set()
+        unique = []
+        for record in records:
+            key = tuple(record[:4])
+            if key in seen or _cur.execute('''SELECT 1 FROM expenses WHERE content_hash=?
+                                              AND category_id IS (SELECT id FROM categories WHERE name=?)
+                                              AND day=? AND cents=? AND title=?''',
+                                           record[4:] + record[:4]).fetchone() != None:
+                continue
+            seen.add(key)
+            unique.append(record)
+        records = unique
+    _cur.executemany(_INSERT_EXPENSE, records)
+    return len(records), len(rows) - len(records)
+
 def add_expense(_db: sqlite3.Connection,
                 _cur: sqlite3.Cursor,
                 expense: Expense) -> None:
-    '''Add an expense to the expenses database with a given category, amount, and optional title and color code.'''
-    _cur.execute('INSERT INTO expenses VALUES(?, ?, ?, ?, ?)',
-                 [expense.category, expense.date, expense.amount, expense.title, expense.color])
-    _db.commit()
+    '''Add an expense to the expenses database with a given category, amount, and optional title and color code.
+    A category that does not exist yet is created with the expense's color; otherwise the expense
+    uses the color of its category. An empty category adds the expense as uncategorized.
+    Raises a ValueError if the amount is not a number or the date is not a valid MM/DD/YYYY date.'''
+    try:
+        _insert_rows(_cur, [_valid_expense_row(expense)], skip_duplicates=False)
+        _commit(_db)
+    except BaseException:
+        _rollback(_db)
+        raise
+
+def add_expenses(_db: sqlite3.Connection,
+                 _cur: sqlite3.Cursor,
+                 expenses: Iterable[Expense],
+                 batch_size: int = 1000,
+                 skip_duplicates: bool = False,
+                 journal: bool = True) -> BulkInsertResult:
+    '''Add any number of expenses from a list or generator, batch_size rows per transaction.
+    Entries that are not valid expenses are skipped. With skip_duplicates, expenses that match an
+    existing one (or an earlier one in the same call) are skipped as well. Returns the number of
+    inserted, rejected and duplicate entries.
+    Without journal the inserted expenses are left out of the change journal, which makes loading
+    many of them much faster, but they cannot be undone and changes_since() does not list them.
+    If an error stops it, the batch in progress is rolled back and the earlier batches are kept.'''
+    result = BulkInsertResult()
+    source = iter(expenses)
+    try:
+        while batch := list(islice(source, batch_size)):
+            rows = []
+            for expense in batch:
+                row = _expense_row(expense)
+                if row is None:
+                    result.rejected += 1
+                else:
+                    rows.append(row)
+            if rows:
+                with _unjournaled(_db, _cur, [] if journal else ['expenses_journal_insert']):
+                    inserted, duplicates = _insert_rows(_cur, rows, skip_duplicates)
+                result.inserted += inserted
+                result.duplicates += duplicates
+            _commit(_db)
+    except BaseException:
+        _rollback(_db)
+        raise
+    return result
+
+def find_duplicates(_cur: sqlite3.Cursor) -> list[list[int]]:
+    '''Find every group of identical expenses (same category, date, amount and title) in a single
+    pass along the content hash index. Returns the ROWIDs of each group in ascending order, so the
+    first ROWID of a group is the original and the rest are its duplicates.'''
+    rows = _cur.connection.execute('''SELECT content_hash, category_id, id, day, cents, title FROM expenses
+                                      ORDER BY content_hash, category_id, id''')
+    groups = []
+    for _, candidates in groupby(rows, key=itemgetter(0, 1)):
+        #Rows with the same hash and category are almost always equal, but a hash collision is
+        #possible, so they are split by their actual values.
+        by_content: dict[tuple, list[int]] = {}
+        for row in candidates:
+            by_content.setdefault(row[3:], []).append(row[2])
+        groups += [ids for ids in by_content.values() if len(ids) > 1]
+    return sorted(groups)
+
+def rehash_expenses(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> int:
+    '''Compute the missing content hashes of expenses that were added with plain SQL instead of the
+    functions of this module. Returns the number of expenses updated.'''
+    updated = _fill_content_hashes(_cur, only_missing=True)
+    _commit(_db)
+    return updated
 
 def delete_expense(_db:sqlite3.Connection, _cur: sqlite3.Cursor, target_id: int) -> None:
     '''Delete an expense from the database with a given ROWID.
     ROWID is used to select an expense to ensure the correct expense is deleted in the event
     that duplicate expenses exist.'''
     _cur.execute('DELETE FROM expenses WHERE ROWID=?', [target_id])
-    _db.commit()
+    _commit(_db)
     
 def update_expense(_db:sqlite3.Connection, _cur: sqlite3.Cursor, target_id: int, new: Expense) -> None:
     '''Update the expense with ROWID=target_id with a given set of values.'''
-    _cur.execute('UPDATE expenses SET category=?, date=?, amount=?, title=?, color=? WHERE ROWID=?',
-                 [new.category, new.date, new.amount, new.title, new.color, target_id])
-    _db.commit()
+    row = _valid_expense_row(new)
+    _add_missing_categories(_cur, [row])
+    _cur.execute('''UPDATE expenses SET category_id=(SELECT id FROM categories WHERE name=?), day=?, cents=?, title=?,
+                    content_hash=? WHERE id=?''',
+                 row[:4] + [expense_hash(*row[1:4]), target_id])
+    _commit(_db)
+
+def _move_category(_cur: sqlite3.Cursor, target_category: str, new_category: str) -> None:
+    '''Move every expense of target_category to new_category. If new_category does not exist yet, the
+    target category is simply renamed, a single row update. Otherwise the expenses are regrouped
+    into the existing category.'''
+    if target_category == new_category:
+        return
+    target_id = None if target_category == '' else get_category_id(_cur, target_category)
+    new_id = None if new_category == '' else get_category_id(_cur, new_category)
+    if target_id == -1:
+        return
+    if new_id == -1 and target_id is not None:
+        _cur.execute('UPDATE categories SET name=? WHERE id=?', [new_category, target_id])
+        _invalidate_cache(_cur.connection)
+        return
+    if new_id == -1:
+        new_id = _cur.execute('INSERT INTO categories(name) VALUES(?)', [new_category]).lastrowid
+        _invalidate_cache(_cur.connection)
+    _cur.execute('UPDATE expenses SET category_id=? WHERE category_id IS ?', [new_id, target_id])
 
 def update_expense_category_group(_db:sqlite3.Connection, _cur: sqlite3.Cursor, target_category: str, new_category: str) -> None:
-    '''Update all expenses of a given category group target_category to a new category, given as new_category.'''
-    _cur.execute('UPDATE expenses SET category=? WHERE category=?', [new_category, target_category])
-    _db.commit()
+    '''Update all expenses of a given category group target_category to a new category, given as new_category.
+    If new_category does not exist yet this renames the category; otherwise the expenses are merged into it.'''
+    _move_category(_cur, target_category, new_category)
+    _commit(_db)
 
 def update_expense_category_color(_db:sqlite3.Connection, _cur: sqlite3.Cursor, target_category: str, new_color: str) -> None:
-    '''Update the color code of all expenses for a given category.'''
-    _cur.execute('UPDATE expenses SET color=? WHERE category=?', [new_color, target_category])
-    _db.commit()
+    '''Update the color code of all expenses for a given category.
+    The color is stored once per category, so this is a single row update.'''
+    _cur.execute('UPDATE categories SET color=? WHERE name=?', [new_color, target_category])
+    _invalidate_cache(_db)
+    _commit(_db)
 
 def search_by_category(_cur: sqlite3.Cursor, cat_name: str) -> list[int]:
     '''Find all expenses with the given category cat_name, and return a list of their ROWIDs.'''
-    results = _cur.execute('SELECT ROWID FROM expenses WHERE category=?', [cat_name]).fetchall()
+    condition, params = _category_filter(cat_name)
+    results = _cur.execute(f'SELECT id FROM expenses WHERE {condition} ORDER BY id', params).fetchall()
     if len(results) > 0:
         return [item[0] for item in results]
     return [-1]
 
+def _search_terms(_cur: sqlite3.Cursor, text: str) -> str:
+    '''Turn search text into an FTS5 query. Every word has to match the start of a word in the title,
+    or of a word in the category name.'''
+    terms = []
+    for word in re.findall(r'\w+', text.lower()):
+        categories = [f'c{cat_id}' for name, (cat_id, _) in _categories(_cur).items()
+                      if any(part.startswith(word) for part in re.findall(r'\w+', name.lower()))]
+        if categories:
+            terms.append(f'(title : "{word}"* OR category : ({" OR ".join(categories)}))')
+        else:
+            terms.append(f'title : "{word}"*')
+    return ' AND '.join(terms)
+
+def search_expenses(_cur: sqlite3.Cursor,
+                    text: str,
+                    start: str | None = None,
+                    end: str | None = None,
+                    min_amount: float | None = None,
+                    max_amount: float | None = None,
+                    order_by: str = 'rank',
+                    limit: int = 50,
+                    offset: int = 0,
+                    after: Expense | None = None) -> list[Expense]:
+    '''Find the expenses whose title or category contains words starting with each word of text,
+    e.g. 'piz' finds 'Way too much pizza'. Results can be limited to dates from start to end
+    (MM/DD/YYYY) and amounts from min_amount to max_amount, all inclusive and optional.
+    Sorted by relevance with order_by='rank', or newest first with order_by='date'. Returns one page
+    of limit results, skipping the first offset. Empty text matches every expense in the filters.
+    To get the next page, pass the last expense of the previous page as after instead of an offset;
+    the search then continues from its position rather than reading and skipping the earlier pages.'''
+    select = 'SELECT e.id, e.category, e.day, e.cents, e.title, e.color FROM expense_details e'
+    where, params = [], []
+    query = _search_terms(_cur, text)
+    if query:
+        select += ' JOIN expense_search s ON s.rowid=e.id'
+        where.append('expense_search MATCH ?')
+        params.append(query)
+    for value, condition, convert in [(start, 'e.day>=?', date_to_day), (end, 'e.day<=?', date_to_day),
+                                      (min_amount, 'e.cents>=?', amount_to_cents), (max_amount, 'e.cents<=?', amount_to_cents)]:
+        if value != None:
+            converted = convert(value)
+            if converted is None:
+                raise ValueError(f'Invalid date: {value!r}')
+            where.append(condition)
+            params.append(converted)
+    if order_by == 'rank' and query:
+        order = 's.rank, e.id'
+        if after != None:
+            #The rank of the earlier result is computed again, for the same query on the same data
+            where.append('(s.rank, e.id) > ((SELECT rank FROM expense_search WHERE expense_search MATCH ? AND rowid=?), ?)')
+            params += [query, after.expense_id, after.expense_id]
+    elif order_by in ['rank', 'date']:
+        order = 'e.day DESC, e.id DESC'
+        if after != None:
+            where.append('(e.day, e.id) < (?, ?)')
+            params += [date_to_day(after.date), after.expense_id]
+    else:
+        raise ValueError(f'Cannot sort search results by {order_by!r}')
+    if where:
+        select += ' WHERE ' + ' AND '.join(where)
+    rows = _cur.execute(f'{select} ORDER BY {order} LIMIT ? OFFSET ?', params + [limit, offset]).fetchall()
+    return [_row_to_expense(row) for row in rows]
+
 def delete_by_category(_db:sqlite3.Connection, _cur: sqlite3.Cursor, target_category: str) -> None:
     '''Delete all expenses from the database whose category is equal to the target_category.'''
-    _cur.execute('DELETE FROM expenses WHERE category=?', [target_category])
-    _db.commit()
+    condition, params = _category_filter(target_category)
+    _cur.execute(f'DELETE FROM expenses WHERE {condition}', params)
+    _commit(_db)
 
-def get_cash_amount(_cur: sqlite3.Cursor) -> float:
-    '''Retrive the current cash on hand amount from the database.'''
+def _fill_aggregates(_cur: sqlite3.Cursor) -> None:
+    '''Recompute every summary table from the expenses table.'''
+    _fill_aggregate_tables(_cur, _CATEGORY_OF_EXPENSE)
+
+def rebuild_aggregates(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Recompute the spending summary tables from scratch, e.g. after check_aggregates() finds a
+    mismatch or after the expenses table was edited with the triggers dropped.'''
+    _fill_aggregates(_cur)
+    _commit(_db)
+
+def check_aggregates(_cur: sqlite3.Cursor) -> list[str]:
+    '''Compare each spending summary table with a fresh computation from the expenses table.
+    Returns the names of the tables that do not match, or an empty list if all are consistent.'''
+    mismatched = []
+    for table, query in _aggregate_queries(_CATEGORY_OF_EXPENSE).items():
+        difference = _cur.execute(f'''SELECT 1 FROM (SELECT * FROM {table} EXCEPT {query})
+                                      UNION ALL SELECT 1 FROM ({query} EXCEPT SELECT * FROM {table}) LIMIT 1''').fetchone()
+        if difference != None:
+            mismatched.append(table)
+    return mismatched
+
+def get_category_totals(_cur: sqlite3.Cursor, year: int, month: int) -> dict[str, float]:
+    '''Return the total amount spent in each category during the given month, read from the
+    category_month_totals summary table. Categories with no expenses that month are left out, and
+    uncategorized expenses are listed under ''.'''
+    rows = _cur.execute('''SELECT IFNULL(c.name, ''), t.cents FROM category_month_totals t
+                           LEFT JOIN categories c ON c.id=t.category_id WHERE t.month=? ORDER BY 1''',
+                        [year * 100 + month]).fetchall()
+    return {category: cents / 100 for category, cents in rows}
+
+def get_month_total(_cur: sqlite3.Cursor, year: int, month: int) -> float:
+    '''Return the total amount spent during the given month.'''
+    row = _cur.execute('SELECT cents FROM month_totals WHERE month=?', [year * 100 + month]).fetchone()
+    if row != None:
+        return row[0] / 100
+    return 0.0
+
+def get_running_total(_cur: sqlite3.Cursor, date: str) -> float:
+    '''Return the running balance of spending: the total of every expense up to and including the
+    given MM/DD/YYYY date. Adds up whole months from month_totals and the remaining days of the last
+    month from day_totals, so the cost depends on the number of months, not the number of expenses.'''
+    day = date_to_day(date)
+    if day is None:
+        raise ValueError(f'Invalid date: {date!r}')
+    end = datetime.date.fromordinal(day)
+    first_of_month = end.replace(day=1).toordinal()
+    cents = _cur.execute('''SELECT (SELECT IFNULL(SUM(cents), 0) FROM month_totals WHERE month<?)
+                                 + (SELECT IFNULL(SUM(cents), 0) FROM day_totals WHERE day BETWEEN ? AND ?)''',
+                         [end.year * 100 + end.month, first_of_month, day]).fetchone()[0]
+    return cents / 100
+
+def get_data_version(_cur: sqlite3.Cursor) -> tuple[int, int]:
+    '''Return (token, version) for the connected database. The version goes up with every change to
+    an expense or category, and the token differs between databases, so together they identify the
+    data that a cached result was computed from.'''
+    return _cur.execute('SELECT token, version FROM data_version').fetchone()
+
+def _load_cash(_cur: sqlite3.Cursor) -> float:
     return _cur.execute('SELECT cash FROM finance WHERE ROWID=1').fetchone()[0]
 
+def get_cash_amount(_cur: sqlite3.Cursor) -> float:
+    '''Retrive the current cash on hand amount, from the lookup cache when possible.'''
+    return _cached_lookup(_cur, 'cash', _load_cash)
+
+#Query for the cash amount and the newest expenses, which reads only the end of the date index.
+_SELECT_CASH_AND_RECENT = f'''SELECT f.cash, e.* FROM finance f
+                              LEFT JOIN ({_SELECT_EXPENSES} ORDER BY day DESC, id DESC LIMIT ?) e
+                              WHERE f.ROWID=1 ORDER BY e.day DESC, e.id DESC'''
+
+def get_cash_and_recent(_cur: sqlite3.Cursor, count: int = 5) -> tuple[float, list[Expense]]:
+    '''Return the cash on hand and the count most recent expenses, newest first, with a single
+    query, for showing as soon as the app starts.'''
+    rows = _cur.execute(_SELECT_CASH_AND_RECENT, [count]).fetchall()
+    return rows[0][0], [_row_to_expense(row[1:]) for row in rows if row[1] != None]
+
 def set_cash_amount(_db: sqlite3.Connection, _cur: sqlite3.Cursor, new_amount: float):
     '''Update the current amount of cash on hand in the database.'''
     if (type(new_amount) in [int, float]):
         _cur.execute('UPDATE finance SET cash=? WHERE ROWID=1', [new_amount])
-        _db.commit() 
+        _invalidate_cache(_db)
+        _commit(_db) 
+
+def _load_categories(_cur: sqlite3.Cursor) -> dict[str, tuple[int, str]]:
+    return {name: (cat_id, color) for cat_id, name, color in _cur.execute('SELECT id, name, color FROM categories')}
+
+def _categories(_cur: sqlite3.Cursor) -> dict[str, tuple[int, str]]:
+    '''Category ids and colors by name, from the lookup cache when possible.'''
+    return _cached_lookup(_cur, 'categories', _load_categories)
+
+def get_categories(_cur: sqlite3.Cursor) -> dict[str, str]:
+    '''Return the color of every category by name, in the order they were added.'''
+    return {name: color for name, (_, color) in sorted(_categories(_cur).items(), key=lambda item: item[1][0])}
 
 def is_duplicate_category(_cur: sqlite3.Cursor, cat_name: str) -> bool:
     '''Check if a category already exists.'''
-    if _cur.execute('SELECT * FROM categories WHERE name=?', [cat_name]).fetchall() == []:
-        return False
-    return True       
+    return cat_name in _categories(_cur)
 
 def get_category_id(_cur: sqlite3.Cursor, cat_name: str) -> int:
-    '''Search the categories database for a given category and returns its ROWID if it is found.'''
-    cat_id = _cur.execute('SELECT ROWID FROM categories WHERE name=?', [cat_name]).fetchone()
-    if cat_id != None:
-        return cat_id[0]
-    return -1
+    '''Search the categories for a given category and returns its ROWID if it is found, -1 otherwise.'''
+    return _categories(_cur).get(cat_name, (-1, None))[0]
+
+def get_category_color(_cur: sqlite3.Cursor, cat_name: str) -> str | None:
+    '''Return the color code of a category, or None if it does not exist.'''
+    return _categories(_cur).get(cat_name, (-1, None))[1]
+
+def get_cache_stats(_cur: sqlite3.Cursor) -> CacheStats:
+    '''Return the hit, miss and invalidation counts of the connection's lookup cache.'''
+    cache = getattr(_cur.connection, 'cache', None)
+    if cache is None:
+        return CacheStats()
+    with cache.lock:
+        return CacheStats(cache.stats.hits, cache.stats.misses, cache.stats.invalidations)
 
 def add_category(_db: sqlite3.Connection, _cur: sqlite3.Cursor, cat_name: str, cat_color: str) -> None:
     '''Adds a new category to the categories database.'''
-    _cur.execute('INSERT INTO categories VALUES(?, ?)', [cat_name, cat_color])
-    _db.commit()
+    _cur.execute('INSERT INTO categories(name, color) VALUES(?, ?)', [cat_name, cat_color])
+    _invalidate_cache(_db)
+    _commit(_db)
 
 def delete_category(_db: sqlite3.Connection, _cur: sqlite3.Cursor, cat_id: int) -> None:
     '''Deletes a given category from the categories database.
-    Be sure to check the expenses database and adjust any existing entries that used the
-    deleted category afterwards.'''
-    _cur.execute('DELETE FROM categories WHERE ROWID=?', [cat_id])
-    _db.commit()
+    Expenses that used the deleted category are kept and become uncategorized (category '').
+    To delete them as well, call delete_by_category first.'''
+    _cur.execute('DELETE FROM categories WHERE id=?', [cat_id])
+    _invalidate_cache(_db)
+    _commit(_db)
 
 def update_category(_db: sqlite3.Connection, _cur: sqlite3.Cursor, cat_id: int, new_name: str, new_color: str) -> None:
     '''Update the name and color of the category at ROWID = cat_id.
-    Be sure to update the entries in the expenses database that used the previous category
-    after use.'''
-    _cur.execute('UPDATE categories SET name=?, color=? WHERE ROWID=?', [new_name, new_color, cat_id])
-    _db.commit()
+    Expenses refer to their category by id, so they follow the change automatically.'''
+    _cur.execute('UPDATE categories SET name=?, color=? WHERE id=?', [new_name, new_color, cat_id])
+    _invalidate_cache(_db)
+    _commit(_db)
 
 def batch_category_update(_db: sqlite3.Connection,
                           _cur: sqlite3.Cursor,
                           target_cat: str,
                           new_cat_name: str,
                           new_cat_color: str) -> None:
-    '''Updates all expenses of a given category with a new category and color code.'''
-    _cur.execute('UPDATE expenses SET category=?, color=? WHERE category=?', [new_cat_name, new_cat_color, target_cat])
-    _db.commit()
+    '''Updates all expenses of a given category with a new category and color code.
+    If new_cat_name does not exist yet this renames and recolors the category in a single row;
+    otherwise the expenses are merged into new_cat_name, which takes the new color.'''
+    _move_category(_cur, target_cat, new_cat_name)
+    _cur.execute('UPDATE categories SET color=? WHERE name=?', [new_cat_color, new_cat_name])
+    _invalidate_cache(_db)
+    _commit(_db)
 
 def expenses_sort_list_by_category(expenses: list, desc=False) -> list:
     '''Sort the given list of expenses by category name, alphabetically..
-    If desc=True, the list will be sorted in reverse alphabetical order.'''
-    return sorted(expenses, key=lambda x: x[0], reverse=desc)
+    If desc=True, the list will be sorted in reverse alphabetical order.
+    For lists that are not already in memory, use query_expenses(order_by='category') instead.
+    An ExpenseBatch is sorted without creating Expense objects, and a new batch is returned.'''
+    if isinstance(expenses, ExpenseBatch):
+        return expenses.sorted('category', desc)
+    return sorted(expenses, key=attrgetter('category'), reverse=desc)
+
+def _date_sort_key(expense: Expense) -> int:
+    '''Sort key for an expense's date. Invalid dates sort as 1/1/1, like str_to_date.'''
+    return date_to_day(expense.date) or 1
 
 def expenses_sort_list_by_date(expenses: list, desc=False) -> list:
     '''Sort the given list of expenses by posting date, oldest to newest.
-    If desc=True, the list will be sorted from newest to oldest.'''
-    return sorted(expenses, key=lambda x: str_to_date(x[1]), reverse=desc)
+    If desc=True, the list will be sorted from newest to oldest.
+    For lists that are not already in memory, use query_expenses(order_by='date') instead.
+    An ExpenseBatch is sorted without creating Expense objects, and a new batch is returned.'''
+    if isinstance(expenses, ExpenseBatch):
+        return expenses.sorted('date', desc)
+    return sorted(expenses, key=_date_sort_key, reverse=desc)
 
 def expenses_sort_list_by_cost(expenses: list, desc=False) -> list:
     '''Sort the given list of expenses by cost, from least to greatest.
-    If desc=True, the list will be sorted greatest to least.'''
-    return sorted(expenses, key=lambda x: x[2], reverse=desc)
+    If desc=True, the list will be sorted greatest to least.
+    For lists that are not already in memory, use query_expenses(order_by='amount') instead.
+    An ExpenseBatch is sorted without creating Expense objects, and a new batch is returned.'''
+    if isinstance(expenses, ExpenseBatch):
+        return expenses.sorted('amount', desc)
+    return sorted(expenses, key=attrgetter('amount'), reverse=desc)
+
+@contextmanager
+def _unjournaled(_db: sqlite3.Connection, _cur: sqlite3.Cursor, triggers: list[str], schema: str = 'main') -> Iterator[None]:
+    '''Drop the given journal triggers of schema for the changes made in the block, and recreate them
+    after it, all in the transaction in progress, so other connections never see them missing.'''
+    if not triggers:
+        yield
+        return
+    if not _db.in_transaction:
+        _cur.execute('BEGIN')
+    statements = _cur.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type='trigger' AND name IN ({', '.join('?' * len(triggers))})",
+                              triggers).fetchall()
+    for name in triggers:
+        _cur.execute(f'DROP TRIGGER {schema}.{name}')
+    try:
+        yield
+    finally:
+        #After a rollback the triggers are back already.
+        if _db.in_transaction:
+            for (sql,) in statements:
+                _cur.execute(sql.replace('CREATE TRIGGER ', f'CREATE TRIGGER {schema}.', 1))
+
+def _clear_expenses(_cur: sqlite3.Cursor) -> None:
+    '''Delete every expense in one step. With triggers on the table SQLite deletes rows one at a
+    time, so the triggers are dropped for the delete and recreated after it, and the tables they
+    maintain are cleared directly.'''
+    triggers = _cur.execute("SELECT name, sql FROM sqlite_master WHERE type='trigger' AND tbl_name='expenses'").fetchall()
+    for name, _ in triggers:
+        _cur.execute(f'DROP TRIGGER {name}')
+    _cur.execute('DELETE FROM expenses')
+    for table in ['category_month_totals', 'month_totals', 'day_totals']:
+        _cur.execute(f'DELETE FROM {table}')
+    _cur.execute("INSERT INTO expense_search(expense_search) VALUES('delete-all')")
+    _cur.execute('UPDATE data_version SET version=version+1')
+    for _, sql in triggers:
+        _cur.execute(sql)
 
 def reset_db(_db: sqlite3.Connection,_cur: sqlite3.Cursor, default_categories: (list[list[str, str]])) -> None:
     '''Clears the expenses and finance tables, reverting the database to a blank slate.
-    Also reverts all user made categories to the initial defaults.'''
-    _cur.execute('DELETE FROM expenses')
-    _cur.execute('UPDATE finance SET cash=0.00 WHERE ROWID=1')
-    _cur.execute('DELETE FROM categories')
-    if default_categories:
-        for category in default_categories:
-            _cur.execute('INSERT INTO categories VALUES(?, ?)', [category[0], category[1]])
-    _db.commit()
+    Also reverts all user made categories to the initial defaults.
+    The freed space stays in the file for reuse; reclaim_space() gives it back in small steps.
+    Database.reset() is faster still for large files, since it swaps in a new file.'''
+    foreign_keys = None
+    if not _db.in_transaction:
+        #SQLite only empties a table in one step with foreign keys off, which cannot change inside a
+        #transaction. Dropping and recreating the triggers has to be part of the same transaction.
+        foreign_keys = _cur.execute('PRAGMA foreign_keys').fetchone()[0]
+        _cur.execute('PRAGMA foreign_keys=OFF')
+        _cur.execute('BEGIN')
+    try:
+        _clear_expenses(_cur)
+        _cur.execute('DELETE FROM recurring_rules')
+        _cur.execute('UPDATE finance SET cash=0.00 WHERE ROWID=1')
+        _cur.execute('DELETE FROM categories')
+        if default_categories:
+            for category in default_categories:
+                _cur.execute('INSERT OR IGNORE INTO categories(name, color) VALUES(?, ?)', [category[0], category[1]])
+        #A blank slate has no history to undo. The sequence numbers carry on, so readers of
+        #changes_since() notice that the changes they had not read yet are gone.
+        _cur.execute('DELETE FROM change_journal')
+        _cur.execute('DELETE FROM change_groups')
+        _invalidate_cache(_db)
+        _commit(_db)
+    except BaseException:
+        if foreign_keys != None:
+            _db.rollback()
+        raise
+    finally:
+        if foreign_keys != None and id(_db) in _open_units:
+            #Inside unit_of_work() the transaction is still open, so foreign keys are turned back on
+            #after the block commits.
+            _unit_pragmas.setdefault(id(_db), []).append(f'PRAGMA foreign_keys={foreign_keys}')
+        elif foreign_keys != None:
+            _cur.execute(f'PRAGMA foreign_keys={foreign_keys}')
+
+def reclaim_space(_db: sqlite3.Connection, _cur: sqlite3.Cursor, max_pages: int = RECLAIM_BATCH_PAGES) -> int:
+    '''Return up to max_pages unused pages to the file system with an incremental vacuum, which is
+    quick enough to run between other work, unlike a full VACUUM. Returns the number of free pages
+    left, so callers can repeat it until it reaches 0. Files made before auto_vacuum was turned on
+    cannot shrink this way; vacuum_db() converts them once.'''
+    if _cur.execute('PRAGMA auto_vacuum').fetchone()[0] != 2 or _db.in_transaction:
+        return 0
+    #The pragma frees one page per step, and only executescript() steps it to the end.
+    _db.executescript(f'PRAGMA incremental_vacuum({int(max_pages)})')
+    return _cur.execute('PRAGMA freelist_count').fetchone()[0]
+
+def vacuum_db(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> None:
+    '''Rebuild the whole file with VACUUM. This blocks until it is done, but also switches files made
+    by older versions to incremental auto_vacuum, so reclaim_space() works on them afterwards.'''
+    _cur.execute('PRAGMA auto_vacuum=INCREMENTAL')
     _cur.execute('VACUUM')
 
+def archive_expenses(_db: sqlite3.Connection,
+                     _cur: sqlite3.Cursor,
+                     archive_path: str,
+                     before: str,
+                     batch_size: int = ARCHIVE_BATCH_SIZE,
+                     progress: Callable[[int, int], None] | None = None,
+                     journal: bool = True) -> int:
+    '''Move the expenses dated before the MM/DD/YYYY date before into the database file at
+    archive_path, which is created if needed and can be opened like any other database.
+    Expenses are moved batch_size at a time, oldest first, each batch in one transaction, so the
+    database stays usable in between. Categories are matched by name and created in the archive as
+    needed. progress is called with the number moved so far and the total. Returns the number moved.
+    In WAL mode a batch is committed to each file separately, so a crash at that moment can leave
+    it in both; find_duplicates() on the archive lists such rows. Without journal the move is left
+    out of the change journal of both files, so changes_since() does not list it.
+    It commits each batch itself, so it raises a ValueError inside unit_of_work() or while another
+    transaction is open.'''
+    day = date_to_day(before)
+    if day is None:
+        raise ValueError(f'Invalid date: {before!r}')
+    if _db.in_transaction or id(_db) in _open_units:
+        raise ValueError('Expenses cannot be archived inside a transaction or unit of work')
+    archive_db, archive_cur = sql_connect(archive_path)
+    try:
+        init_db(archive_db, archive_cur, [])
+    finally:
+        archive_db.close()
+    total = _cur.execute('SELECT COUNT(*) FROM expenses WHERE day<?', [day]).fetchone()[0]
+    moved = 0
+    _cur.execute('ATTACH DATABASE ? AS archive', [archive_path])
+    try:
+        while moved < total:
+            last = _cur.execute('SELECT day, id FROM expenses WHERE day<? ORDER BY day, id LIMIT 1 OFFSET ?',
+                                [day, batch_size - 1]).fetchone()
+            condition, params = ('day<?', [day]) if last is None else ('day<? AND (day, id)<=(?, ?)', [day, *last])
+            _cur.execute('BEGIN')
+            _cur.execute(f'''INSERT OR IGNORE INTO archive.categories(name, color)
+                             SELECT name, color FROM main.categories
+                             WHERE id IN (SELECT category_id FROM main.expenses WHERE {condition})''', params)
+            with _unjournaled(_db, _cur, [] if journal else ['expenses_journal_insert'], 'archive'):
+                _cur.execute(f'''INSERT INTO archive.expenses(category_id, day, cents, title, content_hash)
+                                 SELECT (SELECT a.id FROM archive.categories a JOIN main.categories c ON a.name=c.name
+                                         WHERE c.id=e.category_id), e.day, e.cents, e.title, e.content_hash
+                                 FROM main.expenses e WHERE {condition} ORDER BY e.day, e.id''', params)
+            with _unjournaled(_db, _cur, [] if journal else ['expenses_journal_delete']):
+                count = _cur.execute(f'DELETE FROM main.expenses WHERE {condition}', params).rowcount
+            #Undoing the move would leave the expenses in both files, so it is not an undo step in
+            #either of them. The archive's triggers journal the copies in its own journal.
+            _close_change_group(_db, 'other')
+            _close_change_group(_db, 'other', 'archive')
+            _db.commit()
+            moved += count
+            if progress:
+                progress(moved, total)
+            if count == 0:
+                break
+    except BaseException:
+        if _db.in_transaction:
+            _db.rollback()
+        raise
+    finally:
+        _cur.execute('DETACH DATABASE archive')
+    return moved
+
+def _occurrence_day(frequency: str, interval: int, start_day: int, number: int) -> int | None:
+    '''Day of occurrence number (counting from 0) of a recurring rule, or None if it falls after
+    12/31/9999. Months are counted from the start day, so a rule starting on the 31st returns to
+    the 31st after shorter months.'''
+    if frequency in ['daily', 'weekly']:
+        day = start_day + number * interval * (7 if frequency == 'weekly' else 1)
+        return day if day <= datetime.date.max.toordinal() else None
+    start = datetime.date.fromordinal(start_day)
+    months = start.month - 1 + number * interval * (12 if frequency == 'yearly' else 1)
+    year, month = start.year + months // 12, months % 12 + 1
+    if year > datetime.MAXYEAR:
+        return None
+    return datetime.date(year, month, min(start.day, calendar.monthrange(year, month)[1])).toordinal()
+
+def _recurring_row(rule: RecurringRule) -> list:
+    '''Convert a rule to the (category, start_day, cents, title, color, frequency, interval, end_day)
+    values it is stored with, raising a ValueError if it is not valid.'''
+    start_day = date_to_day(rule.start)
+    end_day = None if rule.end is None else date_to_day(rule.end)
+    if (rule.frequency not in RECURRING_FREQUENCIES
+            or type(rule.interval) != int or rule.interval < 1
+            or type(rule.amount) not in [int, float]
+            or not isinstance(rule.category, str)
+            or start_day is None
+            or (rule.end != None and end_day is None)):
+        raise ValueError(f'Invalid recurring rule: {rule!r}')
+    return [rule.category, start_day, amount_to_cents(rule.amount), rule.title, rule.color,
+            rule.frequency, rule.interval, end_day]
+
+def add_recurring_rule(_db: sqlite3.Connection, _cur: sqlite3.Cursor, rule: RecurringRule) -> int:
+    '''Store a recurring rule and return its ROWID. No expenses are added until
+    add_recurring_expenses() runs. A category that does not exist yet is created with the rule's
+    color. Raises a ValueError if the rule is not valid.'''
+    row = _recurring_row(rule)
+    _add_missing_categories(_cur, [row[:5]])
+    category, start_day, cents, title, _, frequency, interval, end_day = row
+    _cur.execute('''INSERT INTO recurring_rules(category_id, cents, title, frequency, interval, start_day, end_day, next_day)
+                    VALUES((SELECT id FROM categories WHERE name=?), ?, ?, ?, ?, ?, ?, ?)''',
+                 [category, cents, title, frequency, interval, start_day, end_day,
+                  start_day if end_day is None or start_day <= end_day else None])
+    rule_id = _cur.lastrowid
+    _commit(_db)
+    return rule_id
+
+def get_recurring_rules(_cur: sqlite3.Cursor) -> list[RecurringRule]:
+    '''Return every recurring rule, in the order they were added.'''
+    rows = _cur.execute('''SELECT r.id, IFNULL(c.name, ''), r.cents, r.title, r.frequency, r.interval, r.start_day,
+                                  r.end_day, IFNULL(c.color, '#000000'), r.next_day
+                           FROM recurring_rules r LEFT JOIN categories c ON c.id=r.category_id ORDER BY r.id''')
+    return [RecurringRule(category, cents / 100, title, frequency, day_to_date(start_day), interval,
+                          None if end_day is None else day_to_date(end_day), color, rule_id,
+                          None if next_day is None else day_to_date(next_day))
+            for rule_id, category, cents, title, frequency, interval, start_day, end_day, color, next_day in rows]
+
+def delete_recurring_rule(_db: sqlite3.Connection, _cur: sqlite3.Cursor, rule_id: int) -> None:
+    '''Delete the recurring rule with the given ROWID. The expenses it already added are kept.'''
+    _cur.execute('DELETE FROM recurring_rules WHERE id=?', [rule_id])
+    _commit(_db)
+
+def add_recurring_expenses(_db: sqlite3.Connection, _cur: sqlite3.Cursor, until: str | None = None) -> int:
+    '''Add the expenses of every recurring rule that fall due on or before until (MM/DD/YYYY, today
+    by default) and have not been added yet. Returns the number added.
+    Each rule remembers how many expenses it has added, and that count is updated in the same
+    transaction as the inserts, so running this any number of times, or catching up after months
+    without running it, adds each occurrence exactly once. Everything happens in one transaction,
+    taken before the due rules are read so that two processes cannot both add the same occurrences.'''
+    last = date_to_day(until if until != None else get_today_as_str())
+    if last is None:
+        raise ValueError(f'Invalid date: {until!r}')
+    started = not _db.in_transaction
+    if started:
+        _cur.execute('BEGIN IMMEDIATE')
+    try:
+        rules = _cur.execute('''SELECT id, category_id, cents, title, frequency, interval, start_day, end_day, occurrences
+                                FROM recurring_rules WHERE next_day<=?''', [last]).fetchall()
+        added = 0
+        for rule_id, category_id, cents, title, frequency, interval, start_day, end_day, number in rules:
+            stop = last if end_day is None else min(last, end_day)
+            records = []
+            day = _occurrence_day(frequency, interval, start_day, number)
+            while day != None and day <= stop:
+                records.append((category_id, day, cents, title, expense_hash(day, cents, title)))
+                number += 1
+                day = _occurrence_day(frequency, interval, start_day, number)
+            _cur.executemany('INSERT INTO expenses(category_id, day, cents, title, content_hash) VALUES(?, ?, ?, ?, ?)', records)
+            added += len(records)
+            if day != None and end_day != None and day > end_day:
+                day = None
+            _cur.execute('UPDATE recurring_rules SET occurrences=?, next_day=? WHERE id=?', [number, day, rule_id])
+        _commit(_db)
+    except BaseException:
+        if started and id(_db) not in _open_units:
+            _db.rollback()
+        raise
+    return added
+
+def get_journal_seq(_cur: sqlite3.Cursor) -> int:
+    '''Return the sequence number of the latest change in the journal, 0 if nothing was ever
+    journaled. Read it before reading the data, then pass it to changes_since() to follow up.'''
+    row = _cur.execute("SELECT seq FROM sqlite_sequence WHERE name='change_journal'").fetchone()
+    return row[0] if row != None else 0
+
+def _journal_row(row: tuple) -> Change:
+    seq, group, table, row_id, action, old, new = row
+    return Change(seq, group, table, row_id, action, None if old is None else json.loads(old), None if new is None else json.loads(new))
+
+def changes_since(_cur: sqlite3.Cursor, seq: int = 0, limit: int | None = None) -> Iterator[Change]:
+    '''Iterate over the changes made after the change numbered seq, oldest first, read from the
+    database as they are iterated on a cursor of their own. Raises a ValueError if some of those
+    changes were removed by compact_journal() or reset_db(), in which case the caller has to read
+    the current data again instead.'''
+    first = _cur.execute('SELECT MIN(seq) FROM change_journal').fetchone()[0]
+    if (first if first != None else get_journal_seq(_cur) + 1) > seq + 1:
+        raise ValueError(f'Changes after {seq} are no longer in the journal')
+    return map(_journal_row, _ordered_rows(_cur, 'SELECT seq, group_id, table_name, row_id, action, old, new FROM change_journal',
+                                           [], ['seq'], False, [seq], limit))
+
+def _set_row(_cur: sqlite3.Cursor, table: str, row_id: int, current: dict | None, values: dict | None) -> None:
+    '''Put a journaled row back to values, or delete it if values is None. current is None if the row
+    does not exist now.'''
+    if values is None:
+        _cur.execute(f'DELETE FROM {table} WHERE ROWID=?', [row_id])
+    elif current is None:
+        _cur.execute(f'INSERT INTO {table}(ROWID, {", ".join(values)}) VALUES(?{", ?" * len(values)})', [row_id, *values.values()])
+    else:
+        _cur.execute(f'UPDATE {table} SET {", ".join(f"{column}=?" for column in values)} WHERE ROWID=?', [*values.values(), row_id])
+
+def _replay_group(_db: sqlite3.Connection, _cur: sqlite3.Cursor, group: int, backwards: bool, kind: str) -> int:
+    '''Undo (backwards) or redo the changes of a group in one transaction, journaled as a new group of
+    the given kind. Foreign keys are checked at the commit, since rows come back one at a time.
+    Returns the number of changes replayed.'''
+    #The group is read on a cursor of its own as it is replayed, so a large one is never held in
+    #memory. The entries journaled by the replay are not in the group yet, so they are not read.
+    changes = map(_journal_row, _cur.connection.execute(f'''SELECT seq, group_id, table_name, row_id, action, old, new
+                                                            FROM change_journal WHERE group_id=?
+                                                            ORDER BY seq {'DESC' if backwards else 'ASC'}''', [group]))
+    _cur.execute('PRAGMA defer_foreign_keys=ON')
+    count = 0
+    for change in changes:
+        current, values = (change.new, change.old) if backwards else (change.old, change.new)
+        _set_row(_cur, change.table, change.row_id, current, values)
+        count += 1
+    replayed = _close_change_group(_db, kind)
+    if backwards:
+        _cur.execute('UPDATE change_groups SET undone_by=? WHERE id=?', [replayed, group])
+    else:
+        _cur.execute('UPDATE change_groups SET undone_by=NULL WHERE id=?', [group])
+    _invalidate_cache(_db)
+    _commit(_db)
+    return count
+
+def undo(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> int:
+    '''Undo the most recent commit that has not been undone yet, as one new commit. Can be repeated
+    to go further back, as far as compact_journal() has kept. Returns the number of rows changed
+    back, 0 if there was nothing to undo.'''
+    _close_change_group(_db)
+    row = _cur.execute("SELECT id FROM change_groups WHERE kind='change' AND undone_by IS NULL ORDER BY id DESC LIMIT 1").fetchone()
+    return 0 if row is None else _replay_group(_db, _cur, row[0], True, 'undo')
+
+def redo(_db: sqlite3.Connection, _cur: sqlite3.Cursor) -> int:
+    '''Redo the most recently undone commit. Nothing can be redone once a new change is made.
+    Returns the number of rows changed, 0 if there was nothing to redo.'''
+    _close_change_group(_db)
+    row = _cur.execute("SELECT id FROM change_groups WHERE kind='change' AND undone_by IS NOT NULL ORDER BY undone_by DESC LIMIT 1").fetchone()
+    return 0 if row is None else _replay_group(_db, _cur, row[0], False, 'redo')
+
+def compact_journal(_db: sqlite3.Connection, _cur: sqlite3.Cursor, keep: int = JOURNAL_KEEP_GROUPS) -> int:
+    '''Delete the journal entries of all but the keep most recent commits. Undo can only go back as
+    far as the commits kept, and changes_since() raises for earlier sequence numbers.
+    Returns the number of entries deleted.'''
+    row = _cur.execute('SELECT id FROM change_groups ORDER BY id DESC LIMIT 1 OFFSET ?', [keep]).fetchone()
+    if row is None:
+        return 0
+    deleted = _cur.execute('DELETE FROM change_journal WHERE group_id<=?', [row[0]]).rowcount
+    _cur.execute('DELETE FROM change_groups WHERE id<=?', [row[0]])
+    _commit(_db)
+    return deleted
+
+def connection_arguments(function: Callable | None) -> tuple[str, ...]:
+    '''The connection parameters a function starts with: ('_db', '_cur'), ('_cur',), or () for
+    anything else. Decorated functions are checked by the function they wrap.'''
+    arguments = getattr(getattr(inspect.unwrap(function), '__code__', None), 'co_varnames', ()) if function else ()
+    if arguments[:2] == ('_db', '_cur'):
+        return ('_db', '_cur')
+    if arguments[:1] == ('_cur',):
+        return ('_cur',)
+    return ()
+
+class Database:
+    '''Owns the connections to one database file, so that it can be used from several threads.
+    Writes go through a single connection, one at a time. Reads use a separate connection for each
+    thread, which in WAL mode see the last committed data without waiting for the writer.
+    In-memory databases only exist on one connection, so their reads share the writer instead.
+
+    The module functions that take a connection and cursor are available as methods without those
+    arguments: db.add_expense(expense), db.get_cash_amount(), list(db.query_expenses(limit=5)).'''
+
+    def __init__(self, data: str) -> None:
+        self.data = data
+        self._in_memory = data in ['', ':memory:'] or data.startswith('file::memory:')
+        self._write_lock = threading.RLock()
+        self._cache = LookupCache()
+        self._writer = self._connect()
+        self._local = threading.local()
+        self._readers: list[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        #Goes up when reset() replaces the file, so each thread knows to reopen its read connection.
+        self._generation = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        '''Open and configure a connection that may be handed between threads.'''
+        _db = sqlite3.connect(self.data, check_same_thread=False, factory=_Connection)
+        #Every connection shares one cache, so a change made by the writer clears it for the readers too.
+        _db.cache = self._cache
+        _configure_connection(_db)
+        return _db
+
+    @contextmanager
+    def writer(self) -> Iterator[tuple[sqlite3.Connection, sqlite3.Cursor]]:
+        '''Hold the write connection for a group of changes, which are committed together when the
+        block exits (see unit_of_work). Other threads wait for their writes until then.'''
+        with self._write_lock, unit_of_work(self._writer):
+            yield self._writer, self._writer.cursor()
+
+    def reader(self) -> tuple[sqlite3.Connection, sqlite3.Cursor]:
+        '''Return the calling thread's read connection and cursor, opening it on first use.'''
+        if self._in_memory:
+            return self._writer, self._writer.cursor()
+        if getattr(self._local, 'generation', None) != self._generation:
+            _db = self._connect()
+            _db.execute('PRAGMA query_only=ON')
+            with self._readers_lock:
+                self._readers.append(_db)
+            self._local.connection = _db
+            self._local.cursor = _db.cursor()
+            self._local.generation = self._generation
+        return self._local.connection, self._local.cursor
+
+    def call(self, function: Callable, *args, **kwargs):
+        '''Call a function that takes (_db, _cur, ...) on the write connection, or one that takes
+        (_cur, ...) on a read connection, e.g. db.call(cash_on_hand_io.export_expenses, path).
+        Writes commit as they normally would, but only one runs at a time.'''
+        arguments = connection_arguments(function)
+        if arguments == ('_db', '_cur'):
+            with self._write_lock:
+                return function(self._writer, self._writer.cursor(), *args, **kwargs)
+        if arguments != ('_cur',):
+            raise TypeError(f'{function.__name__} does not take a database connection')
+        if self._in_memory:
+            with self._write_lock:
+                return function(self._writer.cursor(), *args, **kwargs)
+        return function(self.reader()[1], *args, **kwargs)
+
+    def __getattr__(self, name: str) -> Callable:
+        '''Look up a module function and bind it to this database's connections.'''
+        function = globals().get(name)
+        if name.startswith('_') or not connection_arguments(function):
+            raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+        @wraps(function)
+        def method(*args, **kwargs):
+            #Looked up on each call, so that functions replaced later (e.g. by instrumentation) are used.
+            return self.call(globals()[name], *args, **kwargs)
+        setattr(self, name, method)
+        return method
+
+    def close(self) -> None:
+        '''Close the write connection and every thread's read connection.'''
+        with self._readers_lock:
+            for _db in self._readers:
+                _db.close()
+            self._readers.clear()
+        with self._write_lock:
+            self._writer.close()
+
+    def reset(self, default_categories: list[list[str]]) -> None:
+        '''Revert to a blank slate like reset_db(), but by swapping in a newly made file, which takes
+        the same short time however large the old one was. Other threads must not be reading at the
+        time; their read connections are reopened on next use. In-memory databases use reset_db().'''
+        if self._in_memory:
+            self.call(reset_db, default_categories)
+            return
+        with self._write_lock:
+            fresh = self.data + '.new'
+            for path in [fresh, fresh + '-wal', fresh + '-shm']:
+                if os.path.exists(path):
+                    os.remove(path)
+            seq = get_journal_seq(self._writer.cursor())
+            _db, _cur = sql_connect(fresh)
+            try:
+                init_db(_db, _cur, default_categories)
+                #Like reset_db(), leave no history and carry the sequence numbers on, so that readers
+                #of changes_since() notice that the changes they had not read yet are gone.
+                _cur.execute('DELETE FROM change_journal')
+                _cur.execute('DELETE FROM change_groups')
+                _cur.execute("UPDATE sqlite_sequence SET seq=MAX(seq, ?) WHERE name='change_journal'", [seq])
+                _db.commit()
+            finally:
+                _db.close()
+            self.close()
+            os.replace(fresh, self.data)
+            #A write-ahead log left by the old file must not be applied to the new one.
+            for suffix in ['-wal', '-shm']:
+                if os.path.exists(self.data + suffix):
+                    os.remove(self.data + suffix)
+            self._generation += 1
+            self._writer = self._connect()
+            self._cache.clear()
+
 def main() -> None:
     pass
 
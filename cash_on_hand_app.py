@@ -1,7 +1,35 @@
+import sys
+import time
+#Taken before the other imports, so the startup timing includes them.
+started = time.perf_counter()
 import PySimpleGUI as sg
 import cash_on_hand_api as db_api
+from cash_on_hand_service import Coalescer, DataService, changed_values
 
-config = {'Font': ('any', 15)}
+config = {'Font': ('any', 15),
+          'Database': 'cash_on_hand.db',
+          'Default Categories': [['Food', '#004400'], ['Bills', '#660000'], ['Pet Supplies', '#440044']],
+          'Quick Entry Category': 'Food',
+          'Expenses Page Size': 100,
+          #Records timings of database calls and shows them in a Debug tab. Calls slower than
+          #'Slow Call ms' are logged with their query plans.
+          'Debug': False,
+          'Slow Call ms': 100,
+          #Prints how long startup took until the Home tab showed its data, then exits, with status 1
+          #if that took longer than 'Startup Target ms'. Also turned on by --startup-timing.
+          'Startup Timing': '--startup-timing' in sys.argv,
+          'Startup Target ms': 1000}
+
+#Milliseconds from start to each step of startup, for the startup timing mode.
+startup_times = {'imports': (time.perf_counter() - started) * 1000}
+
+if config['Debug']:
+    import cash_on_hand_stats
+    cash_on_hand_stats.enable(config['Slow Call ms'])
+
+database = db_api.Database(config['Database'])
+database.init_db(config['Default Categories'])
+startup_times['database'] = (time.perf_counter() - started) * 1000
 
 quick_entry_keys_layout = [
                             [sg.Button('$1', size=[6,1], key='1'), sg.Button('$5', size=[6,1], key='5'), sg.Button('$10', size=[6,1], key='10')],
@@ -18,38 +46,297 @@ recent_expenses_layout = [
                             [sg.Push(), sg.Text('', size=(45,1), justification='center', key='RECENT5'), sg.Push()]
                         ]
 
-main_window_layout = [[sg.Push(), sg.Text(f'${0.00:.2f}'), sg.Push()],
+main_window_layout = [[sg.Push(), sg.Text(f'${0.00:.2f}', key='CASH'), sg.Push()],
                      [sg.Frame(title='', layout=recent_expenses_layout, relief='flat')],
                      [sg.Push()],
                      [sg.Frame(title='',layout=quick_entry_keys_layout), sg.Push()]]
 
-all_expenses_layout = [
-                        [sg.Push(), sg.Text('PLACEHOLDER'), sg.Push()]
-                      ]
+#The other tabs start empty. Their layouts are made by these functions and added the first time the
+#tab is opened, and only then is their data loaded.
+def all_expenses_layout() -> list[list]:
+    return [
+            [sg.Text('Search'), sg.Input(size=(30,1), enable_events=True, key='SEARCH')],
+            [sg.Table(values=[], headings=['Date', 'Category', 'Amount', 'Title'], num_rows=15,
+                      auto_size_columns=False, col_widths=[11, 14, 10, 24], key='EXPENSES_LIST')],
+            [sg.Text('Repeat'), sg.Combo([], size=(12,1), key='RECURRING_CATEGORY'),
+             sg.Input(size=(8,1), key='RECURRING_AMOUNT'), sg.Input(size=(14,1), key='RECURRING_TITLE'),
+             sg.Combo(db_api.RECURRING_FREQUENCIES, default_value='monthly', readonly=True, key='RECURRING_FREQUENCY'),
+             sg.Button('Add', size=[6,1], key='RECURRING_ADD')],
+            [sg.Button('Undo', size=[6,1], key='UNDO'), sg.Button('Redo', size=[6,1], key='REDO')]
+           ]
 
-expense_analysis_layout = [
-                        [sg.Push(), sg.Text('PLACEHOLDER'), sg.Push()]
-                          ]
+analysis_views = ['Weekly', 'Monthly', 'Yearly', 'Rolling 30 days', 'Year over year']
+
+def expense_analysis_layout() -> list[list]:
+    return [
+            [sg.Combo(analysis_views, default_value='Monthly', readonly=True, enable_events=True, key='ANALYSIS_VIEW')],
+            [sg.Table(values=[], headings=['Period', 'Total', 'Count', 'Median', 'Top category'], num_rows=15,
+                      auto_size_columns=False, col_widths=[11, 10, 7, 10, 22], key='ANALYSIS_TABLE')]
+           ]
+
+transfer_file_types = (('CSV', '*.csv'), ('JSON Lines', '*.jsonl'))
 
-export_import_layout = [
-                        [sg.Push(), sg.Text('PLACEHOLDER'), sg.Push()]
-                       ]
+def export_import_layout() -> list[list]:
+    return [
+            [sg.Text('Export expenses')],
+            [sg.Input(size=(30,1), key='EXPORT_PATH'),
+             sg.FileSaveAs('Browse', file_types=transfer_file_types, default_extension='.csv'),
+             sg.Button('Export', size=[6,1], key='EXPORT')],
+            [sg.Text('Import expenses')],
+            [sg.Input(size=(30,1), key='IMPORT_PATH'),
+             sg.FileBrowse('Browse', file_types=transfer_file_types),
+             sg.Button('Import', size=[6,1], key='IMPORT')],
+            [sg.Text('Archive expenses before'), sg.Input(size=(10,1), key='ARCHIVE_BEFORE')],
+            [sg.Input(size=(30,1), key='ARCHIVE_PATH'),
+             sg.FileSaveAs('Browse', file_types=(('Database', '*.db'),), default_extension='.db'),
+             sg.Button('Archive', size=[6,1], key='ARCHIVE')],
+            [sg.ProgressBar(100, orientation='h', size=(30,20), key='TRANSFER_PROGRESS')],
+            [sg.Text('', size=(45,1), key='TRANSFER_STATUS')]
+           ]
+
+def debug_layout() -> list[list]:
+    return [
+            [sg.Multiline(size=(90,15), disabled=True, font=('Courier', 10), key='STATS')],
+            [sg.Button('Refresh', size=[8,1], key='STATS_REFRESH'), sg.Button('Reset', size=[8,1], key='STATS_RESET')]
+           ]
+
+#Layout function of each lazily built tab, keyed by the tab's key. The rows go in the tab's '_BODY' column.
+lazy_tabs = {'EXPENSES_TAB': all_expenses_layout,
+             'ANALYSIS_TAB': expense_analysis_layout,
+             'TRANSFER_TAB': export_import_layout}
+if config['Debug']:
+    lazy_tabs['DEBUG_TAB'] = debug_layout
+#Tabs whose layout has been added.
+built_tabs = set()
+
+def lazy_tab(title: str, key: str) -> sg.Tab:
+    return sg.Tab(title=title, layout=[[sg.Column([], pad=(0,0), key=f'{key}_BODY')]], key=key)
+
+tabs = [sg.Tab(title='     Home    ', layout=main_window_layout, key='HOME_TAB'),
+        lazy_tab('   Expenses  ', 'EXPENSES_TAB'),
+        lazy_tab('   Analysis  ', 'ANALYSIS_TAB'),
+        lazy_tab('Export/Import', 'TRANSFER_TAB')]
+if config['Debug']:
+    tabs.append(lazy_tab('    Debug    ', 'DEBUG_TAB'))
 
 tabs_layout = [
-                [sg.TabGroup([[sg.Tab(title='     Home    ', layout=main_window_layout),
-                               sg.Tab(title='   Expenses  ',layout=all_expenses_layout),
-                               sg.Tab(title='   Analysis  ', layout=expense_analysis_layout),
-                               sg.Tab(title='Export/Import', layout=export_import_layout)]
-                               ])]
+                [sg.TabGroup([tabs], enable_events=True, key='TABS')]
               ]
 
 window = sg.Window(title='CASH_APP_BETA',
                    layout=tabs_layout,
                    font=config['Font'])
 
+quick_entry_keys = ['1', '5', '10', '20', '50', '100']
+
+def format_expense(expense: db_api.Expense) -> str:
+    '''One line summary of an expense for the Recent Expenses list.'''
+    return f'{expense.date}  {expense.category}  ${expense.amount:.2f}  {expense.title}'
+
+def load_home(_cur) -> dict[str, str]:
+    '''Read the values shown on the Home tab: the cash on hand and the five most recent expenses.'''
+    cash, expenses = db_api.get_cash_and_recent(_cur, 5)
+    recent = [format_expense(expense) for expense in expenses]
+    recent += [''] * (5 - len(recent))
+    home = {f'RECENT{number}': text for number, text in enumerate(recent, start=1)}
+    home['CASH'] = f'${cash:.2f}'
+    return home
+
+def load_expenses(_cur, search: str = '') -> dict[str, list]:
+    '''Read the first page of the Expenses tab, newest first, or the best matches for the search text,
+    and the category names offered for recurring expenses.'''
+    if search.strip():
+        expenses = db_api.search_expenses(_cur, search, limit=config['Expenses Page Size'])
+    else:
+        expenses = db_api.query_expenses(_cur, order_by='date', desc=True, limit=config['Expenses Page Size'])
+    return {'EXPENSES_LIST': [[expense.date, expense.category, f'${expense.amount:.2f}', expense.title] for expense in expenses],
+            'RECURRING_CATEGORY': list(db_api.get_categories(_cur))}
+
+def load_analysis(_cur, view: str) -> list[list[str]]:
+    '''Rows of the Analysis tab for one of analysis_views.'''
+    #Imported on first use rather than at startup, since it loads NumPy when that is installed.
+    import cash_on_hand_analytics as analytics
+    if view == 'Rolling 30 days':
+        return [[date, f'${total:.2f}', '', '', ''] for date, total in reversed(analytics.rolling_totals(_cur, 30))]
+    if view == 'Year over year':
+        return [[f'{month.month:02d}/{month.year}', f'${month.total:.2f}', '', '',
+                 '' if month.change is None else f'{month.change:+.0%} vs {month.year - 1}']
+                for month in reversed(analytics.year_over_year(_cur))]
+    period = {'Weekly': 'week', 'Monthly': 'month', 'Yearly': 'year'}[view]
+    rows = []
+    for summary in reversed(analytics.spending_by_period(_cur, period)):
+        top = max(summary.shares, key=summary.shares.get, default=None)
+        rows.append([summary.start, f'${summary.total:.2f}', str(summary.count), f'${summary.median:.2f}',
+                     f'{top or "Uncategorized"} ({summary.shares.get(top, 0.0):.0%})'])
+    return rows
+
+def add_recurring_rule(_db, _cur, values: dict) -> int:
+    '''Store a rule starting today from the Repeat row of the Expenses tab, and add its first expense.'''
+    rule = db_api.RecurringRule(values['RECURRING_CATEGORY'], float(values['RECURRING_AMOUNT']), values['RECURRING_TITLE'],
+                                values['RECURRING_FREQUENCY'], db_api.get_today_as_str())
+    db_api.add_recurring_rule(_db, _cur, rule)
+    return db_api.add_recurring_expenses(_db, _cur)
+
+def add_quick_expense(_db, _cur, amount: float) -> None:
+    '''Record the total of the quick entry buttons as one expense dated today.'''
+    db_api.add_expense(_db, _cur, db_api.Expense(config['Quick Entry Category'], db_api.get_today_as_str(), amount, 'Quick entry'))
+
+window.finalize()
+startup_times['window'] = (time.perf_counter() - started) * 1000
+service = DataService(database, window.write_event_value)
+#Quick entry presses add up until Add is pressed, and are only saved then.
+quick_entry = Coalescer(None, lambda total: service.submit('QUICK_SAVED', add_quick_expense, total))
+#Values currently displayed in the window, so that refreshes only update the elements that changed.
+shown = {}
+
+def load_tab(key: str) -> None:
+    '''Reload the data shown on a tab in the background.'''
+    if key == 'HOME_TAB':
+        service.submit('HOME_LOADED', load_home)
+    elif key == 'EXPENSES_TAB':
+        service.submit('EXPENSES_LOADED', load_expenses, window['SEARCH'].get())
+    elif key == 'ANALYSIS_TAB':
+        service.submit('ANALYSIS_LOADED', load_analysis, window['ANALYSIS_VIEW'].get())
+
+def open_tab(key: str) -> None:
+    '''Add the layout of a lazily built tab the first time it is opened, and load its data.'''
+    if key in lazy_tabs and key not in built_tabs:
+        window.extend_layout(window[f'{key}_BODY'], lazy_tabs[key]())
+        built_tabs.add(key)
+        load_tab(key)
+
+def refresh() -> None:
+    '''Reload the Home tab and the other tabs that have been opened, in the background.'''
+    for key in ['HOME_TAB', *built_tabs]:
+        load_tab(key)
+
+def show_pending_amount() -> None:
+    window['AMT'].update(f'${quick_entry.pending:.2f}' if quick_entry.pending else '')
+
+def report_transfer_progress(done: int, total: int) -> None:
+    '''Progress callback for exports and imports. Runs on the worker thread, so it only posts an event.'''
+    window.write_event_value('TRANSFER_PROGRESSED', (done, total))
+
+def report_startup() -> bool:
+    '''Print the time from start to each step of startup. Returns False if the Home tab took longer
+    than the target to show its data.'''
+    for step, ms in startup_times.items():
+        print(f'{step:12} {ms:8.1f} ms')
+    within_target = startup_times['first paint'] <= config['Startup Target ms']
+    if not within_target:
+        print(f'Startup took longer than the target of {config["Startup Target ms"]} ms')
+    return within_target
+
+#The Home tab is loaded first, so it shows its data before anything else runs. Recurring expenses that
+#fell due while the app was closed are added next, refreshing the window again if there were any.
+load_tab('HOME_TAB')
+service.submit('RECURRING_ADDED', db_api.add_recurring_expenses)
+service.submit('JOURNAL_COMPACTED', db_api.compact_journal)
+exit_status = 0
 while True:
     event, values = window.read()
     if event == sg.WIN_CLOSED:
         break
+    if event == 'TABS':
+        open_tab(values['TABS'])
+    elif event in quick_entry_keys:
+        quick_entry.add(float(event))
+        show_pending_amount()
+    elif event == 'ADD':
+        quick_entry.flush()
+    elif event == 'QUICK_SAVED':
+        show_pending_amount()
+        if isinstance(values[event], Exception):
+            sg.popup_error(f'Could not add the quick entry expense: {values[event]}')
+        else:
+            refresh()
+    elif event == 'HOME_LOADED' and isinstance(values[event], Exception):
+        if config['Startup Timing'] and 'first paint' not in startup_times:
+            print(f'Loading the Home tab failed: {values[event]}')
+            exit_status = 1
+            break
+    elif event == 'HOME_LOADED':
+        for key, value in changed_values(shown, values[event]).items():
+            window[key].update(value)
+        if 'first paint' not in startup_times:
+            window.refresh()
+            startup_times['first paint'] = (time.perf_counter() - started) * 1000
+            if config['Startup Timing']:
+                exit_status = 0 if report_startup() else 1
+                break
+    elif event == 'RECURRING_ADD' and values['RECURRING_AMOUNT']:
+        service.submit('RECURRING_ADDED', add_recurring_rule, values)
+    elif event == 'RECURRING_ADDED':
+        if isinstance(values[event], Exception):
+            sg.popup_error(f'Could not add recurring expenses: {values[event]}')
+        elif values[event]:
+            refresh()
+    elif event == 'UNDO':
+        service.submit('UNDONE', db_api.undo)
+    elif event == 'REDO':
+        service.submit('UNDONE', db_api.redo)
+    elif event == 'UNDONE' and not isinstance(values[event], Exception) and values[event]:
+        refresh()
+    elif event == 'SEARCH':
+        service.submit('EXPENSES_LOADED', load_expenses, values['SEARCH'])
+    elif event == 'EXPENSES_LOADED' and not isinstance(values[event], Exception):
+        for key, value in changed_values(shown, values[event]).items():
+            if key == 'RECURRING_CATEGORY':
+                #Replacing the choices clears the selection, so it is put back.
+                window[key].update(values=value, value=window[key].get())
+            else:
+                window[key].update(values=value)
+    elif event == 'ANALYSIS_VIEW':
+        service.submit('ANALYSIS_LOADED', load_analysis, values['ANALYSIS_VIEW'])
+    elif event == 'ANALYSIS_LOADED' and not isinstance(values[event], Exception):
+        if changed_values(shown, {'ANALYSIS_TABLE': values[event]}):
+            window['ANALYSIS_TABLE'].update(values=values[event])
+    elif event == 'EXPORT' and values['EXPORT_PATH']:
+        import cash_on_hand_io as db_io
+        window['TRANSFER_STATUS'].update('Exporting...')
+        service.submit('EXPORTED', db_io.export_expenses, values['EXPORT_PATH'], progress=report_transfer_progress)
+    elif event == 'IMPORT' and values['IMPORT_PATH']:
+        import cash_on_hand_io as db_io
+        window['TRANSFER_STATUS'].update('Importing...')
+        service.submit('IMPORTED', db_io.import_expenses, values['IMPORT_PATH'], progress=report_transfer_progress)
+    elif event == 'ARCHIVE' and values['ARCHIVE_PATH'] and values['ARCHIVE_BEFORE']:
+        window['TRANSFER_STATUS'].update('Archiving...')
+        service.submit('ARCHIVED', db_api.archive_expenses, values['ARCHIVE_PATH'], values['ARCHIVE_BEFORE'],
+                       progress=report_transfer_progress)
+    elif event == 'ARCHIVED':
+        if isinstance(values[event], Exception):
+            window['TRANSFER_STATUS'].update(f'Archive failed: {values[event]}')
+        else:
+            window['TRANSFER_STATUS'].update(f'Archived {values[event]} expenses.')
+            refresh()
+            service.submit('SPACE_RECLAIMED', db_api.reclaim_space)
+    elif event == 'SPACE_RECLAIMED':
+        #Give the freed space back a little at a time, so other work can run in between.
+        if not isinstance(values[event], Exception) and values[event] > 0:
+            service.submit('SPACE_RECLAIMED', db_api.reclaim_space)
+    elif event == 'TRANSFER_PROGRESSED':
+        done, total = values[event]
+        window['TRANSFER_PROGRESS'].update(current_count=done, max=max(total, 1))
+    elif event == 'EXPORTED':
+        if isinstance(values[event], Exception):
+            window['TRANSFER_STATUS'].update(f'Export failed: {values[event]}')
+        else:
+            window['TRANSFER_STATUS'].update(f'Exported {values[event]} expenses.')
+    elif event == 'IMPORTED':
+        if isinstance(values[event], Exception):
+            window['TRANSFER_STATUS'].update(f'Import failed: {values[event]}')
+        else:
+            result = values[event]
+            window['TRANSFER_STATUS'].update(f'Imported {result.inserted} expenses, skipped {result.duplicates} duplicates '
+                                             f'and {result.rejected} invalid rows.')
+            refresh()
+    elif event == 'STATS_REFRESH':
+        window['STATS'].update(cash_on_hand_stats.format_stats(cash_on_hand_stats.get_stats()))
+    elif event == 'STATS_RESET':
+        cash_on_hand_stats.reset_stats()
+        window['STATS'].update('')
 
-window.close()
\ No newline at end of file
+service.close()
+window.close()
+database.close()
+sys.exit(exit_status)
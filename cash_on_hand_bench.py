@@ -0,0 +1,241 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import asdict, dataclass
+from itertools import accumulate, islice
+import cash_on_hand_api as db_api
+
+#Categories used by the generator, most common first. Their weights fall off as 1/rank.
+BENCH_CATEGORIES = [['Food', '#004400'], ['Bills', '#660000'], ['Fuel', '#444400'], ['Pet Supplies', '#440044'],
+                    ['Entertainment', '#004444'], ['Clothing', '#222266'], ['Gifts', '#662222'], ['Medical', '#226622']]
+
+BENCH_TITLES = ['Groceries', 'Lunch', 'Coffee', 'Rent', 'Electric bill', 'Gas', 'Dog food', 'Movie tickets',
+                'Shoes', 'Birthday present', 'Pharmacy', 'Takeout', 'Internet', 'Phone bill', '']
+
+#Rows inserted per add_expenses() call while loading a benchmark database.
+LOAD_BATCH_SIZE = 10000
+
+#Most expenses read into memory for the sort and memory benchmarks.
+SORT_LIMIT = 100000
+
+@dataclass
+class BenchResult:
+    name: str
+    storage: str
+    rows: int
+    #Number of timed calls, and the number of expenses they handled between them.
+    calls: int
+    items: int
+    seconds: float
+    items_per_second: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+    #Memory taken by what one call returned, for the benchmarks that measure it.
+    result_bytes: int = 0
+
+def generate_expenses(count: int,
+                      seed: int = 0,
+                      duplicate_rate: float = 0.02,
+                      start_date: str = '01/01/2015',
+                      days: int = 3650) -> Iterator[db_api.Expense]:
+    '''Yield count random but reproducible expenses for the given seed.
+    Categories are skewed so the first few in BENCH_CATEGORIES are much more common, dates spread over
+    days days from start_date with more of them towards the end, and amounts are mostly small with a
+    long tail. About duplicate_rate of the expenses repeat one of the last hundred generated.'''
+    rng = random.Random(seed)
+    cum_weights = list(accumulate(1 / rank for rank in range(1, len(BENCH_CATEGORIES) + 1)))
+    first_day = db_api.date_to_day(start_date)
+    recent = deque(maxlen=100)
+    for _ in range(count):
+        if recent and rng.random() < duplicate_rate:
+            expense = recent[rng.randrange(len(recent))]
+        else:
+            name, color = rng.choices(BENCH_CATEGORIES, cum_weights=cum_weights)[0]
+            day = first_day + int(days * rng.random() ** 0.5)
+            amount = max(round(rng.lognormvariate(3, 1), 2), 0.01)
+            expense = db_api.Expense(name, db_api.day_to_date(day), amount, rng.choice(BENCH_TITLES), color)
+        recent.append(expense)
+        yield expense
+
+def _percentile(ordered: list[float], fraction: float) -> float:
+    '''Nearest-rank percentile of an already sorted, non-empty list.'''
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def _summarize(name: str, storage: str, rows: int, latencies: list[float], items: int | None = None) -> BenchResult:
+    '''Turn the seconds taken by each call into a result. items defaults to one per call.'''
+    ordered = sorted(latencies)
+    seconds = sum(ordered)
+    items = len(ordered) if items == None else items
+    return BenchResult(name, storage, rows, len(ordered), items, seconds,
+                       items / seconds if seconds else 0.0,
+                       _percentile(ordered, 0.50) * 1000, _percentile(ordered, 0.95) * 1000,
+                       _percentile(ordered, 0.99) * 1000, ordered[-1] * 1000)
+
+def _time_each(function: Callable, arguments: Iterable[tuple]) -> list[float]:
+    '''Call function once with each tuple of arguments and return how long each call took.'''
+    latencies = []
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def _result_bytes(function: Callable, *args) -> int:
+    '''Memory allocated by one call of function that is still held by its result.'''
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = function(*args)
+        held = tracemalloc.get_traced_memory()[0] - before
+        del result
+        return held
+    finally:
+        tracemalloc.stop()
+
+def _load(_db: sqlite3.Connection, _cur: sqlite3.Cursor, rows: int, seed: int) -> list[float]:
+    '''Fill the database with rows generated expenses and return the time taken by each batch.'''
+    expenses = generate_expenses(rows, seed)
+    batches = iter(lambda: list(islice(expenses, LOAD_BATCH_SIZE)), [])
+    return _time_each(lambda batch: db_api.add_expenses(_db, _cur, batch, batch_size=LOAD_BATCH_SIZE),
+                      ((batch,) for batch in batches))
+
+def bench_database(_db: sqlite3.Connection,
+                   _cur: sqlite3.Cursor,
+                   storage: str,
+                   rows: int,
+                   seed: int = 0,
+                   samples: int = 1000) -> list[BenchResult]:
+    '''Load rows expenses into an empty database and time the main API calls on it, sampling each
+    one up to samples times. reset_db() runs last, so the database is empty again afterwards.'''
+    rng = random.Random(seed)
+    db_api.init_db(_db, _cur, BENCH_CATEGORIES)
+    results = [_summarize('add_expenses', storage, rows, _load(_db, _cur, rows, seed), rows)]
+
+    new_expenses = [(_db, _cur, expense) for expense in generate_expenses(samples, seed + 1, duplicate_rate=0)]
+    results.append(_summarize('add_expense', storage, rows, _time_each(db_api.add_expense, new_expenses)))
+
+    total = rows + samples
+    existing = [(_cur, db_api.get_expense(_cur, rng.randint(1, total))) for _ in range(samples)]
+    results.append(_summarize('find_expense_id', storage, rows, _time_each(db_api.find_expense_id, existing)))
+
+    categories = [(_cur, BENCH_CATEGORIES[number % len(BENCH_CATEGORIES)][0]) for number in range(min(samples, 4 * len(BENCH_CATEGORIES)))]
+    results.append(_summarize('search_by_category', storage, rows, _time_each(db_api.search_by_category, categories)))
+
+    for order_by in ['date', 'category', 'amount']:
+        pages = [(_cur, order_by, rng.random() < 0.5) for _ in range(min(samples, 100))]
+        latencies = _time_each(lambda _cur, order_by, desc: list(db_api.query_expenses(_cur, order_by, desc, limit=50)), pages)
+        results.append(_summarize(f'query_expenses_{order_by}', storage, rows, latencies, 50 * len(pages)))
+
+    #Lists of Expense objects against ExpenseBatch columns, for the same expenses.
+    views = [('list', lambda: list(db_api.query_expenses(_cur, limit=SORT_LIMIT))),
+             ('batch', lambda: db_api.query_expense_batch(_cur, limit=SORT_LIMIT))]
+    for kind, read in views:
+        latencies = _time_each(read, [()])
+        in_memory = read()
+        result = _summarize(f'read_{kind}', storage, rows, latencies, len(in_memory))
+        result.result_bytes = _result_bytes(read)
+        results.append(result)
+        for sort in [db_api.expenses_sort_list_by_category, db_api.expenses_sort_list_by_date, db_api.expenses_sort_list_by_cost]:
+            latencies = _time_each(sort, [(in_memory,), (in_memory, True)])
+            name = sort.__name__ if kind == 'list' else f'{sort.__name__}_{kind}'
+            results.append(_summarize(name, storage, rows, latencies, 2 * len(in_memory)))
+
+    latencies = _time_each(db_api.reset_db, [(_db, _cur, BENCH_CATEGORIES)])
+    results.append(_summarize('reset_db', storage, rows, latencies, total))
+    return results
+
+def run_benchmarks(sizes: Iterable[int],
+                   storages: Iterable[str] = ('memory', 'disk'),
+                   seed: int = 0,
+                   samples: int = 1000,
+                   directory: str | None = None) -> list[BenchResult]:
+    '''Benchmark a fresh database for each number of rows in sizes and each storage: 'memory' for
+    :memory: databases, 'disk' for a file in a temporary folder inside directory.'''
+    results = []
+    for rows in sizes:
+        for storage in storages:
+            with tempfile.TemporaryDirectory(dir=directory) as folder:
+                data = ':memory:' if storage == 'memory' else os.path.join(folder, 'bench.db')
+                _db, _cur = db_api.sql_connect(data)
+                try:
+                    results += bench_database(_db, _cur, storage, rows, seed, samples)
+                finally:
+                    _db.close()
+    return results
+
+def _git_commit() -> str | None:
+    '''The commit of the checked out code, if it is in a git repository.'''
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+def save_results(path: str, results: list[BenchResult], seed: int) -> None:
+    '''Write results as JSON, along with what is needed to compare them with another run.'''
+    report = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+              'commit': _git_commit(),
+              'python': platform.python_version(),
+              'sqlite': sqlite3.sqlite_version,
+              'machine': platform.platform(),
+              'seed': seed,
+              'results': [asdict(result) for result in results]}
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+def load_results(path: str) -> list[BenchResult]:
+    '''Read the results saved by save_results().'''
+    with open(path, encoding='utf-8') as file:
+        return [BenchResult(**result) for result in json.load(file)['results']]
+
+def compare_results(old: list[BenchResult], new: list[BenchResult]) -> list[tuple[str, str, int, float]]:
+    '''Pair up results for the same benchmark, storage and size, and return the ratio of new to old
+    median latency for each. Ratios above 1 are slower than before.'''
+    baseline = {(result.name, result.storage, result.rows): result for result in old}
+    ratios = []
+    for result in new:
+        before = baseline.get((result.name, result.storage, result.rows))
+        if before != None and before.p50_ms > 0:
+            ratios.append((result.name, result.storage, result.rows, result.p50_ms / before.p50_ms))
+    return ratios
+
+def _print_results(results: list[BenchResult]) -> None:
+    print(f'{"benchmark":40} {"storage":7} {"rows":>9} {"items/s":>12} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"MB":>8}')
+    for result in results:
+        print(f'{result.name:40} {result.storage:7} {result.rows:9} {result.items_per_second:12.0f} '
+              f'{result.p50_ms:9.3f} {result.p95_ms:9.3f} {result.p99_ms:9.3f}'
+              + (f' {result.result_bytes / 1e6:8.1f}' if result.result_bytes else ''))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the Cash on Hand database API on synthetic expenses.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000], help='database sizes to benchmark')
+    parser.add_argument('--storage', nargs='+', choices=['memory', 'disk'], default=['memory', 'disk'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--samples', type=int, default=1000, help='timed calls per benchmark')
+    parser.add_argument('--directory', help='where to create on-disk databases')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results to compare against')
+    arguments = parser.parse_args()
+
+    results = run_benchmarks(arguments.rows, arguments.storage, arguments.seed, arguments.samples, arguments.directory)
+    _print_results(results)
+    save_results(arguments.output, results, arguments.seed)
+    if arguments.compare:
+        for name, storage, rows, ratio in compare_results(load_results(arguments.compare), results):
+            print(f'{name:34} {storage:7} {rows:9} {ratio:6.2f}x{"  SLOWER" if ratio > 1.2 else ""}')
+
+if __name__ == '__main__':
+    main()
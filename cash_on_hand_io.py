@@ -0,0 +1,140 @@
+import csv
+import json
+import os
+import sqlite3
+from collections.abc import Callable, Iterator
+from itertools import islice
+import cash_on_hand_api as db_api
+
+#Columns written to and read from export files, in order.
+FIELDS = ['category', 'date', 'amount', 'title', 'color']
+
+#Number of rows read from the database or from a file at a time.
+CHUNK_SIZE = 5000
+
+#Called with the amount of work done so far and the total, for showing a progress bar.
+#Exports count rows, imports count bytes of the file read.
+ProgressCallback = Callable[[int, int], None]
+
+def file_format(path: str) -> str:
+    '''Guess the format of an export file from its extension: 'jsonl' for .jsonl, .ndjson and .json
+    files, 'csv' for everything else.'''
+    if os.path.splitext(path)[1].lower() in ['.jsonl', '.ndjson', '.json']:
+        return 'jsonl'
+    return 'csv'
+
+def _cents_to_str(cents: int) -> str:
+    '''Format an amount in cents as a dollar amount with exactly two decimals.'''
+    sign = '-' if cents < 0 else ''
+    return f'{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}'
+
+def _export_rows(_cur: sqlite3.Cursor) -> Iterator[list]:
+    '''Yield every expense as [category, date, amount, title, color] strings, in the order they were
+    added. Rows are fetched CHUNK_SIZE at a time from a cursor of their own.'''
+    rows = _cur.connection.execute('SELECT category, day, cents, title, color FROM expense_details ORDER BY id')
+    while chunk := rows.fetchmany(CHUNK_SIZE):
+        for category, day, cents, title, color in chunk:
+            yield [category, db_api.day_to_date(day), _cents_to_str(cents), title, color]
+
+def export_expenses(_cur: sqlite3.Cursor,
+                    path: str,
+                    fmt: str | None = None,
+                    progress: ProgressCallback | None = None) -> int:
+    '''Write every expense to a CSV (with a header row) or JSON Lines file, depending on fmt or
+    the file extension. Memory use does not depend on the number of expenses.
+    Returns the number of expenses written.'''
+    fmt = fmt or file_format(path)
+    total = _cur.execute('SELECT COUNT(*) FROM expenses').fetchone()[0]
+    written = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        if fmt == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(FIELDS)
+            write = writer.writerow
+        else:
+            write = lambda row: file.write(json.dumps(dict(zip(FIELDS, row))) + '\n')
+        rows = _export_rows(_cur)
+        while chunk := list(islice(rows, CHUNK_SIZE)):
+            for row in chunk:
+                write(row)
+            written += len(chunk)
+            if progress:
+                progress(written, total)
+    return written
+
+def _parse_amount(text: str) -> float | str:
+    '''Convert an amount read from a file to a number. Text that is not a number is returned as is,
+    so that the expense is rejected by the insert, which also rejects 'nan', 'inf' and amounts too
+    large to store.'''
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return text
+
+def _expense_from_values(values: list) -> db_api.Expense | None:
+    '''Build an Expense from [category, date, amount, title, color] values read from a file.'''
+    if len(values) < 3:
+        return None
+    category, date, amount = values[0], values[1], values[2]
+    title = values[3] if len(values) > 3 and values[3] is not None else ''
+    color = values[4] if len(values) > 4 and values[4] else '#000000'
+    return db_api.Expense(category, date, _parse_amount(amount), title, color)
+
+def _read_lines(path: str, progress: ProgressCallback | None) -> Iterator[str]:
+    '''Yield the lines of a UTF-8 file, reporting the number of bytes read so far to progress.'''
+    total = os.path.getsize(path)
+    done = 0
+    with open(path, 'rb') as file:
+        for count, line in enumerate(file, start=1):
+            done += len(line)
+            if progress and count % CHUNK_SIZE == 0:
+                progress(done, total)
+            yield line.decode('utf-8-sig' if count == 1 else 'utf-8')
+    if progress:
+        progress(total, total)
+
+def _read_csv(lines: Iterator[str]) -> Iterator[db_api.Expense | None]:
+    '''Parse CSV lines into expenses. The header row decides the column order; missing optional
+    columns get their default values.'''
+    reader = csv.reader(lines)
+    header = [name.strip().lower() for name in next(reader, [])]
+    if not all(name in header for name in FIELDS[:3]):
+        raise ValueError(f'CSV file must have the columns {", ".join(FIELDS[:3])}')
+    positions = [header.index(name) if name in header else None for name in FIELDS]
+    for row in reader:
+        if not row:
+            continue
+        yield _expense_from_values([row[i] if i is not None and i < len(row) else None for i in positions])
+
+def _read_jsonl(lines: Iterator[str]) -> Iterator[db_api.Expense | None]:
+    '''Parse JSON Lines into expenses, one object per line.'''
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        if not isinstance(record, dict):
+            yield None
+            continue
+        yield _expense_from_values([record.get(name) for name in FIELDS])
+
+def import_expenses(_db: sqlite3.Connection,
+                    _cur: sqlite3.Cursor,
+                    path: str,
+                    fmt: str | None = None,
+                    skip_duplicates: bool = True,
+                    progress: ProgressCallback | None = None,
+                    journal: bool = True) -> db_api.BulkInsertResult:
+    '''Add the expenses from a CSV or JSON Lines file made by export_expenses, depending on fmt or the
+    file extension. The file is read and inserted CHUNK_SIZE rows at a time, each chunk in one
+    transaction. Rows with an invalid date or amount are rejected. With skip_duplicates, rows that
+    match an existing expense or an earlier row are skipped and counted as duplicates. Without
+    journal the rows are left out of the change journal, see db_api.add_expenses().'''
+    fmt = fmt or file_format(path)
+    lines = _read_lines(path, progress)
+    expenses = _read_csv(lines) if fmt == 'csv' else _read_jsonl(lines)
+    return db_api.add_expenses(_db, _cur, expenses, batch_size=CHUNK_SIZE, skip_duplicates=skip_duplicates,
+                                journal=journal)
@@ -0,0 +1,84 @@
+import queue
+import threading
+from collections.abc import Callable
+import cash_on_hand_api as db_api
+
+#Posts a result back to the GUI, e.g. window.write_event_value(event, value).
+PostCallback = Callable[[str, object], None]
+
+class DataService:
+    '''Runs database calls on a background thread so the window's event loop never waits for them.
+    Each job's return value, or the exception it raised, is posted back with the job's event name.
+    Jobs run one at a time in the order they were submitted.'''
+
+    def __init__(self, database: db_api.Database, post: PostCallback) -> None:
+        self.database = database
+        self.post = post
+        self._jobs: queue.Queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='DataService', daemon=True)
+        self._worker.start()
+
+    def submit(self, event: str, function: Callable, *args, **kwargs) -> None:
+        '''Queue a call of function on the database (see Database.call). When it finishes, its result
+        is posted as the value of event.'''
+        self._jobs.put((event, function, args, kwargs))
+
+    def _run(self) -> None:
+        while (job := self._jobs.get()) is not None:
+            event, function, args, kwargs = job
+            try:
+                result = self.database.call(function, *args, **kwargs)
+            except Exception as error:
+                result = error
+            self.post(event, result)
+
+    def close(self, timeout: float | None = None) -> None:
+        '''Finish the queued jobs and stop the worker thread.'''
+        self._jobs.put(None)
+        self._worker.join(timeout)
+
+class Coalescer:
+    '''Adds up values that arrive in quick succession, such as repeated presses of the quick entry
+    buttons, and passes the total to on_flush when flush() is called. With a delay, the total is also
+    passed on once nothing new has arrived for delay seconds, on a timer thread.'''
+
+    def __init__(self, delay: float | None, on_flush: Callable[[float], None]) -> None:
+        self.delay = delay
+        self.on_flush = on_flush
+        self._total = 0.0
+        self._timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+
+    def add(self, value: float) -> float:
+        '''Add a value and restart the delay, if there is one. Returns the pending total.'''
+        with self._lock:
+            self._total += value
+            if self._timer:
+                self._timer.cancel()
+            if self.delay != None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            return self._total
+
+    def flush(self) -> None:
+        '''Pass the pending total to on_flush now, if there is one.'''
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            total, self._total = self._total, 0.0
+        if total:
+            self.on_flush(total)
+
+    @property
+    def pending(self) -> float:
+        return self._total
+
+def changed_values(shown: dict[str, object], latest: dict[str, object]) -> dict[str, object]:
+    '''Compare the values last shown in the window's elements with the latest ones. Returns only the
+    elements whose value changed, and records them in shown, so that a refresh only updates what
+    actually differs.'''
+    changes = {key: value for key, value in latest.items() if shown.get(key, object()) != value}
+    shown.update(changes)
+    return changes
@@ -0,0 +1,211 @@
+import logging
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Callable
+from dataclasses import dataclass, field, replace
+from functools import wraps
+from types import ModuleType
+import cash_on_hand_api as db_api
+import cash_on_hand_io as db_io
+
+logger = logging.getLogger('cash_on_hand.stats')
+
+#Upper bounds of the latency histogram buckets, in milliseconds. The last bucket counts everything slower.
+HISTOGRAM_BOUNDS_MS = [0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000]
+
+#Most statements kept for one call, to be explained if the call turns out to be slow.
+MAX_TRACED_STATEMENTS = 20
+
+@dataclass
+class FunctionStats:
+    calls: int = 0
+    errors: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    histogram: list[int] = field(default_factory=lambda: [0] * (len(HISTOGRAM_BOUNDS_MS) + 1))
+    statements: int = 0
+    commits: int = 0
+    #Rows inserted, updated or deleted by the calls' own statements, not counting the rows that
+    #triggers wrote for them, and rows in the lists the calls returned.
+    rows_changed: int = 0
+    rows_returned: int = 0
+    slow_calls: int = 0
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.calls if self.calls else 0.0
+
+#Wrapped functions, keyed by (module, name), with the function each one replaced.
+_originals: dict[tuple[ModuleType, str], Callable] = {}
+_stats: dict[str, FunctionStats] = {}
+_stats_lock = threading.Lock()
+#Each thread's stack of calls in progress, as [name, statements, rows changed] lists.
+_calls = threading.local()
+_slow_ms = 100.0
+
+def _current_calls() -> list[list]:
+    if not hasattr(_calls, 'stack'):
+        _calls.stack = []
+    return _calls.stack
+
+def _function_stats(name: str) -> FunctionStats:
+    '''The stats for a function name, created on first use. Call with _stats_lock held.'''
+    if name not in _stats:
+        _stats[name] = FunctionStats()
+    return _stats[name]
+
+def _count_statement(rowcount: int) -> None:
+    '''Count a statement run by an API function, and the rows it changed, against the innermost
+    instrumented call on the thread that ran it.'''
+    stack = _current_calls()
+    if stack:
+        stack[-1][2] += max(rowcount, 0)
+    with _stats_lock:
+        _function_stats(stack[-1][0] if stack else '(outside API calls)').statements += 1
+
+class _CountingCursor(sqlite3.Cursor):
+    '''Cursor of instrumented connections. Its rowcount only covers the statement's own changes, so
+    rows written by triggers are not counted.'''
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        super().execute(sql, parameters)
+        _count_statement(self.rowcount)
+        return self
+
+    def executemany(self, sql: str, parameters) -> sqlite3.Cursor:
+        super().executemany(sql, parameters)
+        _count_statement(self.rowcount)
+        return self
+
+    def executescript(self, script: str) -> sqlite3.Cursor:
+        super().executescript(script)
+        _count_statement(0)
+        return self
+
+def _trace(statement: str) -> None:
+    '''Trace callback for instrumented connections: counts commits and keeps the statements of the
+    innermost instrumented call on the thread that ran it, to explain them if it is slow. SQLite also
+    traces the statements run by triggers and by FTS5 itself, so statements are counted by the
+    cursor instead.'''
+    stack = _current_calls()
+    if stack and len(stack[-1][1]) < MAX_TRACED_STATEMENTS and not statement.startswith('--'):
+        stack[-1][1].append(statement)
+    if statement.startswith('COMMIT'):
+        with _stats_lock:
+            _function_stats(stack[-1][0] if stack else '(outside API calls)').commits += 1
+
+def instrument_connection(_db: sqlite3.Connection) -> None:
+    '''Count the statements, changed rows and commits of a connection. Connections opened after
+    enable() are instrumented automatically; use this for ones that were already open. Statements
+    and rows are only counted on cursors made afterwards, and only for connections made by
+    cash_on_hand_api.'''
+    _db.set_trace_callback(_trace)
+    if hasattr(_db, 'cursor_class'):
+        _db.cursor_class = _CountingCursor
+
+def _connection_of(args: tuple) -> sqlite3.Connection | None:
+    if args and isinstance(args[0], sqlite3.Connection):
+        return args[0]
+    if args and isinstance(args[0], sqlite3.Cursor):
+        return args[0].connection
+    return None
+
+def _explain(_db: sqlite3.Connection, statements: list[str]) -> list[str]:
+    '''EXPLAIN QUERY PLAN each distinct query a slow call ran, as readable lines.'''
+    lines = []
+    for statement in dict.fromkeys(statements):
+        if (statement.split(None, 1) or [''])[0].upper() not in ['SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE']:
+            continue
+        try:
+            plan = _db.execute(f'EXPLAIN QUERY PLAN {statement}').fetchall()
+        except sqlite3.Error as error:
+            plan = [(0, 0, 0, f'(could not explain: {error})')]
+        lines.append(statement)
+        lines += [f'    {row[3]}' for row in plan]
+    return lines
+
+def _record(name: str, elapsed_ms: float, failed: bool, changed: int, result, slow: bool) -> None:
+    with _stats_lock:
+        stats = _function_stats(name)
+        stats.calls += 1
+        stats.errors += failed
+        stats.total_ms += elapsed_ms
+        stats.max_ms = max(stats.max_ms, elapsed_ms)
+        stats.histogram[bisect_left(HISTOGRAM_BOUNDS_MS, elapsed_ms)] += 1
+        stats.rows_changed += changed
+        stats.rows_returned += len(result) if isinstance(result, list) else 0
+        stats.slow_calls += slow
+
+def _instrumented(name: str, function: Callable) -> Callable:
+    '''Wrap an API function so that each call is timed and counted under name.'''
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        _db = _connection_of(args)
+        stack = _current_calls()
+        stack.append([name, [], 0])
+        failed, result = True, None
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            _, statements, changed = stack.pop()
+            changed = 0 if failed else changed
+            slow = elapsed_ms >= _slow_ms
+            _record(name, elapsed_ms, failed, changed, result, slow)
+            if slow and _db:
+                stack.append(['(explaining slow calls)', [], 0])
+                try:
+                    plan = _explain(_db, statements)
+                finally:
+                    stack.pop()
+                logger.warning('Slow call %s took %.1f ms\n%s', name, elapsed_ms, '\n'.join(plan))
+    return wrapper
+
+def enable(slow_ms: float = 100.0, modules: tuple[ModuleType, ...] = (db_api, db_io)) -> None:
+    '''Start recording stats for every function in modules that takes a connection or cursor, and
+    for every statement run on connections opened from now on. Calls taking slow_ms or longer are
+    logged with the query plans of their statements. Calling it again only changes slow_ms.'''
+    global _slow_ms
+    _slow_ms = slow_ms
+    for module in modules:
+        for name, function in list(vars(module).items()):
+            if name.startswith('_') or (module, name) in _originals or not db_api.connection_arguments(function):
+                continue
+            _originals[(module, name)] = function
+            setattr(module, name, _instrumented(f'{module.__name__}.{name}', function))
+    if instrument_connection not in db_api.CONNECTION_HOOKS:
+        db_api.CONNECTION_HOOKS.append(instrument_connection)
+
+def disable() -> None:
+    '''Put back the original functions and stop instrumenting new connections. Connections that
+    are already instrumented keep counting statements until they are closed.'''
+    for (module, name), function in _originals.items():
+        setattr(module, name, function)
+    _originals.clear()
+    if instrument_connection in db_api.CONNECTION_HOOKS:
+        db_api.CONNECTION_HOOKS.remove(instrument_connection)
+
+def is_enabled() -> bool:
+    return bool(_originals)
+
+def get_stats() -> dict[str, FunctionStats]:
+    '''A snapshot of the stats recorded so far, keyed by 'module.function'.'''
+    with _stats_lock:
+        return {name: replace(stats, histogram=stats.histogram.copy()) for name, stats in _stats.items()}
+
+def reset_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+def format_stats(stats: dict[str, FunctionStats]) -> str:
+    '''A plain text table of stats, slowest total time first, for showing in a debug panel.'''
+    lines = [f'{"function":40} {"calls":>7} {"mean ms":>9} {"max ms":>9} {"stmts":>7} {"commits":>7} {"changed":>8} {"slow":>5}']
+    for name, item in sorted(stats.items(), key=lambda entry: entry[1].total_ms, reverse=True):
+        lines.append(f'{name:40} {item.calls:7} {item.mean_ms:9.2f} {item.max_ms:9.2f} {item.statements:7} '
+                     f'{item.commits:7} {item.rows_changed:8} {item.slow_calls:5}')
+    return '\n'.join(lines)
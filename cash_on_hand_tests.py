@@ -1,5 +1,18 @@
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
 import unittest
+from unittest import mock
+import cash_on_hand_accounts
+import cash_on_hand_analytics
 import cash_on_hand_api
+import cash_on_hand_bench
+import cash_on_hand_io
+import cash_on_hand_service
+import cash_on_hand_stats
+from itertools import product
 from random import randint
 
 class DatabaseTests(unittest.TestCase):
@@ -12,12 +25,13 @@ class DatabaseTests(unittest.TestCase):
         self.db, self.cur = cash_on_hand_api.sql_connect(':memory:')
         cash_on_hand_api.init_db(self.db, self.cur, self.default_cats)
         #Expenses setup
-        self.cur.execute('INSERT INTO expenses VALUES("Food", "1/1/2021", 42.50, "Weekly Groceries", "#004400")')
-        self.cur.execute('INSERT INTO expenses VALUES("Food", "9/12/2020", 350.12, "Way too much pizza", "#004400")')
-        self.cur.execute('INSERT INTO expenses VALUES("Bills", "5/5/2020", 600.00, "Rent", "#660000")')
-        self.cur.execute('INSERT INTO expenses VALUES("Food", "9/9/1900", 10.00, "Monthly Groceries", "#004400")')
-        self.cur.execute('INSERT INTO expenses VALUES("DEMO_CAT", "1/1/1111", 11.11, "TEST_DUPES", "#111111")')
-        self.cur.execute('INSERT INTO expenses VALUES("DEMO_CAT", "1/1/1111", 11.11, "TEST_DUPES", "#111111")')
+        cash_on_hand_api.add_expenses(self.db, self.cur,
+                                      [cash_on_hand_api.Expense('Food', '1/1/2021', 42.50, 'Weekly Groceries', '#004400'),
+                                       cash_on_hand_api.Expense('Food', '9/12/2020', 350.12, 'Way too much pizza', '#004400'),
+                                       cash_on_hand_api.Expense('Bills', '5/5/2020', 600.00, 'Rent', '#660000'),
+                                       cash_on_hand_api.Expense('Food', '9/9/1900', 10.00, 'Monthly Groceries', '#004400'),
+                                       cash_on_hand_api.Expense('DEMO_CAT', '1/1/1111', 11.11, 'TEST_DUPES', '#111111'),
+                                       cash_on_hand_api.Expense('DEMO_CAT', '1/1/1111', 11.11, 'TEST_DUPES', '#111111')])
         #Finance setup
         self.cur.execute('UPDATE finance SET cash=500.00 WHERE ROWID=1')
         self.db.commit()
@@ -32,22 +46,27 @@ class DatabaseTests(unittest.TestCase):
                          None,
                          'add_expense should not return anything.')
         #Test that the added value was successfully added to the database.
-        self.assertEqual(self.cur.execute('''SELECT * FROM expenses WHERE 
-                         category="Pet Supplies" AND date="1/2/2020" AND amount=50.00 
-                         AND title="Dog toys" AND color="#440044"''').fetchone(),
-                         ('Pet Supplies', '1/2/2020', 50.00, 'Dog toys', '#440044'),
+        self.assertEqual(cash_on_hand_api.get_expense(self.cur, 7),
+                         cash_on_hand_api.Expense('Pet Supplies', '01/02/2020', 50.00, 'Dog toys', '#440044'),
                          'Expense data was not added to the database successfully.')
+        #Dates and amounts are stored as day numbers and cents
+        self.assertEqual(self.cur.execute('SELECT day, cents FROM expenses WHERE ROWID=7').fetchone(),
+                         (737426, 5000),
+                         'Expense date and amount were not converted for storage.')
+        #Expenses with an invalid date or amount should be refused
+        with self.assertRaises(ValueError):
+            cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', '13/45/2020', 1.00))
+        with self.assertRaises(ValueError):
+            cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', '1/2/2020', 'Poodle'))
         
     def test_expense_deletion(self) -> None:
         #Delete an expense from the database and test that the delete method does not return a value
         self.assertEqual(cash_on_hand_api.delete_expense(self.db, self.cur, 1), None,
                          'delete_expense should not return anything.')
         #Test that the deleted expense no longer exists in the database
-        self.assertEqual(self.cur.execute('''SELECT * FROM expenses WHERE
-                                          category="Food" AND date="1/1/2021" AND amount=42.50
-                                          AND title="Weekly Groceries" AND color="#004400"''').fetchone(),
-                                          None,
-                                          'Target expense was not deleted.')
+        self.assertEqual(cash_on_hand_api.get_expense(self.cur, 1),
+                         None,
+                         'Target expense was not deleted.')
         
     def test_deletion_with_duplicates(self) -> None:
         #Delete an expense from the database and test that the delete method does not return a value.
@@ -57,15 +76,15 @@ class DatabaseTests(unittest.TestCase):
                          'delete_expense should not return anything.')
         #Test that the duplicate of the deleted expense still exists. There were two instances of the expense,
         #so there should be exactly 1 instance remaining.
-        self.assertEqual(len(self.cur.execute('''SELECT * FROM expenses WHERE
-                                          category="DEMO_CAT" AND date="1/1/1111" AND amount=11.11
+        self.assertEqual(len(self.cur.execute('''SELECT * FROM expense_details WHERE
+                                          category="DEMO_CAT" AND day=405419 AND cents=1111
                                           AND title="TEST_DUPES" AND color="#111111"''').fetchall()),
                                           1,
                                           'Only one instance of a duplicate expense should be deleted.')   
 
     def test_expense_id_search(self) -> None:
-        target_id = self.cur.execute('''SELECT ROWID FROM expenses WHERE
-                                     category="Food" AND date="1/1/2021" AND amount=42.50 AND title="Weekly Groceries" AND color="#004400"''').fetchone()[0]
+        target_id = self.cur.execute('''SELECT id FROM expense_details WHERE
+                                     category="Food" AND cents=4250 AND title="Weekly Groceries" AND color="#004400"''').fetchone()[0]
         #Test that searching for the expense in ROWID=1 successfully returns a value of 1
         self.assertEqual(cash_on_hand_api.find_expense_id(self.cur,
                                                       cash_on_hand_api.Expense('Food', '1/1/2021', 42.50, 'Weekly Groceries', '#004400')),
@@ -77,6 +96,63 @@ class DatabaseTests(unittest.TestCase):
                                                       -1,
                                                       'Incorrect expense ROWID returned: expecting -1.\nFound an expense that does not exist in the database.')
 
+    def test_search_expenses(self) -> None:
+        titles = lambda expenses: [expense.title for expense in expenses]
+        self.assertEqual(titles(cash_on_hand_api.search_expenses(self.cur, 'piz')), ['Way too much pizza'],
+                         'Search should match the start of title words.')
+        self.assertEqual(titles(cash_on_hand_api.search_expenses(self.cur, 'groceries', order_by='date')),
+                         ['Weekly Groceries', 'Monthly Groceries'], 'Date order should list the newest first.')
+        self.assertEqual(titles(cash_on_hand_api.search_expenses(self.cur, 'food groc', start='1/1/2000')),
+                         ['Weekly Groceries'], 'Words may match the category, and dates should filter.')
+        self.assertEqual(len(cash_on_hand_api.search_expenses(self.cur, 'bills', min_amount=100, max_amount=1000)), 1,
+                         'Amount filters should apply to category matches.')
+        self.assertEqual(titles(cash_on_hand_api.search_expenses(self.cur, '', limit=2, offset=1)), ['Way too much pizza', 'Rent'],
+                         'Empty text should page through every expense, newest first.')
+        self.assertEqual(cash_on_hand_api.search_expenses(self.cur, '"pizza OR'), [], 'Search syntax should not leak into the query.')
+        for text, order_by in product(['', 'groceries', 'food'], ['rank', 'date']):
+            last, pages = None, []
+            while page := cash_on_hand_api.search_expenses(self.cur, text, order_by=order_by, limit=1, after=last):
+                pages += page
+                last = page[-1]
+            self.assertEqual(pages, cash_on_hand_api.search_expenses(self.cur, text, order_by=order_by),
+                             f'Paging {text!r} by {order_by} with after should continue where the last page ended.')
+        #The index follows inserts, updates, deletes and category changes
+        cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', '2/1/2021', 12.00, 'Pizza night'))
+        cash_on_hand_api.update_expense(self.db, self.cur, 2, cash_on_hand_api.Expense('Food', '9/12/2020', 350.12, 'Sushi'))
+        self.assertEqual(titles(cash_on_hand_api.search_expenses(self.cur, 'pizza')), ['Pizza night'], 'Index is out of date.')
+        cash_on_hand_api.delete_expense(self.db, self.cur, 7)
+        self.assertEqual(cash_on_hand_api.search_expenses(self.cur, 'pizza'), [], 'Deleted expenses should not be found.')
+        cash_on_hand_api.update_category(self.db, self.cur, 1, 'Meals', '#004400')
+        self.assertEqual(len(cash_on_hand_api.search_expenses(self.cur, 'meals')), 3, 'Renamed categories should be searchable.')
+
+    def test_find_duplicates(self) -> None:
+        self.assertEqual(cash_on_hand_api.find_duplicates(self.cur), [[5, 6]], 'The duplicated DEMO_CAT expense was not found.')
+        cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Bills', '5/5/2020', 600.00, 'Rent', '#660000'))
+        cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', '5/5/2020', 600.00, 'Rent', '#004400'))
+        self.assertEqual(cash_on_hand_api.find_duplicates(self.cur),
+                         [[3, 7], [5, 6]],
+                         'Expenses that only differ by category should not be reported as duplicates.')
+        #Moving expenses between categories keeps their content hash valid
+        cash_on_hand_api.update_expense_category_group(self.db, self.cur, 'Food', 'Bills')
+        self.assertEqual(cash_on_hand_api.find_duplicates(self.cur), [[3, 7, 8], [5, 6]], 'Merged duplicates were not found.')
+        self.assertEqual(cash_on_hand_api.find_expense_id(self.cur, cash_on_hand_api.Expense('Bills', '9/9/1900', 10.00, 'Monthly Groceries', '#660000')),
+                         4,
+                         'Expenses should be found after their category changed.')
+        #Expenses added with plain SQL get a hash from rehash_expenses
+        self.cur.execute('INSERT INTO expenses(category_id, day, cents, title) VALUES(3, 405419, 1111, "TEST_DUPES")')
+        self.assertEqual(cash_on_hand_api.rehash_expenses(self.db, self.cur), 1, 'Only the expense without a hash should be updated.')
+        self.assertEqual(cash_on_hand_api.find_duplicates(self.cur)[-1], [5, 6, 9], 'Rehashed expense was not found as a duplicate.')
+
+    def test_skip_duplicates(self) -> None:
+        result = cash_on_hand_api.add_expenses(self.db, self.cur,
+                                               [cash_on_hand_api.Expense('Bills', '5/5/2020', 600.00, 'Rent'),
+                                                cash_on_hand_api.Expense('Bills', '6/5/2020', 600.00, 'Rent'),
+                                                cash_on_hand_api.Expense('Bills', '06/05/2020', 600.00, 'Rent')],
+                                               skip_duplicates=True)
+        self.assertEqual(result,
+                         cash_on_hand_api.BulkInsertResult(inserted=1, duplicates=2),
+                         'Expenses matching an existing or earlier expense should be skipped.')
+
     def test_expense_update(self) -> None:
         #Update the expense and check that the update method is not returning a value
         self.assertEqual(cash_on_hand_api.update_expense(self.db, self.cur, 1,
@@ -84,14 +160,13 @@ class DatabaseTests(unittest.TestCase):
                                                      None,
                                                      'update_expense should not return a value')
         #Check that the values of the expense were properly updated
-        self.assertEqual(self.cur.execute('''SELECT * FROM expenses WHERE
-                                          category="Food" AND date="1/1/2021" AND amount=420.50 AND title="Party Supplies" AND color="#004400"''').fetchone(),
-                                          ('Food', '1/1/2021', 420.50, 'Party Supplies', '#004400'),
+        self.assertEqual(cash_on_hand_api.get_expense(self.cur, 1),
+                                          cash_on_hand_api.Expense('Food', '01/01/2021', 420.50, 'Party Supplies', '#004400'),
                                           '''Failed to update expense. Unable to find the intended updated expense:\n
                                           (Food, 1/1/2021, 420.50, Party Supplies, #004400).''')
         #Check that the original target expense is no longer still in the database
-        self.assertEqual(self.cur.execute('''SELECT * FROM expenses WHERE
-                                          category="Food" AND date="1/1/2021" AND amount=42.50 AND title="Weekly Groceries" AND color="#004400"''').fetchone(),
+        self.assertEqual(self.cur.execute('''SELECT * FROM expense_details WHERE
+                                          category="Food" AND cents=4250 AND title="Weekly Groceries" AND color="#004400"''').fetchone(),
                                           None,
                                           '''Failed to update expense. The original target expense:\n
                                           (Food, 1/1/2021, 42.50, Weekly Groceries, #004400)\n
@@ -99,32 +174,32 @@ class DatabaseTests(unittest.TestCase):
         
     def test_expense_category_update(self) -> None:
         #Get the number of entries in the database with a category of 'Food'
-        num_entries = len(self.cur.execute('SELECT * FROM expenses WHERE category="Food"').fetchall())
+        num_entries = len(self.cur.execute('SELECT * FROM expense_details WHERE category="Food"').fetchall())
         #Update an expense category and check that the update meethod does not return a value
         self.assertEqual(cash_on_hand_api.update_expense_category_group(self.db, self.cur, 'Food', 'Some Stuff'),
                          None,
                          'update_expense_category_group should not return a value.')
         #Check that the same number of expenses for the new 'Some Stuff' category is equal
         #to the number of 'Food' category entries that were originally present
-        self.assertEqual(len(self.cur.execute('SELECT * FROM expenses WHERE category="Some Stuff"').fetchall()),
+        self.assertEqual(len(self.cur.execute('SELECT * FROM expense_details WHERE category="Some Stuff"').fetchall()),
                          num_entries,
                          f'''Failed to update category "Food" to "Some Stuff":\n
                          Number of "Some Stuff" entries does not match the number of original "Food" entries{num_entries}''')
         #Check that the updated entries no longer have a category of 'Food'
-        self.assertNotEqual(len(self.cur.execute('SELECT * FROM expenses WHERE category="Food"').fetchall()),
+        self.assertNotEqual(len(self.cur.execute('SELECT * FROM expense_details WHERE category="Food"').fetchall()),
                             num_entries,
                             '''The number of entries in the updated category "Food" is unchanged.''')
         
     def test_update_expense_color(self) -> None:
         #Get the number of entries with the original 'Food' category color of '#004400'.
-        num_entries = len(self.cur.execute('SELECT * FROM expenses WHERE category="Food" AND color="#004400"').fetchall())
+        num_entries = len(self.cur.execute('SELECT * FROM expense_details WHERE category="Food" AND color="#004400"').fetchall())
         #Update the 'Food' category color and check that the update method returns None
         self.assertEqual(cash_on_hand_api.update_expense_category_color(self.db, self.cur, 'Food', '#FFFFFF'),
                          None,
                          'update_expense_category_color should not return a value.')
         #Confirm that the number of 'Food' entries with the new color of '#FFFFFF' is equal to the original
         #number of entries with color='#004400'.
-        self.assertEqual(len(self.cur.execute('SELECT * FROM expenses WHERE category="Food" AND color="#FFFFFF"').fetchall()),
+        self.assertEqual(len(self.cur.execute('SELECT * FROM expense_details WHERE category="Food" AND color="#FFFFFF"').fetchall()),
                          num_entries,
                          'The number of updated "Food" entries should be equal to the original number of "Food" entries.')
         
@@ -136,7 +211,14 @@ class DatabaseTests(unittest.TestCase):
 
     def test_get_cash_amt(self) -> None:
         self.assertEqual(cash_on_hand_api.get_cash_amount(self.cur), 500.00, 'Did not get the correct cash amount.')
-    
+
+    def test_cash_and_recent(self) -> None:
+        #One query should return what get_cash_amount and the newest page of query_expenses do
+        self.assertEqual(cash_on_hand_api.get_cash_and_recent(self.cur, 5),
+                         (500.00, list(cash_on_hand_api.query_expenses(self.cur, order_by='date', desc=True, limit=5))))
+        plan = ' '.join(row[-1] for row in self.cur.execute(f'EXPLAIN QUERY PLAN {cash_on_hand_api._SELECT_CASH_AND_RECENT}', [5]))
+        self.assertIn('expenses_by_date', plan, 'Recent expenses should be read from the date index.')
+
     def test_set_cash_amt(self) -> None:
         target_amount: float = float(randint(1,1000))
         #Check that set_cash_amount has no return value
@@ -173,7 +255,7 @@ class DatabaseTests(unittest.TestCase):
         self.assertEqual(cash_on_hand_api.add_category(self.db, self.cur, 'Generic', '#330033'),
                          None,
                          'add_category should not return a value.')
-        self.assertEqual(self.cur.execute('SELECT * FROM categories WHERE name="Generic" AND color="#330033"').fetchone(),
+        self.assertEqual(self.cur.execute('SELECT name, color FROM categories WHERE name="Generic" AND color="#330033"').fetchone(),
                          ('Generic', '#330033'),
                          'Category was not added successfully.')
         
@@ -189,7 +271,7 @@ class DatabaseTests(unittest.TestCase):
         self.assertEqual(cash_on_hand_api.update_category(self.db, self.cur, 1, 'Drinks', '#AA0011'),
                          None,
                          'update_category should not return a value.')
-        self.assertEqual(self.cur.execute('SELECT * FROM categories WHERE name="Drinks" AND color="#AA0011"').fetchone(),
+        self.assertEqual(self.cur.execute('SELECT name, color FROM categories WHERE name="Drinks" AND color="#AA0011"').fetchone(),
                          ('Drinks', '#AA0011'),
                          'Updated category entry not found.')
         self.assertEqual(self.cur.execute('SELECT * FROM categories WHERE name="Food" AND color="#004400"').fetchone(),
@@ -206,31 +288,84 @@ class DatabaseTests(unittest.TestCase):
         self.assertEqual(self.cur.execute('SELECT cash FROM finance WHERE ROWID=1').fetchone()[0],
                          0.00,
                          'cash value in the finance table should be 0.00 after reset.')
-        self.assertEqual(self.cur.execute('SELECT * FROM categories').fetchall(),
+        self.assertEqual(self.cur.execute('SELECT name, color FROM categories').fetchall(),
                          [tuple(item) for item in self.default_cats],
                          'Table "categories" should be reset to the default categories list after a reset.')
         
     def test_batch_category_update(self) -> None:
-        target_amount = len(self.cur.execute('SELECT * FROM expenses WHERE category="Food"').fetchall())
+        target_amount = len(self.cur.execute('SELECT * FROM expense_details WHERE category="Food"').fetchall())
         self.assertEqual(cash_on_hand_api.batch_category_update(self.db, self.cur, 'Food', 'Other', '#AAAA00'),
                          None,
                          'batch_category_update should not return a value.')
-        self.assertEqual(len(self.cur.execute('SELECT * FROM expenses WHERE category="Other" AND color="#AAAA00"').fetchall()),
+        self.assertEqual(len(self.cur.execute('SELECT * FROM expense_details WHERE category="Other" AND color="#AAAA00"').fetchall()),
                          target_amount,
                          'Number of final expenses of category "Other" differs from number of expenses of original category "Food".')
-        self.assertEqual(self.cur.execute('SELECT * FROM expenses WHERE category="Food"').fetchall(),
+        self.assertEqual(self.cur.execute('SELECT * FROM expense_details WHERE category="Food"').fetchall(),
                          [],
                          'Items of original category "Food" were not changed.')
         
+    def test_category_rename_is_single_row(self) -> None:
+        #Renaming or recoloring a category should only change its row in the categories table
+        seq = cash_on_hand_api.get_journal_seq(self.cur)
+        cash_on_hand_api.batch_category_update(self.db, self.cur, 'Food', 'Groceries', '#00AA00')
+        cash_on_hand_api.update_expense_category_color(self.db, self.cur, 'Groceries', '#00BB00')
+        self.assertEqual([(change.table, change.action) for change in cash_on_hand_api.changes_since(self.cur, seq)],
+                         [('categories', 'update')] * 3, 'Rename and recolor should only update the category row.')
+        self.assertEqual([cash_on_hand_api.get_expense(self.cur, expense_id) for expense_id in [1, 2, 4]],
+                         [cash_on_hand_api.Expense('Groceries', '01/01/2021', 42.50, 'Weekly Groceries', '#00BB00'),
+                          cash_on_hand_api.Expense('Groceries', '09/12/2020', 350.12, 'Way too much pizza', '#00BB00'),
+                          cash_on_hand_api.Expense('Groceries', '09/09/1900', 10.00, 'Monthly Groceries', '#00BB00')],
+                         'Expenses should show the renamed and recolored category.')
+        #Moving expenses into a category that already exists merges them into it
+        cash_on_hand_api.update_expense_category_group(self.db, self.cur, 'DEMO_CAT', 'Bills')
+        self.assertEqual(cash_on_hand_api.search_by_category(self.cur, 'Bills'), [3, 5, 6], 'Expenses were not merged into "Bills".')
+        self.assertEqual(cash_on_hand_api.get_expense(self.cur, 5).color, '#660000', 'Merged expenses should use the color of "Bills".')
+
+    def test_delete_category_keeps_expenses(self) -> None:
+        cash_on_hand_api.delete_category(self.db, self.cur, cash_on_hand_api.get_category_id(self.cur, 'Food'))
+        #Expenses of a deleted category become uncategorized instead of pointing at a missing category
+        self.assertEqual(cash_on_hand_api.get_expense(self.cur, 1),
+                         cash_on_hand_api.Expense('', '01/01/2021', 42.50, 'Weekly Groceries', '#000000'),
+                         'Expenses of a deleted category should become uncategorized.')
+        self.assertEqual(cash_on_hand_api.search_by_category(self.cur, ''), [1, 2, 4], 'Uncategorized expenses were not found.')
+        self.assertEqual(cash_on_hand_api.get_category_totals(self.cur, 2021, 1),
+                         {'': 42.50},
+                         'Summary tables should list the uncategorized expenses.')
+        #Uncategorized expenses sort before every category
+        self.assertEqual([expense.expense_id for expense in cash_on_hand_api.query_expenses(self.cur, order_by='category', desc=True)],
+                         [6, 5, 3, 1, 2, 4],
+                         'Uncategorized expenses should sort before every category.')
+        pages = []
+        last = None
+        while page := list(cash_on_hand_api.query_expenses(self.cur, order_by='category', limit=4, after=last)):
+            pages += page
+            last = page[-1]
+        self.assertEqual([expense.expense_id for expense in pages], [4, 2, 1, 3, 5, 6], 'Paging by category skipped or repeated expenses.')
+
+    def test_category_order_uses_indexes(self) -> None:
+        #Sorting by category name, date and id should follow indexes instead of sorting every expense,
+        #even in a new database that has no statistics for the query planner yet
+        db, cur = cash_on_hand_api.sql_connect(':memory:')
+        cash_on_hand_api.init_db(db, cur, [['Food', '#004400'], ['Bills', '#660000']])
+        #The query query_expenses(order_by='category') runs for the named categories, with the limit
+        #bound or written out: a small written-out limit tempted the planner into sorting every expense
+        for direction, limit in product(['ASC', 'DESC'], ['LIMIT ?', 'LIMIT 10', '']):
+            plan = ' '.join(row[-1] for row in cur.execute(f'EXPLAIN QUERY PLAN {cash_on_hand_api._SELECT_NAMED_EXPENSES} '
+                                                           f'ORDER BY c.name {direction}, e.day {direction}, e.id {direction} {limit}',
+                                                           [50] if '?' in limit else []))
+            self.assertIn('expenses_by_category_date', plan, 'Expenses should be read by category from the index.')
+            self.assertNotIn('TEMP B-TREE', plan, 'Expenses sorted by category should not need a sort.')
+        db.close()
+
     def test_category_sorting(self) -> None:
         self.maxDiff = None
-        sorted_order = [('Bills', '5/5/2020', 600.0, 'Rent', '#660000'),
-                        ('DEMO_CAT', '1/1/1111', 11.11, 'TEST_DUPES', '#111111'),
-                        ('DEMO_CAT', '1/1/1111', 11.11, 'TEST_DUPES', '#111111'),
-                        ('Food', '1/1/2021', 42.5, 'Weekly Groceries', '#004400'),
-                        ('Food', '9/12/2020', 350.12, 'Way too much pizza', '#004400'),
-                        ('Food', '9/9/1900', 10.0, 'Monthly Groceries', '#004400')]
-        expenses_list = self.cur.execute('SELECT * FROM expenses').fetchall()
+        sorted_order = [cash_on_hand_api.Expense('Bills', '05/05/2020', 600.0, 'Rent', '#660000'),
+                        cash_on_hand_api.Expense('DEMO_CAT', '01/01/1111', 11.11, 'TEST_DUPES', '#111111'),
+                        cash_on_hand_api.Expense('DEMO_CAT', '01/01/1111', 11.11, 'TEST_DUPES', '#111111'),
+                        cash_on_hand_api.Expense('Food', '01/01/2021', 42.5, 'Weekly Groceries', '#004400'),
+                        cash_on_hand_api.Expense('Food', '09/12/2020', 350.12, 'Way too much pizza', '#004400'),
+                        cash_on_hand_api.Expense('Food', '09/09/1900', 10.0, 'Monthly Groceries', '#004400')]
+        expenses_list = cash_on_hand_api.get_all_expenses(self.cur)
         expenses_list = cash_on_hand_api.expenses_sort_list_by_category(expenses_list)
         #Test that sorting by category returns expenses sorted alphabetically A-Z
         self.assertEqual(expenses_list,
@@ -238,12 +373,12 @@ class DatabaseTests(unittest.TestCase):
                          'Expenses list should be sorted by category alphabetically.')
         #Descending sort will not be exactly the reverse of the original sort order as subsorting
         #is determined by index 1
-        sorted_order = [('Food', '1/1/2021', 42.5, 'Weekly Groceries', '#004400'),
-                        ('Food', '9/12/2020', 350.12, 'Way too much pizza', '#004400'),
-                        ('Food', '9/9/1900', 10.0, 'Monthly Groceries', '#004400'),
-                        ('DEMO_CAT', '1/1/1111', 11.11, 'TEST_DUPES', '#111111'),
-                        ('DEMO_CAT', '1/1/1111', 11.11, 'TEST_DUPES', '#111111'),
-                        ('Bills', '5/5/2020', 600.0, 'Rent', '#660000')]
+        sorted_order = [cash_on_hand_api.Expense('Food', '01/01/2021', 42.5, 'Weekly Groceries', '#004400'),
+                        cash_on_hand_api.Expense('Food', '09/12/2020', 350.12, 'Way too much pizza', '#004400'),
+                        cash_on_hand_api.Expense('Food', '09/09/1900', 10.0, 'Monthly Groceries', '#004400'),
+                        cash_on_hand_api.Expense('DEMO_CAT', '01/01/1111', 11.11, 'TEST_DUPES', '#111111'),
+                        cash_on_hand_api.Expense('DEMO_CAT', '01/01/1111', 11.11, 'TEST_DUPES', '#111111'),
+                        cash_on_hand_api.Expense('Bills', '05/05/2020', 600.0, 'Rent', '#660000')]
         expenses_list = cash_on_hand_api.expenses_sort_list_by_category(expenses_list, desc=True)
         #Test that sorting by descending alphabetical returns expenses sorted alphabetically Z-A
         self.assertEqual(expenses_list,
@@ -252,13 +387,13 @@ class DatabaseTests(unittest.TestCase):
         
     def test_date_sorting(self) -> None:
         self.maxDiff = None
-        sorted_order = [('DEMO_CAT', '1/1/1111', 11.11, 'TEST_DUPES', '#111111'),
-                        ('DEMO_CAT', '1/1/1111', 11.11, 'TEST_DUPES', '#111111'),
-                        ('Food', '9/9/1900', 10.00, 'Monthly Groceries', '#004400'),
-                        ('Bills', '5/5/2020', 600.00, 'Rent', '#660000'),
-                        ('Food', '9/12/2020', 350.12, 'Way too much pizza', '#004400'),
-                        ('Food', '1/1/2021', 42.50, 'Weekly Groceries', '#004400')]
-        expenses_list = self.cur.execute('SELECT * FROM expenses').fetchall()
+        sorted_order = [cash_on_hand_api.Expense('DEMO_CAT', '01/01/1111', 11.11, 'TEST_DUPES', '#111111'),
+                        cash_on_hand_api.Expense('DEMO_CAT', '01/01/1111', 11.11, 'TEST_DUPES', '#111111'),
+                        cash_on_hand_api.Expense('Food', '09/09/1900', 10.00, 'Monthly Groceries', '#004400'),
+                        cash_on_hand_api.Expense('Bills', '05/05/2020', 600.00, 'Rent', '#660000'),
+                        cash_on_hand_api.Expense('Food', '09/12/2020', 350.12, 'Way too much pizza', '#004400'),
+                        cash_on_hand_api.Expense('Food', '01/01/2021', 42.50, 'Weekly Groceries', '#004400')]
+        expenses_list = cash_on_hand_api.get_all_expenses(self.cur)
         expenses_list = cash_on_hand_api.expenses_sort_list_by_date(expenses_list)
         #Test that sorting by date sorts all expenses by date, oldest to newest
         self.assertEqual(expenses_list,
@@ -273,13 +408,13 @@ class DatabaseTests(unittest.TestCase):
         
     def test_cost_sorting(self) -> None:
         self.maxDiff = None
-        sorted_order = [('Food', '9/9/1900', 10.00, 'Monthly Groceries', '#004400'),
-                        ('DEMO_CAT', '1/1/1111', 11.11, 'TEST_DUPES', '#111111'),
-                        ('DEMO_CAT', '1/1/1111', 11.11, 'TEST_DUPES', '#111111'),
-                        ('Food', '1/1/2021', 42.50, 'Weekly Groceries', '#004400'),
-                        ('Food', '9/12/2020', 350.12, 'Way too much pizza', '#004400'),
-                        ('Bills', '5/5/2020', 600.00, 'Rent', '#660000')]
-        expenses_list = self.cur.execute('SELECT * FROM expenses').fetchall()
+        sorted_order = [cash_on_hand_api.Expense('Food', '09/09/1900', 10.00, 'Monthly Groceries', '#004400'),
+                        cash_on_hand_api.Expense('DEMO_CAT', '01/01/1111', 11.11, 'TEST_DUPES', '#111111'),
+                        cash_on_hand_api.Expense('DEMO_CAT', '01/01/1111', 11.11, 'TEST_DUPES', '#111111'),
+                        cash_on_hand_api.Expense('Food', '01/01/2021', 42.50, 'Weekly Groceries', '#004400'),
+                        cash_on_hand_api.Expense('Food', '09/12/2020', 350.12, 'Way too much pizza', '#004400'),
+                        cash_on_hand_api.Expense('Bills', '05/05/2020', 600.00, 'Rent', '#660000')]
+        expenses_list = cash_on_hand_api.get_all_expenses(self.cur)
         expenses_list = cash_on_hand_api.expenses_sort_list_by_cost(expenses_list)
         #Test sorting in ascending cost order
         self.assertEqual(expenses_list,
@@ -290,4 +425,999 @@ class DatabaseTests(unittest.TestCase):
         #Test sorting in descending cost order
         self.assertEqual(expenses_list,
                          sorted_order,
-                         'Expensses should be sorted based on cost, from greatest to least.')
\ No newline at end of file
+                         'Expensses should be sorted based on cost, from greatest to least.')
+        
+    def test_query_expenses(self) -> None:
+        #Sorting in SQL should give the same order as the list sorting helpers
+        for order_by, sort_list in [('date', cash_on_hand_api.expenses_sort_list_by_date),
+                                    ('amount', cash_on_hand_api.expenses_sort_list_by_cost)]:
+            for desc in [False, True]:
+                self.assertEqual(list(cash_on_hand_api.query_expenses(self.cur, order_by=order_by, desc=desc)),
+                                 sort_list(cash_on_hand_api.get_all_expenses(self.cur), desc=desc),
+                                 f'query_expenses(order_by={order_by!r}, desc={desc}) returned the wrong order.')
+        #Category order is sub-sorted by date
+        self.assertEqual([expense.expense_id for expense in cash_on_hand_api.query_expenses(self.cur, order_by='category')],
+                         [3, 5, 6, 4, 2, 1],
+                         'Expenses should be sorted by category, then by date.')
+        with self.assertRaises(ValueError):
+            cash_on_hand_api.query_expenses(self.cur, order_by='color')
+
+    def test_query_expenses_pagination(self) -> None:
+        #Paging through with a page size of 2 should visit every expense exactly once, including
+        #the duplicates that share the same date, amount and category.
+        for order_by in ['date', 'amount', 'category']:
+            for desc in [False, True]:
+                expected = list(cash_on_hand_api.query_expenses(self.cur, order_by=order_by, desc=desc))
+                pages = []
+                last = None
+                while page := list(cash_on_hand_api.query_expenses(self.cur, order_by=order_by, desc=desc, limit=2, after=last)):
+                    pages += page
+                    last = page[-1]
+                self.assertEqual([expense.expense_id for expense in pages],
+                                 [expense.expense_id for expense in expected],
+                                 f'Paging by {order_by!r} (desc={desc}) skipped or repeated expenses.')
+
+    def test_expense_batch(self) -> None:
+        #A batch should hold the same expenses as query_expenses, and sort like the list helpers
+        batch = cash_on_hand_api.query_expense_batch(self.cur, order_by='category', desc=True)
+        self.assertEqual(list(batch), list(cash_on_hand_api.query_expenses(self.cur, order_by='category', desc=True)))
+        self.assertEqual(len(batch.categories), 3, 'Each category should be stored once.')
+        for sort_list in [cash_on_hand_api.expenses_sort_list_by_category,
+                          cash_on_hand_api.expenses_sort_list_by_date,
+                          cash_on_hand_api.expenses_sort_list_by_cost]:
+            for desc in [False, True]:
+                self.assertEqual([expense.expense_id for expense in sort_list(batch, desc)],
+                                 [expense.expense_id for expense in sort_list(list(batch), desc)],
+                                 f'{sort_list.__name__}(desc={desc}) sorted a batch differently from a list.')
+        #Slicing, indexing and filtering
+        self.assertIsInstance(batch[1:3], cash_on_hand_api.ExpenseBatch)
+        self.assertEqual(list(batch[1:3]), [batch[1], batch[2]])
+        self.assertEqual(batch[-1], batch[len(batch) - 1])
+        with self.assertRaises(IndexError):
+            batch[len(batch)]
+        self.assertEqual(sorted(expense.expense_id for expense in batch.filter(start='1/1/2020', max_amount=400)), [1, 2])
+        self.assertEqual(sorted(expense.expense_id for expense in batch.filter(category='DEMO_CAT')), [5, 6])
+        self.assertEqual(len(batch.filter(category='Missing')), 0)
+        expenses = cash_on_hand_api.get_all_expenses(self.cur)
+        self.assertEqual(list(cash_on_hand_api.ExpenseBatch.from_expenses(expenses)), expenses)
+        #Expenses are immutable
+        with self.assertRaises(AttributeError):
+            expenses[0].amount = 1.0
+
+    def test_bulk_expense_addition(self) -> None:
+        expenses = (cash_on_hand_api.Expense('Food', f'1/{day}/2022', float(day), f'Lunch {day}', '#004400') for day in range(1, 29))
+        result = cash_on_hand_api.add_expenses(self.db, self.cur, expenses, batch_size=10)
+        self.assertEqual(result,
+                         cash_on_hand_api.BulkInsertResult(inserted=28, rejected=0),
+                         'All 28 expenses should be reported as inserted.')
+        self.assertEqual(len(self.cur.execute('SELECT * FROM expenses WHERE title LIKE "Lunch %"').fetchall()),
+                         28,
+                         'Bulk added expenses were not found in the database.')
+        #Entries that are not valid expenses should be rejected without stopping the rest of the batch
+        result = cash_on_hand_api.add_expenses(self.db, self.cur,
+                                               [cash_on_hand_api.Expense('Food', '2/1/2022', 'Poodle'),
+                                                ('Food', '2/1/2022', 1.00),
+                                                cash_on_hand_api.Expense('Food', '2/1/2022', 3.00, 'Coffee')])
+        self.assertEqual(result,
+                         cash_on_hand_api.BulkInsertResult(inserted=1, rejected=2),
+                         'Invalid entries should be counted as rejected.')
+
+    def test_failed_batch_is_rolled_back(self) -> None:
+        #A row that fails in the middle of a batch must not leave the rows before it to the next commit
+        count = len(cash_on_hand_api.get_all_expenses(self.cur))
+        with self.assertRaises(sqlite3.Error):
+            cash_on_hand_api.add_expenses(self.db, self.cur, [cash_on_hand_api.Expense('Food', '3/1/2022', 1.00, 'Tea'),
+                                                              cash_on_hand_api.Expense('Toys', '3/2/2022', 2.00, 'Ball'),
+                                                              cash_on_hand_api.Expense('Food', '3/3/2022', 3.00, ['Not a title'])])
+        self.assertFalse(self.db.in_transaction, 'No transaction should be left open.')
+        with self.assertRaises(sqlite3.Error):
+            cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Toys', '3/3/2022', 3.00, ['Not a title']))
+        self.assertFalse(self.db.in_transaction, 'No transaction should be left open.')
+        cash_on_hand_api.set_cash_amount(self.db, self.cur, 10.00)
+        self.assertEqual(len(cash_on_hand_api.get_all_expenses(self.cur)), count, 'No rows of the failed batch should be saved.')
+        self.assertFalse(cash_on_hand_api.is_duplicate_category(self.cur, 'Toys'), 'Categories of the failed batch should not be saved.')
+
+    def test_unit_of_work(self) -> None:
+        #Changes made inside a unit of work should be committed together when it exits
+        with cash_on_hand_api.unit_of_work(self.db):
+            cash_on_hand_api.update_expense(self.db, self.cur, 1,
+                                            cash_on_hand_api.Expense('Food', '1/1/2021', 1.00, 'Snack', '#004400'))
+            cash_on_hand_api.delete_expense(self.db, self.cur, 2)
+            self.assertTrue(self.db.in_transaction, 'Changes should not be committed before the unit of work exits.')
+        self.assertFalse(self.db.in_transaction, 'Changes should be committed when the unit of work exits.')
+        #Changes made inside a unit of work that raises should be rolled back
+        with self.assertRaises(ValueError):
+            with cash_on_hand_api.unit_of_work(self.db):
+                cash_on_hand_api.delete_expense(self.db, self.cur, 1)
+                cash_on_hand_api.delete_category(self.db, self.cur, 1)
+                raise ValueError
+        self.assertEqual(cash_on_hand_api.get_expense(self.cur, 1).title,
+                         'Snack',
+                         'Expense deleted in a failed unit of work should be restored.')
+        self.assertEqual(cash_on_hand_api.get_category_id(self.cur, 'Food'),
+                         1,
+                         'Category deleted in a failed unit of work should be restored.')
+
+
+class MigrationTests(unittest.TestCase):
+    #Build a database in memory using the original, unversioned schema
+    def setUp(self) -> None:
+        self.db, self.cur = cash_on_hand_api.sql_connect(':memory:')
+        self.cur.execute('CREATE TABLE expenses(category, date, amount, title, color)')
+        self.cur.execute('CREATE TABLE finance(cash)')
+        self.cur.execute('INSERT INTO finance VALUES(125.00)')
+        self.cur.execute('CREATE TABLE categories(name, color)')
+        self.cur.execute('INSERT INTO categories VALUES("Food", "#004400")')
+        self.cur.execute('INSERT INTO expenses VALUES("Food", "1/1/2021", 42.50, "Weekly Groceries", "#004400")')
+        self.cur.execute('INSERT INTO expenses VALUES("Food", "not a date", 0.1, "Gum", "#004400")')
+        self.cur.execute('INSERT INTO expenses VALUES("Food", "9/12/2020", 350.12, "Way too much pizza", "#004400")')
+        self.db.commit()
+
+    def tearDown(self) -> None:
+        if self.db:
+            self.db.close()
+
+    def test_legacy_migration(self) -> None:
+        self.assertEqual(cash_on_hand_api.get_schema_version(self.cur), 0, 'Legacy databases should report version 0.')
+        cash_on_hand_api.init_db(self.db, self.cur, [['Bills', '#660000']])
+        self.assertEqual(cash_on_hand_api.get_schema_version(self.cur),
+                         len(cash_on_hand_api._MIGRATIONS),
+                         'init_db should migrate to the latest schema version.')
+        #Existing rows keep their ROWIDs and values, unreadable dates fall back to 1/1/1
+        self.assertEqual(cash_on_hand_api.get_all_expenses(self.cur),
+                         [cash_on_hand_api.Expense('Food', '01/01/2021', 42.50, 'Weekly Groceries', '#004400'),
+                          cash_on_hand_api.Expense('Food', '01/01/0001', 0.10, 'Gum', '#004400'),
+                          cash_on_hand_api.Expense('Food', '09/12/2020', 350.12, 'Way too much pizza', '#004400')],
+                         'Legacy expenses were not converted correctly.')
+        self.assertEqual(cash_on_hand_api.find_expense_id(self.cur, cash_on_hand_api.Expense('Food', '9/12/2020', 350.12, 'Way too much pizza', '#004400')),
+                         3,
+                         'Migrated expenses should keep their ROWIDs.')
+        self.assertEqual([expense.expense_id for expense in cash_on_hand_api.search_expenses(self.cur, 'piz')], [3],
+                         'Migrated expenses should be found by search.')
+        #Existing databases should not get default categories or a second finance row
+        self.assertEqual(self.cur.execute('SELECT name, color FROM categories').fetchall(),
+                         [('Food', '#004400')],
+                         'Default categories should only be added to new databases.')
+        self.assertEqual(cash_on_hand_api.get_cash_amount(self.cur), 125.00, 'Cash amount should survive the migration.')
+        #Running init_db again on an up to date database should change nothing
+        cash_on_hand_api.init_db(self.db, self.cur, [['Bills', '#660000']])
+        self.assertEqual(len(cash_on_hand_api.get_all_expenses(self.cur)), 3, 'Re-running init_db should not alter expenses.')
+        self.assertEqual(self.cur.execute('SELECT COUNT(*) FROM finance').fetchone()[0], 1, 'Re-running init_db should not add finance rows.')
+
+    def test_legacy_null_category(self) -> None:
+        #Legacy rows without a category become uncategorized instead of a category named 'None'
+        self.cur.execute('INSERT INTO expenses VALUES(NULL, "9/13/2020", 2.00, NULL, NULL)')
+        self.db.commit()
+        cash_on_hand_api.init_db(self.db, self.cur, [])
+        self.assertEqual(cash_on_hand_api.get_all_expenses(self.cur)[-1], cash_on_hand_api.Expense('', '09/13/2020', 2.00))
+        self.assertFalse(cash_on_hand_api.is_duplicate_category(self.cur, 'None'), 'No category should be made from NULL.')
+
+    def test_migration_uses_indexes(self) -> None:
+        cash_on_hand_api.init_db(self.db, self.cur, [])
+        plan = ' '.join(row[-1] for row in self.cur.execute('EXPLAIN QUERY PLAN SELECT ROWID FROM expenses WHERE category_id=? AND day>?', [1, 0]))
+        self.assertIn('expenses_by_category_date', plan, 'Category and date lookups should use an index.')
+
+
+class AggregateTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db, self.cur = cash_on_hand_api.sql_connect(':memory:')
+        cash_on_hand_api.init_db(self.db, self.cur, [['Food', '#004400'], ['Bills', '#660000']])
+        cash_on_hand_api.add_expenses(self.db, self.cur,
+                                      [cash_on_hand_api.Expense('Food', '1/1/2021', 42.50, 'Weekly Groceries', '#004400'),
+                                       cash_on_hand_api.Expense('Food', '1/20/2021', 7.25, 'Lunch', '#004400'),
+                                       cash_on_hand_api.Expense('Bills', '1/31/2021', 600.00, 'Rent', '#660000'),
+                                       cash_on_hand_api.Expense('Food', '2/3/2021', 10.00, 'Snacks', '#004400'),
+                                       cash_on_hand_api.Expense('Bills', '12/31/2020', 80.10, 'Power', '#660000')])
+
+    def tearDown(self) -> None:
+        if self.db:
+            self.db.close()
+
+    def test_category_totals(self) -> None:
+        self.assertEqual(cash_on_hand_api.get_category_totals(self.cur, 2021, 1),
+                         {'Bills': 600.00, 'Food': 49.75},
+                         'Category totals for January 2021 are incorrect.')
+        self.assertEqual(cash_on_hand_api.get_month_total(self.cur, 2021, 2), 10.00, 'Total for February 2021 is incorrect.')
+        self.assertEqual(cash_on_hand_api.get_month_total(self.cur, 2021, 3), 0.0, 'Months without expenses should total 0.')
+
+    def test_totals_follow_changes(self) -> None:
+        cash_on_hand_api.update_expense(self.db, self.cur, 2, cash_on_hand_api.Expense('Bills', '2/20/2021', 7.25, 'Phone', '#660000'))
+        cash_on_hand_api.delete_expense(self.db, self.cur, 1)
+        cash_on_hand_api.batch_category_update(self.db, self.cur, 'Food', 'Groceries', '#00AA00')
+        self.assertEqual(cash_on_hand_api.get_category_totals(self.cur, 2021, 1),
+                         {'Bills': 600.00},
+                         'Category totals were not updated after expenses changed.')
+        self.assertEqual(cash_on_hand_api.get_category_totals(self.cur, 2021, 2),
+                         {'Bills': 7.25, 'Groceries': 10.00},
+                         'Category totals were not updated after expenses changed.')
+        self.assertEqual(cash_on_hand_api.check_aggregates(self.cur), [], 'Summary tables should match the expenses table.')
+
+    def test_running_total(self) -> None:
+        self.assertEqual(cash_on_hand_api.get_running_total(self.cur, '12/30/2020'), 0.0, 'Nothing was spent before 12/31/2020.')
+        self.assertEqual(cash_on_hand_api.get_running_total(self.cur, '1/20/2021'), 129.85, 'Running total through 1/20/2021 is incorrect.')
+        self.assertEqual(cash_on_hand_api.get_running_total(self.cur, '2/3/2021'), 739.85, 'Running total through 2/3/2021 is incorrect.')
+        with self.assertRaises(ValueError):
+            cash_on_hand_api.get_running_total(self.cur, 'Poodle')
+
+    def test_check_and_rebuild(self) -> None:
+        self.assertEqual(cash_on_hand_api.check_aggregates(self.cur), [], 'Summary tables should match the expenses table.')
+        self.cur.execute('UPDATE day_totals SET cents=0')
+        self.assertEqual(cash_on_hand_api.check_aggregates(self.cur), ['day_totals'], 'Tampered summary table was not detected.')
+        cash_on_hand_api.rebuild_aggregates(self.db, self.cur)
+        self.assertEqual(cash_on_hand_api.check_aggregates(self.cur), [], 'Summary tables should match after a rebuild.')
+
+
+class RecurringTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db, self.cur = cash_on_hand_api.sql_connect(':memory:')
+        cash_on_hand_api.init_db(self.db, self.cur, [['Food', '#004400'], ['Bills', '#660000']])
+        self.rent = cash_on_hand_api.add_recurring_rule(self.db, self.cur,
+                                                        cash_on_hand_api.RecurringRule('Bills', 600.00, 'Rent', 'monthly', '1/31/2021'))
+        cash_on_hand_api.add_recurring_rule(self.db, self.cur,
+                                            cash_on_hand_api.RecurringRule('Food', 10.00, 'Monthly Groceries', 'weekly', '1/1/2021',
+                                                                           interval=2, end='2/28/2021'))
+
+    def tearDown(self) -> None:
+        if self.db:
+            self.db.close()
+
+    def dates(self, title: str) -> list[str]:
+        return [expense.date for expense in cash_on_hand_api.query_expenses(self.cur) if expense.title == title]
+
+    def test_catch_up_is_idempotent(self) -> None:
+        self.assertEqual(cash_on_hand_api.add_recurring_expenses(self.db, self.cur, '4/30/2021'), 9)
+        self.assertEqual(self.dates('Rent'), ['01/31/2021', '02/28/2021', '03/31/2021', '04/30/2021'],
+                         'Monthly rules should fall on the last day of shorter months.')
+        self.assertEqual(self.dates('Monthly Groceries'), ['01/01/2021', '01/15/2021', '01/29/2021', '02/12/2021', '02/26/2021'],
+                         'Every other week until the end date.')
+        self.assertEqual(cash_on_hand_api.add_recurring_expenses(self.db, self.cur, '4/30/2021'), 0,
+                         'Running again should not add anything twice.')
+        self.assertEqual(cash_on_hand_api.add_recurring_expenses(self.db, self.cur, '5/31/2021'), 1)
+        self.assertEqual(cash_on_hand_api.check_aggregates(self.cur), [], 'Totals should include recurring expenses.')
+        rules = cash_on_hand_api.get_recurring_rules(self.cur)
+        self.assertEqual([rule.next_date for rule in rules], ['06/30/2021', None])
+
+    def test_rules(self) -> None:
+        with self.assertRaises(ValueError):
+            cash_on_hand_api.add_recurring_rule(self.db, self.cur, cash_on_hand_api.RecurringRule('Food', 1.0, '', 'hourly', '1/1/2021'))
+        with self.assertRaises(ValueError):
+            cash_on_hand_api.add_recurring_rule(self.db, self.cur, cash_on_hand_api.RecurringRule('Food', 1.0, '', 'daily', '1/1/2021', interval=0))
+        cash_on_hand_api.delete_recurring_rule(self.db, self.cur, self.rent)
+        cash_on_hand_api.add_recurring_expenses(self.db, self.cur, '4/30/2021')
+        self.assertEqual(self.dates('Rent'), [], 'Deleted rules should not add expenses.')
+        cash_on_hand_api.reset_db(self.db, self.cur, [])
+        self.assertEqual(cash_on_hand_api.get_recurring_rules(self.cur), [], 'Reset should delete the recurring rules.')
+
+
+class JournalTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db, self.cur = cash_on_hand_api.sql_connect(':memory:')
+        cash_on_hand_api.init_db(self.db, self.cur, [['Food', '#004400'], ['Bills', '#660000']])
+        cash_on_hand_api.add_expenses(self.db, self.cur,
+                                      [cash_on_hand_api.Expense('Food', '1/1/2021', 42.50, 'Weekly Groceries'),
+                                       cash_on_hand_api.Expense('Bills', '1/31/2021', 600.00, 'Rent')])
+
+    def tearDown(self) -> None:
+        if self.db:
+            self.db.close()
+
+    def snapshot(self) -> tuple:
+        return (cash_on_hand_api.get_all_expenses(self.cur), cash_on_hand_api.get_categories(self.cur),
+                cash_on_hand_api.get_cash_amount(self.cur))
+
+    def test_changes_since(self) -> None:
+        seq = cash_on_hand_api.get_journal_seq(self.cur)
+        cash_on_hand_api.update_expense(self.db, self.cur, 1, cash_on_hand_api.Expense('Food', '1/2/2021', 40.00, 'Weekly Groceries'))
+        cash_on_hand_api.delete_expense(self.db, self.cur, 2)
+        cash_on_hand_api.set_cash_amount(self.db, self.cur, 25.00)
+        changes = list(cash_on_hand_api.changes_since(self.cur, seq))
+        self.assertEqual([(change.table, change.row_id, change.action) for change in changes],
+                         [('expenses', 1, 'update'), ('expenses', 2, 'delete'), ('finance', 1, 'update')])
+        self.assertEqual([change.seq for change in changes], list(range(seq + 1, seq + 4)), 'Sequence numbers should count up.')
+        self.assertEqual((changes[0].old['cents'], changes[0].new['cents']), (4250, 4000))
+        self.assertEqual(len({change.group for change in changes}), 3, 'Each commit should be its own group.')
+        self.assertEqual(list(cash_on_hand_api.changes_since(self.cur, changes[-1].seq)), [])
+
+    def test_undo_and_redo(self) -> None:
+        states = [self.snapshot()]
+        cash_on_hand_api.set_cash_amount(self.db, self.cur, 25.00)
+        states.append(self.snapshot())
+        cash_on_hand_api.delete_category(self.db, self.cur, cash_on_hand_api.get_category_id(self.cur, 'Food'))
+        states.append(self.snapshot())
+        cash_on_hand_api.update_expense(self.db, self.cur, 2, cash_on_hand_api.Expense('Bills', '2/1/2021', 650.00, 'Rent'))
+        states.append(self.snapshot())
+        for state in reversed(states[:-1]):
+            self.assertGreater(cash_on_hand_api.undo(self.db, self.cur), 0)
+            self.assertEqual(self.snapshot(), state, 'Undo should restore the state before each change.')
+        self.assertEqual(cash_on_hand_api.redo(self.db, self.cur), 1)
+        self.assertEqual(cash_on_hand_api.redo(self.db, self.cur), 2, 'The category and its expense should come back together.')
+        self.assertEqual(self.snapshot(), states[2])
+        self.assertEqual(cash_on_hand_api.check_aggregates(self.cur), [], 'Totals should follow undo and redo.')
+        cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('', '3/1/2021', 1.00, 'Gum'))
+        self.assertEqual(cash_on_hand_api.redo(self.db, self.cur), 0, 'A new change should end redo.')
+        self.assertEqual(len(cash_on_hand_api.search_expenses(self.cur, 'gum')), 1)
+        cash_on_hand_api.undo(self.db, self.cur)
+        self.assertEqual(cash_on_hand_api.search_expenses(self.cur, 'gum'), [], 'Search should follow undo.')
+
+    def test_unjournaled_bulk_insert(self) -> None:
+        seq = cash_on_hand_api.get_journal_seq(self.cur)
+        triggers = self.cur.execute("SELECT name, sql FROM sqlite_master WHERE type='trigger' ORDER BY name").fetchall()
+        result = cash_on_hand_api.add_expenses(self.db, self.cur, [cash_on_hand_api.Expense('Food', f'2/{day}/2021', 5.00, 'Lunch')
+                                                                   for day in range(1, 11)], batch_size=4, journal=False)
+        self.assertEqual(result.inserted, 10)
+        self.assertEqual(cash_on_hand_api.get_journal_seq(self.cur), seq, 'Expenses added without journal should not be journaled.')
+        self.assertEqual(self.cur.execute("SELECT name, sql FROM sqlite_master WHERE type='trigger' ORDER BY name").fetchall(), triggers,
+                         'The journal triggers should be put back.')
+        self.assertEqual(cash_on_hand_api.check_aggregates(self.cur), [], 'Totals should still be kept.')
+        cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', '3/1/2021', 1.00, 'Gum'))
+        self.assertEqual(cash_on_hand_api.undo(self.db, self.cur), 1, 'Later changes should be journaled again.')
+        self.assertEqual(len(cash_on_hand_api.search_expenses(self.cur, 'lunch')), 10, 'Unjournaled expenses cannot be undone.')
+
+    def test_compaction_and_reset(self) -> None:
+        for amount in range(5):
+            cash_on_hand_api.set_cash_amount(self.db, self.cur, float(amount))
+        self.assertEqual(cash_on_hand_api.compact_journal(self.db, self.cur, keep=2), 7)
+        with self.assertRaises(ValueError):
+            cash_on_hand_api.changes_since(self.cur, 0)
+        self.assertEqual(len(list(cash_on_hand_api.changes_since(self.cur, cash_on_hand_api.get_journal_seq(self.cur) - 2))), 2)
+        cash_on_hand_api.undo(self.db, self.cur)
+        cash_on_hand_api.undo(self.db, self.cur)
+        self.assertEqual(cash_on_hand_api.get_cash_amount(self.cur), 2.0)
+        self.assertEqual(cash_on_hand_api.undo(self.db, self.cur), 0, 'Compacted commits cannot be undone.')
+        seq = cash_on_hand_api.get_journal_seq(self.cur)
+        cash_on_hand_api.reset_db(self.db, self.cur, [])
+        with self.assertRaises(ValueError):
+            cash_on_hand_api.changes_since(self.cur, seq)
+        self.assertEqual(cash_on_hand_api.undo(self.db, self.cur), 0, 'A reset should not be undone.')
+
+
+class LookupCacheTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db, self.cur = cash_on_hand_api.sql_connect(':memory:')
+        cash_on_hand_api.init_db(self.db, self.cur, [['Food', '#004400'], ['Bills', '#660000']])
+
+    def tearDown(self) -> None:
+        self.db.close()
+
+    def test_hits_and_misses(self) -> None:
+        stats = cash_on_hand_api.get_cache_stats(self.cur)
+        for _ in range(10):
+            self.assertTrue(cash_on_hand_api.is_duplicate_category(self.cur, 'Food'))
+            self.assertEqual(cash_on_hand_api.get_category_id(self.cur, 'Bills'), 2)
+            self.assertEqual(cash_on_hand_api.get_category_color(self.cur, 'Bills'), '#660000')
+            self.assertEqual(cash_on_hand_api.get_cash_amount(self.cur), 0.0)
+        after = cash_on_hand_api.get_cache_stats(self.cur)
+        self.assertEqual((after.misses - stats.misses, after.hits - stats.hits), (2, 38),
+                         'Categories and cash should each be read from the database once.')
+        self.assertEqual(cash_on_hand_api.get_categories(self.cur), {'Food': '#004400', 'Bills': '#660000'},
+                         'get_categories should list every category in the order they were added.')
+        self.assertEqual((cash_on_hand_api.get_category_id(self.cur, 'Tires'), cash_on_hand_api.get_category_color(self.cur, 'Tires')),
+                         (-1, None), 'Missing categories should not be found.')
+
+    @mock.patch.object(cash_on_hand_api, 'LOOKUP_CHECK_SECONDS', 0)
+    def test_other_connections_invalidate(self) -> None:
+        #Commits made by another connection to the same file, as another process would, are noticed
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'expenses.db')
+            first_db, first_cur = cash_on_hand_api.sql_connect(path)
+            cash_on_hand_api.init_db(first_db, first_cur, [['Food', '#004400']])
+            second_db, second_cur = cash_on_hand_api.sql_connect(path)
+            self.assertFalse(cash_on_hand_api.is_duplicate_category(first_cur, 'Fuel'))
+            self.assertEqual(cash_on_hand_api.get_cash_amount(first_cur), 0.0)
+            cash_on_hand_api.add_category(second_db, second_cur, 'Fuel', '#444400')
+            cash_on_hand_api.set_cash_amount(second_db, second_cur, 42.00)
+            self.assertTrue(cash_on_hand_api.is_duplicate_category(first_cur, 'Fuel'), 'A category added elsewhere should be seen.')
+            self.assertEqual(cash_on_hand_api.get_cash_amount(first_cur), 42.00, 'Cash set elsewhere should be seen.')
+            stats = cash_on_hand_api.get_cache_stats(first_cur)
+            cash_on_hand_api.get_cash_amount(first_cur)
+            self.assertEqual(cash_on_hand_api.get_cache_stats(first_cur).hits, stats.hits + 1, 'Without new commits the cache should be used.')
+            second_db.close()
+            first_db.close()
+
+    @mock.patch.object(cash_on_hand_api, 'LOOKUP_CHECK_SECONDS', 0)
+    def test_hits_survive_expense_writes(self) -> None:
+        #Expenses added by the writer of a Database leave the readers' cached lookups in place
+        with tempfile.TemporaryDirectory() as folder:
+            database = cash_on_hand_api.Database(os.path.join(folder, 'expenses.db'))
+            database.init_db([['Food', '#004400']])
+            database.is_duplicate_category('Food')
+            database.get_cash_amount()
+            stats = database.get_cache_stats()
+            for day in range(1, 11):
+                database.add_expense(cash_on_hand_api.Expense('Food', f'1/{day}/2021', 5.00))
+                self.assertTrue(database.is_duplicate_category('Food'))
+                self.assertEqual(database.get_cash_amount(), 0.0)
+            after = database.get_cache_stats()
+            self.assertEqual((after.misses - stats.misses, after.hits - stats.hits), (0, 20),
+                             'Writes to expenses should not clear the cache.')
+            database.close()
+
+    def test_writes_invalidate(self) -> None:
+        changes = [(lambda: cash_on_hand_api.add_category(self.db, self.cur, 'Fuel', '#444400'),
+                    lambda: cash_on_hand_api.is_duplicate_category(self.cur, 'Fuel')),
+                   (lambda: cash_on_hand_api.update_category(self.db, self.cur, 3, 'Gas', '#444444'),
+                    lambda: cash_on_hand_api.get_category_color(self.cur, 'Gas') == '#444444'),
+                   (lambda: cash_on_hand_api.delete_category(self.db, self.cur, 3),
+                    lambda: cash_on_hand_api.get_category_id(self.cur, 'Gas') == -1),
+                   (lambda: cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Toys', '1/1/2021', 5.00)),
+                    lambda: cash_on_hand_api.is_duplicate_category(self.cur, 'Toys')),
+                   (lambda: cash_on_hand_api.set_cash_amount(self.db, self.cur, 42.00),
+                    lambda: cash_on_hand_api.get_cash_amount(self.cur) == 42.00),
+                   (lambda: cash_on_hand_api.reset_db(self.db, self.cur, [['Food', '#004400']]),
+                    lambda: not cash_on_hand_api.is_duplicate_category(self.cur, 'Toys') and cash_on_hand_api.get_cash_amount(self.cur) == 0)]
+        for change, check in changes:
+            #Fill the cache, then make sure the change is seen
+            cash_on_hand_api.get_categories(self.cur)
+            cash_on_hand_api.get_cash_amount(self.cur)
+            change()
+            self.assertTrue(check(), 'The cache was not invalidated by a write.')
+
+    def test_uncommitted_changes_stay_out_of_the_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as folder:
+            database = cash_on_hand_api.Database(os.path.join(folder, 'expenses.db'))
+            database.init_db([['Food', '#004400']])
+            self.assertFalse(database.is_duplicate_category('Fuel'))
+            with database.writer() as (_db, _cur):
+                cash_on_hand_api.add_category(_db, _cur, 'Fuel', '#444400')
+                self.assertTrue(cash_on_hand_api.is_duplicate_category(_cur, 'Fuel'), 'The writer should see its own changes.')
+                self.assertFalse(database.is_duplicate_category('Fuel'), 'Readers should not see uncommitted categories.')
+            self.assertTrue(database.is_duplicate_category('Fuel'), 'Readers should see committed categories.')
+            with self.assertRaises(ZeroDivisionError):
+                with database.writer() as (_db, _cur):
+                    cash_on_hand_api.set_cash_amount(_db, _cur, 10.00)
+                    1 / 0
+            self.assertEqual(database.get_cash_amount(), 0.0, 'Rolled back changes should not be cached.')
+            database.close()
+
+class MaintenanceTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'expenses.db')
+        self.db, self.cur = cash_on_hand_api.sql_connect(self.path)
+        cash_on_hand_api.init_db(self.db, self.cur, [['Food', '#004400'], ['Bills', '#660000']])
+        cash_on_hand_api.add_expenses(self.db, self.cur,
+                                      [cash_on_hand_api.Expense(['Food', 'Bills', ''][number % 3], f'{number % 12 + 1}/1/{2019 + number % 4}',
+                                                                number + 0.5, f'Expense {number}')
+                                       for number in range(400)])
+
+    def tearDown(self) -> None:
+        self.db.close()
+        self.temp_dir.cleanup()
+
+    def test_archive(self) -> None:
+        archive_path = os.path.join(self.temp_dir.name, 'archive.db')
+        progress = []
+        moved = cash_on_hand_api.archive_expenses(self.db, self.cur, archive_path, '1/1/2021', batch_size=30,
+                                                  progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual(moved, 200, 'Expenses from 2019 and 2020 should be moved.')
+        self.assertEqual(progress[-1], (200, 200), 'Progress should end at the total.')
+        self.assertEqual(len(progress), 7, 'Expenses should be moved in batches.')
+        self.assertGreaterEqual(self.cur.execute('SELECT MIN(day) FROM expenses').fetchone()[0],
+                         cash_on_hand_api.date_to_day('1/1/2021'), 'Archived expenses should be removed.')
+        self.assertEqual(cash_on_hand_api.check_aggregates(self.cur), [], 'Totals should only count the remaining expenses.')
+        archive_db, archive_cur = cash_on_hand_api.sql_connect(archive_path)
+        self.assertEqual(archive_cur.execute('SELECT category, COUNT(*) FROM expense_details GROUP BY 1 ORDER BY 1').fetchall(),
+                         [('', 66), ('Bills', 67), ('Food', 67)], 'Archived expenses should keep their categories.')
+        self.assertEqual(cash_on_hand_api.check_aggregates(archive_cur), [], 'Archive totals should match its expenses.')
+        cash_on_hand_api.add_expense(archive_db, archive_cur, cash_on_hand_api.Expense('Food', '6/1/2020', 5.00, 'Lunch'))
+        self.assertEqual(cash_on_hand_api.undo(archive_db, archive_cur), 1, 'Undo in the archive should only revert the later change.')
+        while cash_on_hand_api.undo(archive_db, archive_cur):
+            pass
+        self.assertEqual(archive_cur.execute('SELECT COUNT(*) FROM expenses').fetchone()[0], 200, 'Archiving should not be an undo step in the archive.')
+        archive_db.close()
+        seq = cash_on_hand_api.get_journal_seq(self.cur)
+        self.assertEqual(cash_on_hand_api.archive_expenses(self.db, self.cur, archive_path, '1/1/2022', journal=False), 100)
+        self.assertEqual(cash_on_hand_api.get_journal_seq(self.cur), seq, 'An archive without journal should not be journaled.')
+        with self.assertRaises(ValueError):
+            cash_on_hand_api.archive_expenses(self.db, self.cur, archive_path, 'Poodle')
+
+    def test_archive_in_unit_of_work(self) -> None:
+        archive_path = os.path.join(self.temp_dir.name, 'archive.db')
+        count = self.cur.execute('SELECT COUNT(*) FROM expenses').fetchone()[0]
+        with cash_on_hand_api.unit_of_work(self.db):
+            cash_on_hand_api.set_cash_amount(self.db, self.cur, 12.00)
+            with self.assertRaises(ValueError):
+                cash_on_hand_api.archive_expenses(self.db, self.cur, archive_path, '1/1/2021')
+        self.assertEqual(cash_on_hand_api.get_cash_amount(self.cur), 12.00, 'The unit of work should still be committed.')
+        self.assertEqual(self.cur.execute('SELECT COUNT(*) FROM expenses').fetchone()[0], count, 'Nothing should be archived.')
+        self.assertFalse(os.path.exists(archive_path), 'No archive should be made.')
+
+    def test_reset_in_writer(self) -> None:
+        #reset_db() inside a unit of work cannot turn foreign keys back on until the unit commits
+        database = cash_on_hand_api.Database(os.path.join(self.temp_dir.name, 'writer.db'))
+        database.init_db([['Food', '#004400']])
+        with database.writer() as (_db, _cur):
+            cash_on_hand_api.add_expense(_db, _cur, cash_on_hand_api.Expense('Food', '1/1/2021', 5.00))
+        with database.writer() as (_db, _cur):
+            cash_on_hand_api.reset_db(_db, _cur, [['Bills', '#440000']])
+            cash_on_hand_api.add_category(_db, _cur, 'Fuel', '#444400')
+        with database.writer() as (_db, _cur):
+            self.assertEqual(_cur.execute('PRAGMA foreign_keys').fetchone()[0], 1, 'Foreign keys should be enforced again.')
+            self.assertEqual(_cur.execute('SELECT COUNT(*) FROM expenses').fetchone()[0], 0, 'Expenses should be deleted.')
+        self.assertEqual(database.get_categories(), {'Bills': '#440000', 'Fuel': '#444400'}, 'The reset should be committed with the unit.')
+        database.close()
+
+    def test_reset_and_reclaim(self) -> None:
+        cash_on_hand_api.reset_db(self.db, self.cur, [['Food', '#004400']])
+        self.assertEqual(self.cur.execute('SELECT COUNT(*) FROM expenses').fetchone()[0], 0, 'Expenses should be deleted.')
+        self.assertEqual(self.cur.execute('PRAGMA foreign_keys').fetchone()[0], 1, 'Foreign keys should be enforced again.')
+        cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', '1/1/2021', 5.00, 'Lunch'))
+        self.assertEqual(cash_on_hand_api.check_aggregates(self.cur), [], 'Triggers should still work after a reset.')
+        self.assertEqual(len(cash_on_hand_api.search_expenses(self.cur, 'lunch')), 1, 'Search should still work after a reset.')
+        self.assertGreater(self.cur.execute('PRAGMA freelist_count').fetchone()[0], 0, 'Reset should leave free pages.')
+        while cash_on_hand_api.reclaim_space(self.db, self.cur, max_pages=5):
+            pass
+        self.assertEqual(self.cur.execute('PRAGMA freelist_count').fetchone()[0], 0, 'reclaim_space should free every page.')
+
+    def test_database_reset_swaps_file(self) -> None:
+        database = cash_on_hand_api.Database(self.path)
+        self.assertEqual(len(database.search_by_category('Food')), 134)
+        token = database.get_data_version()[0]
+        database.reset([['Pets', '#440044']])
+        self.assertEqual(database.search_by_category('Pets'), [-1], 'The new file should have no expenses.')
+        self.assertEqual(database.get_categories(), {'Pets': '#440044'}, 'The new file should have the default categories.')
+        self.assertNotEqual(database.get_data_version()[0], token, 'The new file should invalidate cached results.')
+        database.add_expense(cash_on_hand_api.Expense('Pets', '1/1/2021', 5.00))
+        self.assertEqual(database.search_by_category('Pets'), [1], 'Readers should see the new file.')
+        database.close()
+
+    def test_database_reset_keeps_journal_seq(self) -> None:
+        #Readers following changes_since() must learn that the changes they had not read are gone
+        database = cash_on_hand_api.Database(self.path)
+        seq = database.call(cash_on_hand_api.get_journal_seq)
+        database.set_cash_amount(1.00)
+        database.reset([])
+        with self.assertRaises(ValueError):
+            database.call(cash_on_hand_api.changes_since, seq)
+        database.set_cash_amount(2.00)
+        self.assertGreater(database.call(cash_on_hand_api.get_journal_seq), seq + 1, 'Sequence numbers should carry on.')
+        with self.assertRaises(ValueError):
+            database.call(cash_on_hand_api.changes_since, seq)
+        database.close()
+
+class ExportImportTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db, self.cur = cash_on_hand_api.sql_connect(':memory:')
+        cash_on_hand_api.init_db(self.db, self.cur, [['Food', '#004400'], ['Bills', '#660000']])
+        cash_on_hand_api.add_expenses(self.db, self.cur,
+                                      [cash_on_hand_api.Expense('Food', '1/1/2021', 42.50, 'Weekly Groceries, "organic"', '#004400'),
+                                       cash_on_hand_api.Expense('Bills', '5/5/2020', 600.00, 'Rent', '#660000'),
+                                       cash_on_hand_api.Expense('Food', '9/9/1900', 0.05, 'Gum\nand mints', '#004400')])
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        if self.db:
+            self.db.close()
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self) -> None:
+        for file_name in ['expenses.csv', 'expenses.jsonl']:
+            path = os.path.join(self.temp_dir.name, file_name)
+            progress = []
+            self.assertEqual(cash_on_hand_io.export_expenses(self.cur, path, progress=lambda done, total: progress.append((done, total))),
+                             3,
+                             f'Exporting to {file_name} should write every expense.')
+            self.assertEqual(progress[-1], (3, 3), 'Export progress should end at the total number of expenses.')
+            db, cur = cash_on_hand_api.sql_connect(':memory:')
+            cash_on_hand_api.init_db(db, cur, [])
+            self.assertEqual(cash_on_hand_io.import_expenses(db, cur, path),
+                             cash_on_hand_api.BulkInsertResult(inserted=3),
+                             f'Importing {file_name} should add every expense.')
+            self.assertEqual(cash_on_hand_api.get_all_expenses(cur),
+                             cash_on_hand_api.get_all_expenses(self.cur),
+                             f'Expenses imported from {file_name} differ from the exported ones.')
+            db.close()
+
+    def test_import_validation_and_duplicates(self) -> None:
+        path = os.path.join(self.temp_dir.name, 'import.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            file.write('date,amount,category,title\n'
+                       '5/5/2020,600.00,Bills,Rent\n'
+                       '2/30/2021,5.00,Food,Lunch\n'
+                       '3/1/2021,lots,Food,Dinner\n'
+                       '3/1/2021,7.25,Pet Supplies,Treats\n'
+                       '03/01/2021,7.25,Pet Supplies,Treats\n')
+        progress = []
+        result = cash_on_hand_io.import_expenses(self.db, self.cur, path, progress=lambda done, total: progress.append((done, total)))
+        #The rent expense already exists, and the last row repeats the one before it
+        self.assertEqual(result,
+                         cash_on_hand_api.BulkInsertResult(inserted=1, rejected=2, duplicates=2),
+                         'Import should skip duplicates and reject invalid dates and amounts.')
+        self.assertEqual(cash_on_hand_api.search_by_category(self.cur, 'Pet Supplies'), [4], 'Valid imported expense was not added.')
+        self.assertEqual(progress[-1], (os.path.getsize(path), os.path.getsize(path)), 'Import progress should end at the file size.')
+        #Without skipping duplicates, every valid row is added again
+        result = cash_on_hand_io.import_expenses(self.db, self.cur, path, skip_duplicates=False)
+        self.assertEqual(result, cash_on_hand_api.BulkInsertResult(inserted=3, rejected=2), 'Duplicates should be added when not skipped.')
+
+    def test_import_rejects_unstorable_amounts(self) -> None:
+        #Amounts that are not finite or too large to store are rejected like any invalid row
+        csv_path = os.path.join(self.temp_dir.name, 'import.csv')
+        with open(csv_path, 'w', newline='', encoding='utf-8') as file:
+            file.write('date,amount,category,title\n'
+                       '4/1/2021,nan,Food,Lunch\n'
+                       '4/2/2021,1.50,Food,Gum\n'
+                       '4/3/2021,inf,Food,Dinner\n'
+                       '4/4/2021,-inf,Food,Dinner\n'
+                       '4/5/2021,1e20,Food,Dinner\n')
+        jsonl_path = os.path.join(self.temp_dir.name, 'import.jsonl')
+        with open(jsonl_path, 'w', encoding='utf-8') as file:
+            file.write('{"date": "4/6/2021", "amount": NaN, "category": "Food"}\n'
+                       '{"date": "4/7/2021", "amount": Infinity, "category": "Food"}\n'
+                       '{"date": "4/8/2021", "amount": 1e20, "category": "Food"}\n'
+                       '{"date": "4/9/2021", "amount": 2.5, "category": "Food", "title": "Tea"}\n')
+        self.assertEqual(cash_on_hand_io.import_expenses(self.db, self.cur, csv_path),
+                         cash_on_hand_api.BulkInsertResult(inserted=1, rejected=4))
+        self.assertEqual(cash_on_hand_io.import_expenses(self.db, self.cur, jsonl_path),
+                         cash_on_hand_api.BulkInsertResult(inserted=1, rejected=3))
+        self.assertEqual([expense.title for expense in cash_on_hand_api.get_all_expenses(self.cur)[-2:]], ['Gum', 'Tea'])
+        with self.assertRaises(ValueError):
+            cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', '4/1/2021', float('nan')))
+
+    def test_import_requires_columns(self) -> None:
+        path = os.path.join(self.temp_dir.name, 'import.csv')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('name,price\nPizza,12.00\n')
+        with self.assertRaises(ValueError):
+            cash_on_hand_io.import_expenses(self.db, self.cur, path)
+
+
+class ConnectionTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.database = cash_on_hand_api.Database(os.path.join(self.temp_dir.name, 'expenses.db'))
+        self.database.init_db([['Food', '#004400']])
+
+    def tearDown(self) -> None:
+        self.database.close()
+        self.temp_dir.cleanup()
+
+    def test_connection_settings(self) -> None:
+        _db, _cur = self.database.reader()
+        self.assertEqual(_cur.execute('PRAGMA journal_mode').fetchone()[0], 'wal', 'Database files should use WAL mode.')
+        self.assertEqual(_cur.execute('PRAGMA synchronous').fetchone()[0], 1, 'synchronous should be NORMAL.')
+        self.assertEqual(_cur.execute('PRAGMA foreign_keys').fetchone()[0], 1, 'Foreign keys should be enforced.')
+        with self.assertRaises(AttributeError):
+            self.database.str_to_date('1/1/2021')
+        with self.assertRaises(AttributeError):
+            self.database.unit_of_work()
+
+    def test_methods(self) -> None:
+        self.assertEqual(self.database.add_expense(cash_on_hand_api.Expense('Food', '1/1/2021', 42.50, 'Groceries', '#004400')),
+                         None,
+                         'Database.add_expense should not return anything.')
+        self.database.set_cash_amount(20.00)
+        self.assertEqual(self.database.get_cash_amount(), 20.00, 'Reads should see committed writes.')
+        self.assertEqual([expense.title for expense in self.database.query_expenses(limit=5)],
+                         ['Groceries'],
+                         'Database.query_expenses did not return the added expense.')
+        #Changes made through writer() are only visible to readers once the block exits
+        with self.database.writer() as (_db, _cur):
+            cash_on_hand_api.set_cash_amount(_db, _cur, 5.00)
+            self.assertEqual(self.database.get_cash_amount(), 20.00, 'Uncommitted writes should not be visible to readers.')
+        self.assertEqual(self.database.get_cash_amount(), 5.00, 'Writes should be visible after writer() exits.')
+        #Functions from other modules can be run on the database's connections as well
+        path = os.path.join(self.temp_dir.name, 'export.csv')
+        self.assertEqual(self.database.call(cash_on_hand_io.export_expenses, path), 1, 'Database.call did not run the export.')
+        self.assertEqual(self.database.call(cash_on_hand_io.import_expenses, path, skip_duplicates=False).inserted,
+                         1,
+                         'Database.call did not run the import.')
+
+    def test_threads(self) -> None:
+        #Each thread reads through its own connection while other threads write
+        errors = []
+        def work(number: int) -> None:
+            try:
+                for day in range(1, 21):
+                    self.database.add_expense(cash_on_hand_api.Expense('Food', f'{number}/{day}/2021', 1.00, f'Thread {number}'))
+                    self.database.get_cash_amount()
+                    self.database.search_by_category('Food')
+            except Exception as error:
+                errors.append(error)
+        threads = [threading.Thread(target=work, args=[number]) for number in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [], 'Concurrent reads and writes should not fail.')
+        self.assertEqual(len(self.database.search_by_category('Food')), 80, 'Every expense written by the threads should be saved.')
+        self.assertGreater(len(self.database._readers), 1, 'Each thread should get its own read connection.')
+
+    def test_in_memory(self) -> None:
+        database = cash_on_hand_api.Database(':memory:')
+        database.init_db([['Food', '#004400']])
+        database.add_expense(cash_on_hand_api.Expense('Food', '1/1/2021', 1.00))
+        self.assertEqual(database.search_by_category('Food'), [1], 'In-memory databases should read through the write connection.')
+        database.close()
+
+
+class DataServiceTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.database = cash_on_hand_api.Database(os.path.join(self.temp_dir.name, 'expenses.db'))
+        self.database.init_db([['Food', '#004400']])
+        self.events = queue.Queue()
+        self.service = cash_on_hand_service.DataService(self.database, lambda event, value: self.events.put((event, value)))
+
+    def tearDown(self) -> None:
+        self.service.close()
+        self.database.close()
+        self.temp_dir.cleanup()
+
+    def test_jobs_post_results(self) -> None:
+        self.service.submit('ADDED', cash_on_hand_api.add_expense, cash_on_hand_api.Expense('Food', '1/1/2021', 5.00))
+        self.service.submit('FOUND', cash_on_hand_api.search_by_category, 'Food')
+        self.service.submit('FAILED', cash_on_hand_api.add_expense, cash_on_hand_api.Expense('Food', 'Poodle', 5.00))
+        self.assertEqual(self.events.get(timeout=5), ('ADDED', None), 'Write job result was not posted.')
+        self.assertEqual(self.events.get(timeout=5), ('FOUND', [1]), 'Read job should see the earlier write.')
+        event, value = self.events.get(timeout=5)
+        self.assertEqual(event, 'FAILED', 'Failed job should still post its event.')
+        self.assertIsInstance(value, ValueError, 'Failed job should post the exception it raised.')
+
+    def test_coalescer(self) -> None:
+        flushed = queue.Queue()
+        coalescer = cash_on_hand_service.Coalescer(0.05, flushed.put)
+        for amount in [1, 5, 10, 5]:
+            coalescer.add(amount)
+        self.assertEqual(coalescer.pending, 21, 'Quick presses should add up.')
+        self.assertEqual(flushed.get(timeout=5), 21, 'Quick presses should be written once, as their total.')
+        coalescer.add(20)
+        coalescer.flush()
+        self.assertEqual(flushed.get_nowait(), 20, 'flush() should write the pending total immediately.')
+        coalescer.flush()
+        self.assertTrue(flushed.empty(), 'flush() without a pending total should not write.')
+        #Without a delay, presses are only written by flush()
+        coalescer = cash_on_hand_service.Coalescer(None, flushed.put)
+        coalescer.add(5)
+        coalescer.add(10)
+        with self.assertRaises(queue.Empty):
+            flushed.get(timeout=0.2)
+        coalescer.flush()
+        self.assertEqual(flushed.get_nowait(), 15, 'flush() should write the presses added up.')
+
+    def test_changed_values(self) -> None:
+        shown = {}
+        self.assertEqual(cash_on_hand_service.changed_values(shown, {'CASH': '$5.00', 'RECENT1': 'Rent'}),
+                         {'CASH': '$5.00', 'RECENT1': 'Rent'},
+                         'Every value should be updated the first time.')
+        self.assertEqual(cash_on_hand_service.changed_values(shown, {'CASH': '$5.00', 'RECENT1': 'Lunch'}),
+                         {'RECENT1': 'Lunch'},
+                         'Only changed values should be updated.')
+
+class BenchmarkTests(unittest.TestCase):
+    def test_generator(self) -> None:
+        expenses = list(cash_on_hand_bench.generate_expenses(2000, seed=7, duplicate_rate=0.1))
+        self.assertEqual(expenses, list(cash_on_hand_bench.generate_expenses(2000, seed=7, duplicate_rate=0.1)),
+                         'The same seed should generate the same expenses.')
+        self.assertNotEqual(expenses, list(cash_on_hand_bench.generate_expenses(2000, seed=8, duplicate_rate=0.1)),
+                            'Different seeds should generate different expenses.')
+        counts = {name: sum(expense.category == name for expense in expenses) for name, _ in cash_on_hand_bench.BENCH_CATEGORIES}
+        self.assertGreater(counts['Food'], 3 * counts['Medical'], 'Categories should be skewed towards the first ones.')
+        distinct = {(expense.category, expense.date, expense.amount, expense.title) for expense in expenses}
+        self.assertLess(len(distinct), 1950, 'Some generated expenses should be duplicates.')
+        self.assertTrue(all(cash_on_hand_api.date_to_day(expense.date) and expense.amount > 0 for expense in expenses),
+                        'Generated expenses should be valid.')
+
+    def test_run_and_save(self) -> None:
+        with tempfile.TemporaryDirectory() as folder:
+            results = cash_on_hand_bench.run_benchmarks([300], ['memory', 'disk'], samples=10, directory=folder)
+            path = os.path.join(folder, 'results.json')
+            cash_on_hand_bench.save_results(path, results, 0)
+            self.assertEqual(cash_on_hand_bench.load_results(path), results, 'Saved results should load back unchanged.')
+        names = [result.name for result in results if result.storage == 'disk']
+        self.assertEqual(names, [result.name for result in results if result.storage == 'memory'],
+                         'Both storages should run the same benchmarks.')
+        self.assertIn('reset_db', names, 'reset_db should be benchmarked.')
+        load = results[0]
+        self.assertEqual((load.name, load.items), ('add_expenses', 300), 'The load should count every row.')
+        self.assertTrue(all(result.p50_ms <= result.p95_ms <= result.p99_ms <= result.max_ms for result in results),
+                        'Percentiles should be in order.')
+        ratios = cash_on_hand_bench.compare_results(results, results)
+        self.assertTrue(ratios and all(ratio == 1 for *_, ratio in ratios), 'A run compared with itself should not change.')
+
+class AccountsTests(unittest.TestCase):
+    #Several account files, each filled with its own generated expenses
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.accounts = cash_on_hand_accounts.Accounts()
+        self.all_expenses = []
+        for seed, name in enumerate(['Wallet', 'Checking', 'Savings']):
+            expenses = list(cash_on_hand_bench.generate_expenses(3000, seed=seed, days=365))
+            database = self.accounts.add(name, os.path.join(self.temp_dir.name, f'{name}.db'), cash_on_hand_bench.BENCH_CATEGORIES)
+            database.add_expenses(expenses, batch_size=3000)
+            database.set_cash_amount(10.0 * (seed + 1))
+            self.all_expenses += [(name, expense) for expense in expenses]
+
+    def tearDown(self) -> None:
+        self.accounts.close()
+        self.temp_dir.cleanup()
+
+    def test_totals(self) -> None:
+        self.assertEqual(self.accounts.names(), ['Wallet', 'Checking', 'Savings'])
+        self.assertEqual(self.accounts.get_cash_amount(), 60.0)
+        january = [expense for _, expense in self.all_expenses if expense.date.startswith('01/')]
+        self.assertAlmostEqual(self.accounts.get_month_total(2015, 1), sum(expense.amount for expense in january), places=2)
+        totals = self.accounts.get_category_totals(2015, 1)
+        self.assertAlmostEqual(totals['Food'], sum(expense.amount for expense in january if expense.category == 'Food'), places=2)
+        self.assertEqual(self.accounts.call(cash_on_hand_api.get_month_total, 2015, 1, accounts=['Savings']).keys(), {'Savings'})
+        with self.assertRaises(ValueError):
+            self.accounts.get_running_total('Poodle')
+
+    def test_merged_queries(self) -> None:
+        for order_by, key in [('date', lambda item: cash_on_hand_api.date_to_day(item[1].date)),
+                              ('amount', lambda item: item[1].amount)]:
+            for desc in [False, True]:
+                merged = self.accounts.query_expenses(order_by, desc, limit=200)
+                self.assertEqual(len(merged), 200)
+                self.assertEqual([key(item) for item in merged], sorted(map(key, self.all_expenses), reverse=desc)[:200],
+                                 f'Merged {order_by!r} order (desc={desc}) is wrong.')
+        found = self.accounts.search_expenses('rent', order_by='date', limit=20)
+        self.assertTrue(found and all(expense.title == 'Rent' for _, expense in found), 'Search should find the rent in every account.')
+        days = [cash_on_hand_api.date_to_day(expense.date) for _, expense in found]
+        self.assertEqual(days, sorted(days, reverse=True), 'Search results should be merged newest first.')
+        by_rank = self.accounts.search_expenses('rent', limit=6)
+        self.assertEqual([name for name, _ in by_rank], ['Wallet', 'Checking', 'Savings'] * 2, 'Accounts should take turns.')
+
+    def test_cursor_paging(self) -> None:
+        #Two larger accounts join the fixtures. Paging with cursors should visit every expense once, in
+        #order, while each account is only asked for one page at a time however deep the page is
+        for seed, name in enumerate(['Cards', 'Travel'], start=3):
+            expenses = list(cash_on_hand_bench.generate_expenses(6000, seed=seed, days=365))
+            database = self.accounts.add(name, os.path.join(self.temp_dir.name, f'{name}.db'), cash_on_hand_bench.BENCH_CATEGORIES)
+            database.add_expenses(expenses, batch_size=6000)
+            self.all_expenses += [(name, expense) for expense in expenses]
+        def visit(read_page) -> list:
+            pages, after = [], {}
+            while page := read_page(after):
+                self.assertLessEqual(len(page), 500)
+                pages += page
+                after.update(page)
+            self.assertEqual(len({(name, expense.expense_id) for name, expense in pages}), len(pages), 'An expense was read twice.')
+            return pages
+        with mock.patch.object(cash_on_hand_api, 'query_expenses', wraps=cash_on_hand_api.query_expenses) as query:
+            merged = visit(lambda after: self.accounts.query_expenses('amount', True, limit=500, after=after))
+        self.assertEqual(len(merged), 21000)
+        self.assertEqual([expense.amount for _, expense in merged], sorted((expense.amount for _, expense in self.all_expenses), reverse=True),
+                         'Pages should continue the merged order.')
+        self.assertEqual({call.args[3] for call in query.call_args_list}, {500}, 'Each account should read one page at a time.')
+        #Database.call() needs a function whose parameters it can read, so the search is wrapped in one
+        search_limits = set()
+        search_expenses = cash_on_hand_api.search_expenses
+        def search(_cur, *args):
+            search_limits.add(args[6])
+            return search_expenses(_cur, *args)
+        with mock.patch.object(cash_on_hand_api, 'search_expenses', search):
+            by_date = visit(lambda after: self.accounts.search_expenses('bill', order_by='date', limit=500, after=after))
+            by_rank = visit(lambda after: self.accounts.search_expenses('bill', limit=500, after=after))
+        self.assertEqual(search_limits, {500}, 'Each account should read one page at a time.')
+        days = [cash_on_hand_api.date_to_day(expense.date) for _, expense in by_date]
+        self.assertEqual(days, sorted(days, reverse=True), 'Search pages should continue newest first.')
+        for name in self.accounts.names():
+            expected = [expense.expense_id for expense in self.accounts[name].search_expenses('bill', limit=10000)]
+            self.assertEqual([expense.expense_id for account, expense in by_rank if account == name], expected,
+                             f'{name} results should keep their order by rank.')
+            self.assertEqual(sorted(expense.expense_id for account, expense in by_date if account == name), sorted(expected))
+
+class StatsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        cash_on_hand_stats.enable(slow_ms=1000)
+        self.db, self.cur = cash_on_hand_api.sql_connect(':memory:')
+        cash_on_hand_api.init_db(self.db, self.cur, [['Food', '#004400']])
+        cash_on_hand_stats.reset_stats()
+
+    def tearDown(self) -> None:
+        cash_on_hand_stats.disable()
+        cash_on_hand_stats.reset_stats()
+        self.db.close()
+
+    def test_call_stats(self) -> None:
+        for day in range(1, 4):
+            cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', f'1/{day}/2021', 5.00))
+        cash_on_hand_api.search_by_category(self.cur, 'Food')
+        with self.assertRaises(ValueError):
+            cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', 'Poodle', 5.00))
+        stats = cash_on_hand_stats.get_stats()
+        added = stats['cash_on_hand_api.add_expense']
+        self.assertEqual((added.calls, added.errors, added.commits), (4, 1, 3), 'Calls, errors and commits were not counted.')
+        self.assertEqual(sum(added.histogram), 4, 'Every call should be in the latency histogram.')
+        #Each add_expense runs 6 statements: the category insert, the expense insert and 4 that number
+        #its journal entries as a group. Rows written by triggers are not counted.
+        self.assertEqual(added.statements, 18, 'Only the statements run by add_expense itself should be counted.')
+        self.assertEqual(added.rows_changed, 9, 'The expense, its change group and its journal entry should be counted.')
+        cash_on_hand_api.set_cash_amount(self.db, self.cur, 5.00)
+        cash_on_hand_api.update_category(self.db, self.cur, 1, 'Groceries', '#004400')
+        stats = cash_on_hand_stats.get_stats()
+        self.assertEqual(stats['cash_on_hand_api.set_cash_amount'].rows_changed, 3, 'The cash row and its journal group should be counted.')
+        self.assertEqual(stats['cash_on_hand_api.update_category'].rows_changed, 3, 'The category row and its journal group should be counted.')
+        self.assertEqual(stats['cash_on_hand_api.search_by_category'].rows_returned, 3, 'Returned rows were not counted.')
+        self.assertIn('cash_on_hand_api.add_expense', cash_on_hand_stats.format_stats(stats), 'Stats table is missing a function.')
+        #Instrumented functions still work through a Database
+        database = cash_on_hand_api.Database(':memory:')
+        database.init_db([['Food', '#004400']])
+        database.close()
+        self.assertEqual(cash_on_hand_stats.get_stats()['cash_on_hand_api.init_db'].calls, 1, 'Database calls were not counted.')
+
+    def test_slow_calls_and_disable(self) -> None:
+        cash_on_hand_stats.enable(slow_ms=0)
+        with self.assertLogs('cash_on_hand.stats', 'WARNING') as logs:
+            cash_on_hand_api.find_expense_id(self.cur, cash_on_hand_api.Expense('Food', '1/1/2021', 5.00))
+        self.assertIn('USING INDEX expenses_by_hash', '\n'.join(logs.output), 'Slow calls should be logged with their query plans.')
+        self.assertEqual(cash_on_hand_stats.get_stats()['cash_on_hand_api.find_expense_id'].slow_calls, 1, 'Slow call was not counted.')
+        cash_on_hand_stats.disable()
+        self.assertFalse(hasattr(cash_on_hand_api.add_expense, '__wrapped__'), 'disable() should restore the original functions.')
+
+class AnalyticsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db, self.cur = cash_on_hand_api.sql_connect(':memory:')
+        cash_on_hand_api.init_db(self.db, self.cur, [['Food', '#004400'], ['Bills', '#660000']])
+        cash_on_hand_api.add_expenses(self.db, self.cur,
+                                      [cash_on_hand_api.Expense('Food', '1/4/2021', 10.00),
+                                       cash_on_hand_api.Expense('Food', '1/5/2021', 20.00),
+                                       cash_on_hand_api.Expense('Bills', '1/12/2021', 70.00),
+                                       cash_on_hand_api.Expense('Food', '2/1/2021', 5.00),
+                                       cash_on_hand_api.Expense('Bills', '1/20/2022', 35.00)])
+
+    def tearDown(self) -> None:
+        cash_on_hand_analytics.clear_cache()
+        self.db.close()
+
+    def test_spending_by_period(self) -> None:
+        months = cash_on_hand_analytics.spending_by_period(self.cur, 'month')
+        self.assertEqual([(month.start, month.total, month.count) for month in months],
+                         [('01/01/2021', 100.0, 3), ('02/01/2021', 5.0, 1), ('01/01/2022', 35.0, 1)],
+                         'Monthly totals are wrong.')
+        january = months[0]
+        self.assertEqual((january.mean, january.median), (100 / 3 / 1, 20.0), 'Mean or median is wrong.')
+        self.assertAlmostEqual(january.p90, 60.0, msg='90th percentile should interpolate like numpy.percentile.')
+        self.assertEqual(january.by_category, {'Food': 30.0, 'Bills': 70.0}, 'Category totals are wrong.')
+        self.assertEqual(january.shares, {'Food': 0.3, 'Bills': 0.7}, 'Category shares are wrong.')
+        weeks = cash_on_hand_analytics.spending_by_period(self.cur, 'week', '1/1/2021', '1/31/2021')
+        self.assertEqual([(week.start, week.total) for week in weeks], [('01/04/2021', 30.0), ('01/11/2021', 70.0)],
+                         'Weeks should start on Monday and respect the date range.')
+        self.assertEqual([year.total for year in cash_on_hand_analytics.spending_by_period(self.cur, 'year')], [105.0, 35.0],
+                         'Yearly totals are wrong.')
+        with self.assertRaises(ValueError):
+            cash_on_hand_analytics.spending_by_period(self.cur, 'fortnight')
+
+    def test_rolled_back_results_are_not_cached(self) -> None:
+        #A result computed inside a transaction that is rolled back must not be served later, even
+        #once other changes bring the data version back to the same number
+        with self.assertRaises(ValueError):
+            with cash_on_hand_api.unit_of_work(self.db):
+                cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', '6/1/2023', 100.00))
+                self.assertEqual(cash_on_hand_analytics.spending_by_period(self.cur, 'month', '6/1/2023', '6/30/2023')[0].total, 100.0)
+                raise ValueError
+        cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', '6/2/2023', 1.00))
+        self.assertEqual(cash_on_hand_analytics.spending_by_period(self.cur, 'month', '6/1/2023', '6/30/2023')[0].total, 1.0)
+
+    def test_zero_amount_expense(self) -> None:
+        #A period whose only expense is $0.00 still lists its category, with and without NumPy
+        cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', '6/1/2023', 0.00))
+        for numpy in ([cash_on_hand_analytics.numpy, None] if cash_on_hand_analytics.numpy != None else [None]):
+            cash_on_hand_analytics.clear_cache()
+            with mock.patch.object(cash_on_hand_analytics, 'numpy', numpy):
+                june = cash_on_hand_analytics.spending_by_period(self.cur, 'month', '6/1/2023', '6/30/2023')
+            self.assertEqual([(month.total, month.by_category, month.shares) for month in june],
+                             [(0.0, {'Food': 0.0}, {'Food': 0.0})],
+                             f'Zero amounts should be kept (NumPy: {numpy != None}).')
+
+    def test_rolling_and_year_over_year(self) -> None:
+        rolling = dict(cash_on_hand_analytics.rolling_totals(self.cur, 7, '1/1/2021', '2/28/2021'))
+        self.assertEqual((rolling['01/04/2021'], rolling['01/10/2021'], rolling['01/11/2021'], rolling['01/12/2021']),
+                         (10.0, 30.0, 20.0, 70.0),
+                         'Rolling totals should cover the last window days.')
+        self.assertEqual(len(rolling), 29, 'Rolling totals should cover every day from the first to the last expense.')
+        january = [month for month in cash_on_hand_analytics.year_over_year(self.cur) if month.month == 1]
+        self.assertEqual([(month.year, month.previous_total, month.change) for month in january],
+                         [(2021, 0.0, None), (2022, 100.0, -0.65)],
+                         'Year over year changes are wrong.')
+
+    def test_cache(self) -> None:
+        first = cash_on_hand_analytics.spending_by_period(self.cur, 'month')
+        self.assertIs(cash_on_hand_analytics.spending_by_period(self.cur, 'month'), first,
+                      'Unchanged data should be served from the cache.')
+        cash_on_hand_api.add_expense(self.db, self.cur, cash_on_hand_api.Expense('Food', '2/2/2021', 1.00))
+        self.assertEqual(cash_on_hand_analytics.spending_by_period(self.cur, 'month')[1].total, 6.0,
+                         'Changed data should be recomputed.')
+        cash_on_hand_api.update_category(self.db, self.cur, 1, 'Groceries', '#004400')
+        self.assertIn('Groceries', cash_on_hand_analytics.spending_by_period(self.cur, 'month')[0].by_category,
+                      'Renaming a category should invalidate the cache.')